@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark suite of listing, workplan, download, and process_parallel
+against the offline S3 stand-in (standin.LocalS3) filled with synthetic
+GOES files.
+
+Reported:
+    workplan    time to build the workplan (listing included) and the
+                number of listing requests, cold and with the key index
+    download    throughput of download for different max_concurrency
+    process     rows per second of process_parallel by number of workers
+                (includes the start up of the spawned workers, about a
+                second each)
+
+The stand-in simulates latency (per request) and bandwidth (per request),
+so the effect of concurrency shows up like it would against S3. Runs
+offline (nesdis_aws needs to be installed or on the PYTHONPATH):
+    python benchmarks/bench_suite.py
+    python benchmarks/bench_suite.py --hours 72 --file-size 4000000 --latency 0.05
+"""
+import os
+import time
+import argparse
+import tempfile
+import pathlib as pl
+import pandas as pd
+import nesdis_aws
+import standin
+
+
+def burn(row, seconds = 0.02):
+    """Stand-in process function that keeps one CPU busy for some time."""
+    end = time.perf_counter() + seconds
+    x = 0
+    while time.perf_counter() < end:
+        x += 1
+    return x
+
+
+def make_query(fs, root, start, end, **kwargs):
+    return nesdis_aws.AwsQuery(path2folder_local = root, start = start, end = end, aws = fs, **kwargs)
+
+
+def bench_workplan(path2s3, start, no_of_hours, latency, path2tmp):
+    print('\n#### workplan')
+    print(f'{"case":>28} {"time [s]":>9} {"list requests":>14} {"rows":>7}')
+    end = pd.to_datetime(start) + pd.Timedelta(hours = no_of_hours) - pd.Timedelta('1s')
+    path2index = os.path.join(path2tmp, 'index.db')
+    for case, kwargs in [('no index', {}),
+                         ('index, cold', dict(path2index = path2index)),
+                         ('index, warm', dict(path2index = path2index))]:
+        fs = standin.LocalS3(path2s3, latency = latency)
+        query = make_query(fs, os.path.join(path2tmp, 'raw'), start, end, **kwargs)
+        t0 = time.perf_counter()
+        workplan = query.workplan
+        dt = time.perf_counter() - t0
+        print(f'{case:>28} {dt:>9.3f} {fs.calls.get("list", 0):>14} {workplan.shape[0]:>7}')
+
+
+def bench_download(path2s3, start, no_of_hours, latency, bandwidth, path2tmp, concurrencies):
+    print('\n#### download')
+    print(f'{"max_concurrency":>16} {"files":>6} {"MB":>8} {"time [s]":>9} {"MB/s":>8}')
+    end = pd.to_datetime(start) + pd.Timedelta(hours = no_of_hours) - pd.Timedelta('1s')
+    for max_concurrency in concurrencies:
+        with tempfile.TemporaryDirectory(dir = path2tmp) as path2raw:
+            fs = standin.LocalS3(path2s3, latency = latency, bandwidth = bandwidth)
+            query = make_query(fs, path2raw, start, end)
+            workplan = query.workplan
+            t0 = time.perf_counter()
+            query.download(max_concurrency = max_concurrency, error_if_low_disk_space = False)
+            dt = time.perf_counter() - t0
+            size = sum(f.stat().st_size for f in pl.Path(path2raw).iterdir()) * 1e-6
+            print(f'{str(max_concurrency):>16} {workplan.shape[0]:>6} {size:>8.1f} {dt:>9.2f} {size / dt:>8.1f}')
+
+
+def bench_process(path2s3, start, no_of_hours, path2tmp, workers, seconds_per_row):
+    print('\n#### process_parallel')
+    print(f'{"workers":>8} {"rows":>6} {"time [s]":>9} {"rows/s":>8} {"speedup":>8}')
+    end = pd.to_datetime(start) + pd.Timedelta(hours = no_of_hours) - pd.Timedelta('1s')
+    base = None
+    for no_of_workers in workers:
+        fs = standin.LocalS3(path2s3)
+        query = make_query(fs, os.path.join(path2tmp, 'raw'), start, end)
+        workplan = query.workplan
+        t0 = time.perf_counter()
+        report = query.process_parallel(burn, args = dict(seconds = seconds_per_row), no_of_cpu = no_of_workers, verbose = False)
+        dt = time.perf_counter() - t0
+        assert((report.status == 'success').all())
+        rate = workplan.shape[0] / dt
+        base = base or rate
+        print(f'{no_of_workers:>8} {workplan.shape[0]:>6} {dt:>9.2f} {rate:>8.1f} {rate / base:>8.2f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--hours', type = int, default = 48, help = 'number of hours of synthetic data')
+    parser.add_argument('--files-per-hour', type = int, default = 12)
+    parser.add_argument('--file-size', type = int, default = 2**20, help = 'bytes')
+    parser.add_argument('--latency', type = float, default = 0.02, help = 'seconds per request')
+    parser.add_argument('--bandwidth', type = float, default = 50e6, help = 'bytes per second per request')
+    parser.add_argument('--concurrency', type = str, default = 'None,4,16', help = 'comma separated, None is the serial download')
+    parser.add_argument('--workers', type = str, default = '1,2,4')
+    parser.add_argument('--process-hours', type = int, default = 24, help = 'hours of data used in the process benchmark')
+    parser.add_argument('--seconds-per-row', type = float, default = 0.02, help = 'cpu time of the process function')
+    parser.add_argument('--only', type = str, default = 'workplan,download,process')
+    args = parser.parse_args()
+    only = args.only.split(',')
+    start = '2020-08-08'
+
+    with tempfile.TemporaryDirectory() as path2tmp:
+        path2s3 = os.path.join(path2tmp, 's3')
+        t0 = time.perf_counter()
+        keys = standin.populate(path2s3, start = start, no_of_hours = args.hours,
+                                files_per_hour = args.files_per_hour, file_size = args.file_size)
+        print(f'{len(keys)} synthetic files of {args.file_size * 1e-6:0.1f} MB created in {time.perf_counter() - t0:0.1f} s '
+              f'(latency {args.latency} s, bandwidth {args.bandwidth * 1e-6:0.0f} MB/s per request)')
+        if 'workplan' in only:
+            bench_workplan(path2s3, start, args.hours, args.latency, path2tmp)
+        if 'download' in only:
+            concurrencies = [None if c == 'None' else int(c) for c in args.concurrency.split(',')]
+            bench_download(path2s3, start, args.hours, args.latency, args.bandwidth, path2tmp, concurrencies)
+        if 'process' in only:
+            bench_process(path2s3, start, args.process_hours, path2tmp, [int(w) for w in args.workers.split(',')], args.seconds_per_row)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the workplan construction from a listing.
+
+A synthetic listing of mesoscale like keys (one scan per minute) is turned
+into a workplan with AwsQuery._listing2workplan. For comparison, the former
+row-wise construction (DataFrame.apply and one stat per row) is timed as
+well, but only up to legacy_max keys since it gets very slow.
+
+Nothing is downloaded or listed, this runs offline (nesdis_aws needs to be
+installed or on the PYTHONPATH):
+    python benchmarks/bench_workplan.py
+"""
+import time
+import tempfile
+import pathlib as pl
+import pandas as pd
+import nesdis_aws
+
+
+def synthetic_listing(no_of_keys, start = '2018-01-01', product = 'ABI-L2-AODM1'):
+    times = pd.date_range(start, periods = no_of_keys, freq = 'min')
+    s = times.strftime('%Y%j%H%M%S') + '0'
+    e = (times + pd.Timedelta('50s')).strftime('%Y%j%H%M%S') + '0'
+    folders = times.strftime(f'noaa-goes16/{product}/%Y/%j/%H/')
+    keys = folders + 'OR_' + product + '-M6_G16_s' + s + '_e' + e + '_c' + e + '.nc'
+    return pd.DataFrame({'path2file_aws': keys})
+
+
+def legacy_listing2workplan(query, listing):
+    workplan = pd.DataFrame([pl.Path(f) for f in listing.path2file_aws], columns=['path2file_aws'])
+    workplan['path2file_local'] = workplan.apply(lambda row: query.path2folder_local.joinpath(row.path2file_aws.name), axis = 1)
+    workplan = workplan[~workplan.apply(lambda row: row.path2file_local.is_file(), axis = 1)]
+
+    def row2timestamp(row):
+        sos = row.path2file_aws.name.split('_')[-3]
+        return pd.to_datetime(sos[1:-1],format = '%Y%j%H%M%S')
+
+    workplan.index = workplan.apply(lambda row: row2timestamp(row), axis = 1)
+    workplan = workplan.sort_index()
+    return workplan.truncate(query.start, query.end)
+
+
+def main(sizes = (1000, 10000, 100000, 1000000), legacy_max = 100000):
+    print(f'{"no of keys":>12} {"vectorized [s]":>15} {"legacy [s]":>12}')
+    for no_of_keys in sizes:
+        listing = synthetic_listing(no_of_keys)
+        with tempfile.TemporaryDirectory() as path2folder_local:
+            query = nesdis_aws.AwsQuery(path2folder_local = path2folder_local,
+                                        product = 'ABI-L2-AOD', scan_sector = 'M1',
+                                        start = '2000-01-01', end = '2100-01-01')
+            # a few files already on disk so the existence filter has something to do
+            for key in listing.path2file_aws.iloc[::max(1, no_of_keys // 10)]:
+                pl.Path(path2folder_local).joinpath(key.split('/')[-1]).touch()
+
+            t0 = time.perf_counter()
+            workplan = query._listing2workplan(listing)
+            dt_vec = time.perf_counter() - t0
+
+            dt_leg = float('nan')
+            if no_of_keys <= legacy_max:
+                t0 = time.perf_counter()
+                workplan_legacy = legacy_listing2workplan(query, listing)
+                dt_leg = time.perf_counter() - t0
+                assert(workplan.index.equals(workplan_legacy.index))
+        print(f'{no_of_keys:>12} {dt_vec:>15.3f} {dt_leg:>12.3f}')
+
+
+if __name__ == '__main__':
+    main()
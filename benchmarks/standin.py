@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+Offline stand-in for the NOAA buckets on S3.
+
+LocalS3 is an async fsspec filesystem over a local directory, so it can be
+used as AwsQuery.aws in place of s3fs. It counts the requests by type and
+can simulate the latency and bandwidth of S3. populate fills a directory
+with synthetic GOES keys in the real layout
+
+    noaa-goesNN/<product><sector>/<year>/<doy>/<hour>/OR_<product><sector>-M6_GNN_s<YYYYJJJHHMMSSs>_e..._c....nc
+"""
+import os
+import asyncio
+import shutil
+import pandas as pd
+from fsspec.asyn import AsyncFileSystem
+from fsspec.spec import AbstractBufferedFile
+
+
+class LocalS3(AsyncFileSystem):
+    # every instance counts its own requests
+    cachable = False
+
+    def __init__(self, root, latency = 0, bandwidth = None, **kwargs):
+        """
+        Parameters
+        ----------
+        root : str
+            Local directory that stands for the root of S3 (buckets are the
+            first level of folders).
+        latency : float, optional
+            Seconds each request takes before any data is sent. The default
+            is 0.
+        bandwidth : float, optional
+            Bytes per second per request. The default is None, unlimited.
+
+        """
+        super().__init__(**kwargs)
+        self.root = root
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.calls = {}
+
+    def _local(self, path):
+        return os.path.join(self.root, path.lstrip('/'))
+
+    async def _request(self, kind, size = 0):
+        self.calls[kind] = self.calls.get(kind, 0) + 1
+        self.calls['bytes'] = self.calls.get('bytes', 0) + size
+        delay = self.latency + (size / self.bandwidth if self.bandwidth else 0)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def _entry(self, path, local):
+        is_file = os.path.isfile(local)
+        return {'name': path, 'size': os.path.getsize(local) if is_file else 0,
+                'type': 'file' if is_file else 'directory', 'ETag': '"0"'}
+
+    async def _info(self, path, **kwargs):
+        await self._request('head')
+        local = self._local(path)
+        if not os.path.exists(local):
+            raise FileNotFoundError(path)
+        return self._entry(path.rstrip('/'), local)
+
+    async def _ls(self, path, detail = True, **kwargs):
+        # like s3, one request per 1000 keys
+        local = self._local(path)
+        if not os.path.isdir(local):
+            await self._request('list')
+            raise FileNotFoundError(path)
+        names = sorted(os.listdir(local))
+        for i in range(max(1, -(-len(names) // 1000))):
+            await self._request('list')
+        out = [self._entry(path.rstrip('/') + '/' + n, os.path.join(local, n)) for n in names]
+        return out if detail else [o['name'] for o in out]
+
+    async def _find(self, path, detail = False, **kwargs):
+        local = self._local(path)
+        out = {}
+        for dirpath, dirnames, filenames in os.walk(local):
+            for n in filenames:
+                name = os.path.relpath(os.path.join(dirpath, n), self.root)
+                out[name] = self._entry(name, os.path.join(dirpath, n))
+        for i in range(max(1, -(-len(out) // 1000))):
+            await self._request('list')
+        out = dict(sorted(out.items()))
+        return out if detail else list(out)
+
+    async def _cat_file(self, path, start = None, end = None, **kwargs):
+        local = self._local(path)
+        start = start or 0
+        end = os.path.getsize(local) if end is None else end
+        await self._request('get', end - start)
+        with open(local, 'rb') as f:
+            f.seek(start)
+            return f.read(end - start)
+
+    async def _get_file(self, rpath, lpath, **kwargs):
+        local = self._local(rpath)
+        await self._request('get', os.path.getsize(local))
+        shutil.copyfile(local, lpath)
+
+    def _open(self, path, mode = 'rb', block_size = None, cache_type = None, **kwargs):
+        fs = self
+        local = self._local(path)
+
+        class File(AbstractBufferedFile):
+            def _fetch_range(self, start, end):
+                fs.calls['get'] = fs.calls.get('get', 0) + 1
+                fs.calls['bytes'] = fs.calls.get('bytes', 0) + end - start
+                with open(local, 'rb') as f:
+                    f.seek(start)
+                    return f.read(end - start)
+
+        return File(self, path, mode, block_size = block_size or 2**20,
+                    cache_type = cache_type or 'readahead', size = os.path.getsize(local))
+
+
+def key(satellite, product, scan_sector, time, duration = '4min'):
+    """Key of a synthetic file in the layout of the NOAA GOES buckets."""
+    end = time + pd.Timedelta(duration)
+    s = time.strftime('%Y%j%H%M%S') + '0'
+    e = end.strftime('%Y%j%H%M%S') + '0'
+    return (f'noaa-goes{satellite}/{product}{scan_sector}/{time.year}/{time.day_of_year:03d}/{time.hour:02d}/'
+            f'OR_{product}{scan_sector}-M6_G{satellite}_s{s}_e{e}_c{e}.nc')
+
+
+def populate(root, start = '2020-08-08', no_of_hours = 24, files_per_hour = 12, file_size = 2**20,
+             satellites = ['16'], products = ['ABI-L2-AOD'], scan_sectors = ['C'], random = False):
+    """
+    Fill root with synthetic files.
+
+    Parameters
+    ----------
+    root : str
+    start : str, optional
+        First hour. The default is '2020-08-08'.
+    no_of_hours : int, optional
+        The default is 24.
+    files_per_hour : int, optional
+        12 is CONUS (every 5 min), 6 full disk, 60 meso. The default is 12.
+    file_size : int, optional
+        Bytes per file. The default is 1 MiB.
+    satellites, products, scan_sectors : list of str, optional
+        All combinations are created.
+    random : bool, optional
+        If True, files are filled with random bytes, otherwise they are
+        sparse (zeros, fast to create). The default is False.
+
+    Returns
+    -------
+    list of str
+        The keys.
+
+    """
+    freq = pd.Timedelta('1h') / files_per_hour
+    times = pd.date_range(start, periods = no_of_hours * files_per_hour, freq = freq)
+    keys = []
+    for satellite in satellites:
+        for product in products:
+            for scan_sector in scan_sectors:
+                for time in times:
+                    k = key(satellite, product, scan_sector, time)
+                    path = os.path.join(root, k)
+                    os.makedirs(os.path.dirname(path), exist_ok = True)
+                    with open(path, 'wb') as f:
+                        if random:
+                            f.write(os.urandom(file_size))
+                        else:
+                            f.truncate(file_size)
+                    keys.append(k)
+    return keys
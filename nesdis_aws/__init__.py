@@ -1,2 +1,2 @@
 # -*- coding: utf-8 -*-
-from nesdis_aws.nesdis_aws import AwsQuery
+from nesdis_aws.nesdis_aws import AwsQuery, BatchQuery, JpssQuery
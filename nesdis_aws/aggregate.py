@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+Aggregation of processed per-scan files into daily or monthly stores.
+
+Processed scans are buffered in memory (at most buffer_size of them) and
+then appended along the time dimension to one store per day or month,
+either a NetCDF file with an unlimited time dimension or a Zarr store.
+Scans that arrive late are appended to the store of their own period, also
+if that period was written before, and scans that are in a store already
+are skipped, so a restarted run does not duplicate anything. The time axis
+of a store is therefore in order of arrival; open returns it sorted.
+
+Writing is done by a single process, e.g. the one that runs
+AwsQuery.process or the callback of AwsQuery.process_parallel. xarray and
+h5netcdf (or zarr) are only needed when an Aggregator is used.
+"""
+import re as _re
+import shutil as _shutil
+import pathlib as _pl
+import pandas as _pd
+from nesdis_aws import utils as _utils
+from nesdis_aws.remote_read import _keep_encoding
+
+formats = {'netcdf': '.nc', 'zarr': '.zarr'}
+periods = {'daily': '%Y%m%d', 'monthly': '%Y%m'}
+
+# compression settings of h5netcdf that zarr does not understand
+_netcdf_only_encoding = ['zlib', 'complevel', 'shuffle']
+
+
+def _time_from_name(path2file):
+    """Scan time from a processed file name (<prefix>_YYYYMMDD_HHMMSS.nc)."""
+    match = _re.search(r'_(\d{8}_\d{6})', _pl.Path(path2file).name)
+    assert(not isinstance(match, type(None))), f'No time (_YYYYMMDD_HHMMSS) in {path2file}, pass time.'
+    return _pd.to_datetime(match.group(1), format = '%Y%m%d_%H%M%S')
+
+
+class Aggregator(object):
+    def __init__(self, path2stores, prefix, period = 'daily', format = 'netcdf', buffer_size = 24,
+                 time_dim = 'time', time_chunk = 12, remove_added = False):
+        """
+        Parameters
+        ----------
+        path2stores : str or pathlib.Path
+            Folder of the stores.
+        prefix : str
+            Stores are named <prefix>_<YYYYMMDD or YYYYMM>.nc (or .zarr).
+        period : str, optional
+            'daily' or 'monthly'. The default is 'daily'.
+        format : str, optional
+            'netcdf' or 'zarr'. The default is 'netcdf'.
+        buffer_size : int, optional
+            Number of scans kept in memory before they are written. The
+            default is 24.
+        time_dim : str, optional
+            Name of the time dimension. Scans that do not have it get it
+            (length 1). The default is 'time'.
+        time_chunk : int, optional
+            Chunk size along time of new stores. The default is 12.
+        remove_added : bool, optional
+            If True, per-scan files added by path are removed once they are
+            written to the store. The default is False.
+
+        """
+        assert(format in formats), f'format has to be one of {list(formats)}, not {format}.'
+        assert(period in periods), f'period has to be one of {list(periods)}, not {period}.'
+        self.path2stores = _pl.Path(path2stores)
+        self.prefix = prefix
+        self.period = period
+        self.format = format
+        self.buffer_size = buffer_size
+        self.time_dim = time_dim
+        self.time_chunk = time_chunk
+        self.remove_added = remove_added
+        self.path2stores.mkdir(parents = True, exist_ok = True)
+        self._buffer = []
+        # times that are in each store, read when a store is first touched
+        self._times = {}
+
+    def like(self, **kwargs):
+        """New Aggregator with the same settings, except those in kwargs."""
+        settings = dict(path2stores = self.path2stores, prefix = self.prefix, period = self.period,
+                        format = self.format, buffer_size = self.buffer_size, time_dim = self.time_dim,
+                        time_chunk = self.time_chunk, remove_added = self.remove_added)
+        settings.update(kwargs)
+        return Aggregator(**settings)
+
+    def path(self, time):
+        """Store that holds the scan at time."""
+        name = f'{self.prefix}_{_pd.to_datetime(time).strftime(periods[self.period])}{formats[self.format]}'
+        return self.path2stores.joinpath(name)
+
+    def add(self, scan, time = None):
+        """
+        Add a processed scan, written when the buffer is full.
+
+        Parameters
+        ----------
+        scan : xarray.Dataset, str or pathlib.Path
+            The scan or the path to its file.
+        time : pandas.Timestamp, optional
+            Only used if the scan has no time dimension. The default is
+            None, the time is taken from the file name
+            (<prefix>_YYYYMMDD_HHMMSS.nc).
+
+        """
+        import xarray as _xr
+        path2file = None
+        if not isinstance(scan, _xr.Dataset):
+            path2file = _pl.Path(scan)
+            with _xr.open_dataset(path2file) as ds:
+                scan = ds.load()
+        if self.time_dim not in scan.dims:
+            if isinstance(time, type(None)):
+                time = _time_from_name(path2file)
+            scan = scan.expand_dims({self.time_dim: [_pd.to_datetime(time)]})
+            # variables without time (e.g. coordinates) are written once per store
+            for name, var in scan.data_vars.items():
+                if self.time_dim not in var.dims:
+                    scan = scan.set_coords(name)
+        self._buffer.append((scan, path2file))
+        if len(self._buffer) >= self.buffer_size:
+            self.flush()
+        return
+
+    def flush(self):
+        """Write the buffered scans to their stores."""
+        import xarray as _xr
+        if len(self._buffer) == 0:
+            return
+        groups = {}
+        for scan, path2file in self._buffer:
+            for time in scan[self.time_dim].values:
+                groups.setdefault(self.path(time), []).append(scan.sel({self.time_dim: [time]}))
+        for path2store, scans in groups.items():
+            ds = _xr.concat(scans, dim = self.time_dim, data_vars = 'minimal', coords = 'minimal', compat = 'override')
+            self._write(path2store, ds)
+        if self.remove_added:
+            for scan, path2file in self._buffer:
+                if not isinstance(path2file, type(None)):
+                    path2file.unlink(missing_ok = True)
+        self._buffer = []
+        return
+
+    def _stored_times(self, path2store):
+        if path2store not in self._times:
+            if path2store.exists():
+                with self._open(path2store) as ds:
+                    self._times[path2store] = set(_pd.to_datetime(ds[self.time_dim].values))
+            else:
+                self._times[path2store] = set()
+        return self._times[path2store]
+
+    def _open(self, path2store):
+        import xarray as _xr
+        if self.format == 'zarr':
+            return _xr.open_zarr(path2store)
+        return _xr.open_dataset(path2store, engine = 'h5netcdf')
+
+    def _write(self, path2store, ds):
+        """Append ds to the store, skipping times that are in it already."""
+        stored = self._stored_times(path2store)
+        times = _pd.to_datetime(ds[self.time_dim].values)
+        new = ~times.isin(stored) & ~times.duplicated()
+        if not new.any():
+            return
+        ds = ds.isel({self.time_dim: new.nonzero()[0]})
+        if not path2store.exists():
+            self._create(path2store, ds)
+        elif self.format == 'zarr':
+            ds.to_zarr(path2store, append_dim = self.time_dim)
+        else:
+            self._append_netcdf(path2store, ds)
+        stored.update(_pd.to_datetime(ds[self.time_dim].values))
+        return
+
+    def _encoding(self, ds):
+        """Encoding of the scans (packing, fill value) plus the chunks along time."""
+        encoding = {}
+        for name, var in ds.variables.items():
+            if self.time_dim not in var.dims or name == self.time_dim:
+                continue
+            encoding[name] = {k: v for k, v in var.encoding.items() if k in _keep_encoding
+                              and not (self.format == 'zarr' and k in _netcdf_only_encoding)}
+            chunks = tuple(min(self.time_chunk, n) if d == self.time_dim else n for d, n in zip(var.dims, var.shape))
+            encoding[name]['chunks' if self.format == 'zarr' else 'chunksizes'] = chunks
+        return encoding
+
+    def _create(self, path2store, ds):
+        if self.format == 'zarr':
+            ds.to_zarr(path2store, mode = 'w-', encoding = self._encoding(ds))
+        else:
+            with _utils.atomic_path(path2store) as part:
+                ds.to_netcdf(part, engine = 'h5netcdf', unlimited_dims = [self.time_dim], encoding = self._encoding(ds))
+        return
+
+    def _append_netcdf(self, path2store, ds):
+        """
+        Resize the unlimited time dimension and write the new scans at the
+        end. This is done in a copy of the store that replaces it when it
+        is complete, so a crash in between leaves the store as it was 
+        (instead of with fill values on the time axis).
+        """
+        import xarray as _xr
+        import h5netcdf as _h5netcdf
+        with self._open(path2store) as stored:
+            encodings = {name: {k: v for k, v in stored[name].encoding.items() if k in _keep_encoding}
+                         for name in stored.variables if self.time_dim in stored[name].dims}
+        with _utils.atomic_path(path2store) as part:
+            _shutil.copyfile(path2store, part)
+            with _h5netcdf.File(part, 'a') as f:
+                n = f.dimensions[self.time_dim].size
+                m = ds.sizes[self.time_dim]
+                f.resize_dimension(self.time_dim, n + m)
+                for name, encoding in encodings.items():
+                    var = ds[name].variable.copy(deep = False)
+                    var.encoding = encoding
+                    values = _xr.conventions.encode_cf_variable(var, name = name).values
+                    axis = var.dims.index(self.time_dim)
+                    f.variables[name][(slice(None),) * axis + (slice(n, n + m),)] = values
+        return
+
+    def open(self, time):
+        """
+        Dataset of the store that holds time, sorted by time. Flushes the
+        buffer first.
+        """
+        self.flush()
+        with self._open(self.path(time)) as ds:
+            return ds.sortby(self.time_dim).load()
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+Storage backends the keys of the NOAA buckets are read from.
+
+A BackendChain is an async fsspec filesystem that resolves each key against
+a list of backends in order, e.g. a local (NFS) mirror of hot products,
+then an S3 compatible endpoint (e.g. a caching proxy or MinIO), then the
+public buckets on AWS. Reads are served by the first backend that has the
+key. Clients are only created when a backend is first used, and s3fs is
+only imported then.
+"""
+import os as _os
+import shutil as _shutil
+import asyncio as _asyncio
+from fsspec.asyn import AsyncFileSystem as _AsyncFileSystem
+
+
+class MirrorFileSystem(_AsyncFileSystem):
+    """
+    Async filesystem over a local directory with the same layout as the
+    buckets (<root>/noaa-goes16/ABI-L2-AODC/...). File access runs in a
+    thread pool, so a slow NFS does not block other requests.
+    """
+    cachable = False
+
+    def __init__(self, root, **kwargs):
+        super().__init__(**kwargs)
+        self.root = root
+
+    def _local(self, path):
+        return _os.path.join(self.root, self._strip_protocol(path).lstrip('/'))
+
+    async def _run(self, func, *args):
+        return await _asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    def _entry(self, path, local):
+        stat = _os.stat(local)
+        is_dir = _os.path.isdir(local)
+        return {'name': path.rstrip('/'), 'size': 0 if is_dir else stat.st_size,
+                'type': 'directory' if is_dir else 'file', 'mtime': stat.st_mtime}
+
+    async def _info(self, path, **kwargs):
+        local = self._local(path)
+        if not _os.path.exists(local):
+            raise FileNotFoundError(path)
+        return await self._run(self._entry, path, local)
+
+    async def _ls(self, path, detail = True, **kwargs):
+        local = self._local(path)
+        if not _os.path.isdir(local):
+            raise FileNotFoundError(path)
+        def ls():
+            path_ = path.rstrip('/')
+            return [self._entry(f'{path_}/{name}', _os.path.join(local, name)) for name in sorted(_os.listdir(local))]
+        out = await self._run(ls)
+        return out if detail else [o['name'] for o in out]
+
+    async def _find(self, path, detail = False, **kwargs):
+        local = self._local(path)
+        def find():
+            out = {}
+            for dirpath, dirnames, filenames in _os.walk(local):
+                for name in filenames:
+                    key = _os.path.relpath(_os.path.join(dirpath, name), self.root)
+                    out[key] = self._entry(key, _os.path.join(dirpath, name))
+            return dict(sorted(out.items()))
+        out = await self._run(find)
+        return out if detail else list(out)
+
+    async def _cat_file(self, path, start = None, end = None, **kwargs):
+        local = self._local(path)
+        def cat():
+            with open(local, 'rb') as f:
+                # negative start and end count from the end of the file, like in fsspec
+                size = _os.fstat(f.fileno()).st_size
+                if start is not None:
+                    f.seek(start if start >= 0 else max(0, size + start))
+                if end is None:
+                    return f.read()
+                return f.read(max(0, (end if end >= 0 else size + end) - f.tell()))
+        return await self._run(cat)
+
+    async def _get_file(self, rpath, lpath, **kwargs):
+        await self._run(_shutil.copyfile, self._local(rpath), lpath)
+
+    def _open(self, path, mode = 'rb', **kwargs):
+        assert(mode == 'rb'), 'The mirror is read only.'
+        return open(self._local(path), 'rb')
+
+
+class Mirror(object):
+    def __init__(self, path2mirror, listing = False):
+        """
+        Local directory with a copy of (parts of) the buckets.
+
+        Parameters
+        ----------
+        path2mirror : str
+            Root of the mirror, containing e.g. noaa-goes16/ABI-L2-AODC/...
+        listing : bool, optional
+            If True, folders are also listed from the mirror if they exist
+            there, which is only right if the mirror is always complete.
+            The default is False, only files are read from the mirror.
+
+        """
+        self.path2mirror = path2mirror
+        self.listing = listing
+
+    def make_filesystem(self):
+        return MirrorFileSystem(self.path2mirror)
+
+    def __repr__(self):
+        return f'Mirror({self.path2mirror!r})'
+
+
+class S3(object):
+    def __init__(self, endpoint_url = None, anon = True, **storage_options):
+        """
+        An S3 compatible service.
+
+        Parameters
+        ----------
+        endpoint_url : str, optional
+            E.g. 'http://minio.local:9000'. The default is None, AWS.
+        anon : bool, optional
+            The default is True.
+        **storage_options
+            Passed to s3fs.S3FileSystem.
+
+        """
+        self.endpoint_url = endpoint_url
+        self.anon = anon
+        self.storage_options = storage_options
+        self.listing = True
+
+    def make_filesystem(self):
+        import s3fs as _s3fs
+        kwargs = dict(self.storage_options)
+        if not isinstance(self.endpoint_url, type(None)):
+            kwargs['endpoint_url'] = self.endpoint_url
+        return _s3fs.S3FileSystem(anon = self.anon, skip_instance_cache = True, **kwargs)
+
+    def __repr__(self):
+        return f'S3({self.endpoint_url or "aws"!r})'
+
+
+class BackendChain(_AsyncFileSystem):
+    cachable = False
+
+    def __init__(self, backends, **kwargs):
+        """
+        Async filesystem that tries backends in order. Reads (info, cat,
+        get, open) are served by the first backend that has the key.
+        Listings come from the first backend with listing True that returns
+        something.
+
+        Parameters
+        ----------
+        backends : list
+            Mirror and S3 instances, the nearest first.
+
+        """
+        super().__init__(**kwargs)
+        self.backends = list(backends)
+        self._filesystems = [None] * len(self.backends)
+        # number of files (or ranges) read from each backend
+        self.hits = {repr(b): 0 for b in self.backends}
+
+    def filesystem(self, i):
+        """Filesystem of backend i, created on first use."""
+        if isinstance(self._filesystems[i], type(None)):
+            self._filesystems[i] = self.backends[i].make_filesystem()
+        return self._filesystems[i]
+
+    async def _first(self, method, path, *args, listing = False, **kwargs):
+        error = FileNotFoundError(path)
+        for i, backend in enumerate(self.backends):
+            if listing and not backend.listing:
+                continue
+            try:
+                out = await getattr(self.filesystem(i), method)(path, *args, **kwargs)
+            except OSError as e:
+                # e.g. missing, no permission, or a stale NFS handle: try the next backend
+                error = e
+                continue
+            if listing and len(out) == 0:
+                continue
+            if method in ('_cat_file', '_get_file'):
+                self.hits[repr(backend)] += 1
+            return out
+        if listing:
+            # nothing found anywhere, empty like s3fs
+            return {} if method == '_find' and kwargs.get('detail') else []
+        raise error
+
+    async def _info(self, path, **kwargs):
+        return await self._first('_info', path, **kwargs)
+
+    async def _cat_file(self, path, start = None, end = None, **kwargs):
+        return await self._first('_cat_file', path, start = start, end = end, **kwargs)
+
+    async def _get_file(self, rpath, lpath, **kwargs):
+        return await self._first('_get_file', rpath, lpath, **kwargs)
+
+    async def _ls(self, path, detail = True, **kwargs):
+        out = await self._first('_ls', path, detail = detail, listing = True, **kwargs)
+        if len(out) == 0:
+            raise FileNotFoundError(path)
+        return out
+
+    async def _find(self, path, detail = False, **kwargs):
+        return await self._first('_find', path, detail = detail, listing = True, **kwargs)
+
+    def _open(self, path, mode = 'rb', **kwargs):
+        for i, backend in enumerate(self.backends):
+            fs = self.filesystem(i)
+            if fs.exists(path):
+                self.hits[repr(backend)] += 1
+                return fs.open(path, mode, **kwargs)
+        raise FileNotFoundError(path)
+
+
+def make_filesystem(path2mirror = None, endpoint_url = None, mirror_listing = False):
+    """
+    Filesystem for the given sources: the mirror, then the endpoint, then
+    public AWS. Without mirror and endpoint this is a plain anonymous
+    s3fs.S3FileSystem. mirror_listing is passed to Mirror as listing.
+    """
+    backends = []
+    if not isinstance(path2mirror, type(None)):
+        backends.append(Mirror(path2mirror, listing = mirror_listing))
+    if not isinstance(endpoint_url, type(None)):
+        backends.append(S3(endpoint_url = endpoint_url))
+    backends.append(S3())
+    if len(backends) == 1:
+        return backends[0].make_filesystem()
+    return BackendChain(backends)
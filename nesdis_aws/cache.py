@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""
+Shared, size bounded local cache of raw files.
+
+Files are stored under their key on AWS
+(<path2cache>/noaa-goes16/ABI-L2-AODC/2020/221/00/OR_...nc), so all queries
+and processes that use the same cache find each others files. A SQLite file
+in the cache folder keeps size, state, and last access of each file, and
+which processes are currently using (pinning) it.
+
+Space for a file is reserved before the download starts. If the reservation
+would exceed the byte budget (or fill the disk) files that are not pinned
+are evicted, least recently used ('lru') or oldest scan ('oldest_scan')
+first. If that is not enough, because everything is in use, the download
+waits until other processes release files.
+"""
+import os as _os
+import re as _re
+import time as _time
+import socket as _socket
+import shutil as _shutil
+import pathlib as _pl
+from nesdis_aws import utils as _utils
+
+_schema = """
+CREATE TABLE IF NOT EXISTS files (
+    key TEXT PRIMARY KEY,
+    size INTEGER,
+    state TEXT,
+    owner TEXT,
+    last_access REAL,
+    scan_start TEXT
+);
+CREATE TABLE IF NOT EXISTS pins (
+    key TEXT,
+    owner TEXT,
+    pinned_at REAL
+);
+CREATE INDEX IF NOT EXISTS pins_key ON pins (key);
+"""
+
+policies = {'lru': 'last_access',
+            'oldest_scan': 'scan_start, last_access'}
+
+
+def _scan_start(key):
+    """The sYYYYJJJHHMMSS part of the file name, sorts like the time."""
+    match = _re.search(r'_s(\d{13})', key.rsplit('/', 1)[-1])
+    return '' if isinstance(match, type(None)) else match.group(1)
+
+
+class RawFileCache(object):
+    def __init__(self, path2cache, max_bytes, policy = 'lru', min_free_fraction = 0.1,
+                 wait_timeout = 3600, poll_interval = 5, stale_after = 24 * 3600):
+        """
+        Parameters
+        ----------
+        path2cache : str or pathlib.Path
+            Cache folder, can be shared between processes (and hosts, if
+            the file system supports SQLite locking).
+        max_bytes : int
+            Byte budget of all files in the cache.
+        policy : str, optional
+            'lru' evicts the least recently used file first, 'oldest_scan'
+            the file with the oldest scan start. The default is 'lru'.
+        min_free_fraction : float, optional
+            Files are also evicted to keep at least this fraction of the
+            disk free, no matter the budget. The default is 0.1.
+        wait_timeout : float, optional
+            Seconds a reservation waits for space before a TimeoutError is
+            raised. The default is 3600.
+        poll_interval : float, optional
+            Seconds between attempts while waiting. The default is 5.
+        stale_after : float, optional
+            Reservations and pins of processes on other hosts are dropped
+            after this many seconds. On the same host they are dropped as
+            soon as the process is gone. The default is 24 h.
+
+        """
+        assert(policy in policies), f'policy has to be one of {list(policies)}, not {policy}.'
+        self.path2cache = _pl.Path(path2cache)
+        self.path2db = self.path2cache.joinpath('cache.db')
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.min_free_fraction = min_free_fraction
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self.owner = _utils.owner()
+        self.path2cache.mkdir(parents = True, exist_ok = True)
+        with _utils.connect(self.path2db) as con:
+            con.executescript(_schema)
+
+    def path(self, key):
+        """Local path of a key."""
+        return self.path2cache.joinpath(_pl.Path(key).as_posix().lstrip('/'))
+
+    def _is_stale(self, owner, since, now):
+        host, pid = owner.rsplit(':', 1)
+        if host != _socket.gethostname():
+            return now - since > self.stale_after
+        try:
+            _os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return True
+        except PermissionError:
+            pass
+        return False
+
+    def _drop_stale(self, con, now):
+        """Remove pins and reservations of processes that are gone."""
+        for rowid, owner, pinned_at in con.execute('SELECT rowid, owner, pinned_at FROM pins').fetchall():
+            if self._is_stale(owner, pinned_at, now):
+                con.execute('DELETE FROM pins WHERE rowid = ?', (rowid,))
+        for key, owner, last_access in con.execute("SELECT key, owner, last_access FROM files WHERE state = 'reserved'").fetchall():
+            if self._is_stale(owner, last_access, now):
+                con.execute('DELETE FROM files WHERE key = ?', (key,))
+                self.path(key).unlink(missing_ok = True)
+
+    def _evict(self, con, key, size):
+        """
+        Evict files (not pinned, least valuable first) until size bytes fit.
+        Returns False, and evicts nothing, if that is not possible.
+        """
+        used = con.execute('SELECT COALESCE(SUM(size), 0) FROM files WHERE key != ?', (key,)).fetchone()[0]
+        du = _shutil.disk_usage(self.path2cache)
+        disk_available = du.free - self.min_free_fraction * du.total
+        to_free = max(used + size - self.max_bytes, size - disk_available)
+        if to_free <= 0:
+            return True
+        candidates = con.execute(f"""SELECT key, size FROM files
+                                     WHERE state = 'complete' AND key != ?
+                                     AND key NOT IN (SELECT key FROM pins)
+                                     ORDER BY {policies[self.policy]}""", (key,)).fetchall()
+        evict = []
+        for candidate, candidate_size in candidates:
+            if to_free <= 0:
+                break
+            evict.append(candidate)
+            to_free -= candidate_size
+        if to_free > 0:
+            return False
+        for candidate in evict:
+            con.execute('DELETE FROM files WHERE key = ?', (candidate,))
+            self.path(candidate).unlink(missing_ok = True)
+        return True
+
+    def reserve(self, key, size):
+        """
+        Reserve space for a file and pin it. Waits if other processes are
+        downloading the same file or the space can not be freed yet.
+
+        Parameters
+        ----------
+        key : str
+            Key on AWS.
+        size : int
+            Bytes.
+
+        Returns
+        -------
+        bool
+            True if space was reserved and the file needs to be downloaded
+            (followed by commit or abort), False if it is in the cache
+            already.
+
+        """
+        assert(size <= self.max_bytes), f'{key} ({size} bytes) is larger than the entire cache ({self.max_bytes} bytes).'
+        key = _pl.Path(key).as_posix()
+        start_time = _time.time()
+        while True:
+            now = _time.time()
+            # the check of the budget and the reservation are atomic
+            with _utils.connect(self.path2db, immediate = True) as con:
+                self._drop_stale(con, now)
+                row = con.execute('SELECT state, owner FROM files WHERE key = ?', (key,)).fetchone()
+                if not isinstance(row, type(None)) and row[0] == 'complete' and self.path(key).is_file():
+                    con.execute('UPDATE files SET last_access = ? WHERE key = ?', (now, key))
+                    con.execute('INSERT INTO pins VALUES (?, ?, ?)', (key, self.owner, now))
+                    return False
+                busy = not isinstance(row, type(None)) and row[0] == 'reserved' and row[1] != self.owner
+                if not busy and self._evict(con, key, size):
+                    con.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)',
+                                (key, size, 'reserved', self.owner, now, _scan_start(key)))
+                    con.execute('INSERT INTO pins VALUES (?, ?, ?)', (key, self.owner, now))
+                    return True
+            if now - start_time > self.wait_timeout:
+                raise TimeoutError(f'No space for {key} in the cache after {self.wait_timeout} s, all files are in use.')
+            _time.sleep(self.poll_interval)
+
+    def commit(self, key):
+        """Mark a reserved file as complete, with its actual size."""
+        key = _pl.Path(key).as_posix()
+        with _utils.connect(self.path2db) as con:
+            con.execute("UPDATE files SET state = 'complete', size = ?, last_access = ? WHERE key = ?",
+                        (self.path(key).stat().st_size, _time.time(), key))
+
+    def abort(self, key):
+        """Drop a reservation (e.g. after a failed download) and the file."""
+        key = _pl.Path(key).as_posix()
+        with _utils.connect(self.path2db) as con:
+            con.execute('DELETE FROM files WHERE key = ? AND owner = ?', (key, self.owner))
+            con.execute('DELETE FROM pins WHERE key = ? AND owner = ?', (key, self.owner))
+        self.path(key).unlink(missing_ok = True)
+
+    def get(self, key, pin = False):
+        """
+        Path of a key if it is in the cache, otherwise None. If pin is True
+        the file is protected from eviction until unpin.
+        """
+        key = _pl.Path(key).as_posix()
+        now = _time.time()
+        with _utils.connect(self.path2db, immediate = pin) as con:
+            row = con.execute('SELECT state FROM files WHERE key = ?', (key,)).fetchone()
+            if isinstance(row, type(None)) or row[0] != 'complete':
+                return None
+            if not self.path(key).is_file():
+                # removed behind the back of the cache
+                con.execute('DELETE FROM files WHERE key = ?', (key,))
+                return None
+            con.execute('UPDATE files SET last_access = ? WHERE key = ?', (now, key))
+            if pin:
+                con.execute('INSERT INTO pins VALUES (?, ?, ?)', (key, self.owner, now))
+        return self.path(key)
+
+    def unpin(self, key):
+        """Release one pin of this process on key, the file can be evicted again."""
+        key = _pl.Path(key).as_posix()
+        with _utils.connect(self.path2db) as con:
+            con.execute('DELETE FROM pins WHERE rowid = (SELECT rowid FROM pins WHERE key = ? AND owner = ? LIMIT 1)',
+                        (key, self.owner))
+
+    def fetch(self, key, size, download):
+        """
+        Make sure a file is in the cache and pin it (call unpin when done).
+
+        Parameters
+        ----------
+        key : str
+            Key on AWS.
+        size : int
+            Bytes, to reserve the space.
+        download : callable
+            Called as download(path) to write the file to path if it is not
+            in the cache.
+
+        Returns
+        -------
+        bool
+            True if the file was downloaded, False if it was in the cache.
+
+        """
+        if not self.reserve(key, size):
+            return False
+        path = self.path(key)
+        path.parent.mkdir(parents = True, exist_ok = True)
+        try:
+            download(path)
+        except BaseException:
+            self.abort(key)
+            raise
+        self.commit(key)
+        return True
+
+    def keys(self):
+        """Set of the keys that are complete in the cache."""
+        with _utils.connect(self.path2db) as con:
+            return set(k for k, in con.execute("SELECT key FROM files WHERE state = 'complete'"))
+
+    def usage(self):
+        """
+        Returns
+        -------
+        dict
+            no_of_files, size_bytes (complete files), reserved_bytes
+            (downloads in progress), pinned (no of pinned files), and
+            max_bytes.
+
+        """
+        with _utils.connect(self.path2db) as con:
+            sizes = dict(con.execute('SELECT state, COALESCE(SUM(size), 0) FROM files GROUP BY state').fetchall())
+            no_of_files = con.execute("SELECT COUNT(*) FROM files WHERE state = 'complete'").fetchone()[0]
+            pinned = con.execute('SELECT COUNT(DISTINCT key) FROM pins').fetchone()[0]
+        return dict(no_of_files = no_of_files, size_bytes = sizes.get('complete', 0),
+                    reserved_bytes = sizes.get('reserved', 0), pinned = pinned, max_bytes = self.max_bytes)
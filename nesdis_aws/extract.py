@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+Extraction of the values at a set of stations from many scenes.
+
+The fixed grid pixel of each station (and optionally a window of pixels
+around it) only depends on the grid, so it is computed once per grid
+(platform, scene, resolution, and position; see
+fixed_grid.FixedGridWindow.grid_key) and cached. Each scene is then reduced
+to one row per station by a single vectorized gather of all stations and
+variables, which only reads the needed parts of the file. The rows are
+streamed into one table (time x station) instead of one file per scene.
+
+xarray and h5netcdf are needed to open the files, pyarrow to write the
+table.
+"""
+import os as _os
+import json as _json
+import time as _time
+import pathlib as _pl
+import numpy as _np
+import pandas as _pd
+from nesdis_aws import fixed_grid as _fixed_grid
+from nesdis_aws import utils as _utils
+
+
+class StationTable(object):
+    def __init__(self, path2table, buffer_size = 1000):
+        """
+        Table of the extracted values, one row per scene and station. Rows
+        are buffered and written as Parquet parts into the folder
+        path2table, which can be read as one table (read, or e.g.
+        pandas.read_parquet(path2table)).
+
+        Parameters
+        ----------
+        path2table : str or pathlib.Path
+            Folder of the parts.
+        buffer_size : int, optional
+            Number of rows kept in memory before a part is written. The
+            default is 1000.
+
+        """
+        self.path2table = _pl.Path(path2table)
+        self.buffer_size = buffer_size
+        self.path2table.mkdir(parents = True, exist_ok = True)
+        self._buffer = []
+        self._no_of_rows = 0
+        self._no_of_parts = 0
+
+    def _parts(self):
+        return sorted(self.path2table.glob('part_*.parquet'))
+
+    def append(self, rows):
+        """Add rows (pandas.DataFrame), written when the buffer is full."""
+        self._buffer.append(rows)
+        self._no_of_rows += rows.shape[0]
+        if self._no_of_rows >= self.buffer_size:
+            self.flush()
+        return
+
+    def flush(self):
+        """Write the buffered rows to a new part."""
+        if len(self._buffer) == 0:
+            return
+        rows = _pd.concat(self._buffer, ignore_index = True)
+        # unique over processes and time, written to a temporary name first
+        name = f'part_{_time.time():.6f}_{_os.getpid()}_{self._no_of_parts:05d}.parquet'
+        with _utils.atomic_path(self.path2table.joinpath(name)) as part:
+            rows.to_parquet(part, index = False)
+        self._no_of_parts += 1
+        self._buffer = []
+        self._no_of_rows = 0
+        return
+
+    def keys(self):
+        """Set of the keys (files on AWS) that are in the table."""
+        keys = set()
+        for path in self._parts():
+            keys.update(_pd.read_parquet(path, columns = ['key']).key)
+        for rows in self._buffer:
+            keys.update(rows.key)
+        return keys
+
+    def read(self, variable = None):
+        """
+        Parameters
+        ----------
+        variable : str, optional
+            If given, a time x station table of this variable is returned.
+            The default is None, all rows.
+
+        Returns
+        -------
+        pandas.DataFrame
+            Columns time, key, station, the variables, and whatever was
+            passed to StationExtractor.extract. Sorted by time and station,
+            rows that were written twice (e.g. after a crash) only once.
+
+        """
+        parts = [_pd.read_parquet(path) for path in self._parts()] + self._buffer
+        if len(parts) == 0:
+            return _pd.DataFrame()
+        table = _pd.concat(parts, ignore_index = True)
+        table = table.drop_duplicates(['key', 'station'], keep = 'last').sort_values(['time', 'station'], kind = 'stable')
+        table = table.reset_index(drop = True)
+        if isinstance(variable, type(None)):
+            return table
+        return table.pivot_table(index = 'time', columns = 'station', values = variable, aggfunc = 'first', dropna = False)
+
+
+class StationExtractor(object):
+    def __init__(self, stations, path2table, variables = None, window = 0, path2cache = None, buffer_size = 1000):
+        """
+        Extracts the values at stations from ABI scenes, see AwsQuery
+        (extractor) and AwsQuery.extract.
+
+        Parameters
+        ----------
+        stations : pandas.DataFrame or dict
+            DataFrame with the columns lat and lon (degrees), the index
+            are the station names, or a dict {name: (lat, lon)}.
+        path2table : str or pathlib.Path
+            Folder of the table (see StationTable).
+        variables : list of str, optional
+            Variables on the (y, x) grid to extract. The default is None,
+            all of them.
+        window : int, optional
+            Half width of the window around each station in pixels, e.g. 1
+            for 3 x 3 pixels. With a window the mean, the standard
+            deviation (<variable>_std), and the number of valid pixels
+            (<variable>_count) are extracted. The default is 0, only the
+            value of the pixel the station is in.
+        path2cache : str, optional
+            JSON file to keep the pixel indices between sessions and
+            processes. The default is None, only cached in memory.
+        buffer_size : int, optional
+            See StationTable. The default is 1000.
+
+        """
+        if isinstance(stations, dict):
+            stations = _pd.DataFrame(stations, index = ['lat', 'lon']).transpose()
+        self.stations = stations[['lat', 'lon']].astype(float)
+        self.variables = variables
+        self.window = window
+        self.path2cache = path2cache
+        self.table = StationTable(path2table, buffer_size = buffer_size)
+        offsets = _np.arange(-window, window + 1)
+        self._offset_y, self._offset_x = [o.ravel() for o in _np.meshgrid(offsets, offsets, indexing = 'ij')]
+        self._cache = {}
+        if not isinstance(path2cache, type(None)) and _pl.Path(path2cache).is_file():
+            with open(path2cache) as f:
+                self._cache = _json.load(f)
+
+    def indices(self, ds):
+        """
+        Pixel of each station in the grid of ds, cached per grid.
+
+        Returns
+        -------
+        iy, ix : numpy.ndarray
+            Index along y and x, -1 where the station is not visible or
+            not in the grid (e.g. outside of CONUS).
+
+        """
+        key = _fixed_grid.FixedGridWindow.grid_key(ds)
+        if key not in self._cache:
+            x = ds['x'].values
+            y = ds['y'].values
+            px, py = _fixed_grid.latlon2xy(self.stations.lat.values, self.stations.lon.values,
+                                           _fixed_grid.projection_parameters(ds))
+            visible = ~_np.isnan(px)
+            ix = _np.full(px.size, -1)
+            iy = _np.full(py.size, -1)
+            ix[visible] = _fixed_grid.nearest_index(x, px[visible])
+            iy[visible] = _fixed_grid.nearest_index(y, py[visible])
+            # the nearest pixel of a station beyond the edge is the edge, it needs to be within half a pixel
+            inside = (visible & (_np.abs(x[ix] - px) <= abs(x[1] - x[0]) / 2 * 1.001)
+                              & (_np.abs(y[iy] - py) <= abs(y[1] - y[0]) / 2 * 1.001))
+            ix[~inside] = -1
+            iy[~inside] = -1
+            self._cache[key] = [iy.tolist(), ix.tolist()]
+            if not isinstance(self.path2cache, type(None)):
+                with open(self.path2cache, 'w') as f:
+                    _json.dump(self._cache, f)
+        iy, ix = self._cache[key]
+        return _np.array(iy), _np.array(ix)
+
+    def extract(self, ds, **columns):
+        """
+        Values at the stations.
+
+        Parameters
+        ----------
+        ds : xarray.Dataset
+            ABI scene (not loaded, only the pixels needed are read).
+        **columns
+            Added to each row, e.g. time and key (needed by the table).
+
+        Returns
+        -------
+        pandas.DataFrame
+            One row per station.
+
+        """
+        import xarray as _xr
+        iy, ix = self.indices(ds)
+        ny, nx = ds.sizes['y'], ds.sizes['x']
+        # stations x pixels of the window
+        wy = iy[:, None] + self._offset_y[None, :]
+        wx = ix[:, None] + self._offset_x[None, :]
+        valid = (iy >= 0)[:, None] & (wy >= 0) & (wy < ny) & (wx >= 0) & (wx < nx)
+        wy = _np.where(valid, wy, 0)
+        wx = _np.where(valid, wx, 0)
+        variables = self.variables
+        if isinstance(variables, type(None)):
+            variables = [name for name, var in ds.data_vars.items() if var.dims == ('y', 'x')]
+        # one gather of all stations and variables
+        values = ds[variables].isel(y = _xr.DataArray(wy, dims = ('station', 'pixel')),
+                                    x = _xr.DataArray(wx, dims = ('station', 'pixel'))).load()
+        out = _pd.DataFrame({'station': self.stations.index})
+        for name in variables:
+            v = values[name].values.astype(float)
+            v[~valid] = _np.nan
+            finite = _np.isfinite(v)
+            count = finite.sum(axis = 1)
+            if self.window == 0:
+                out[name] = v[:, 0]
+                continue
+            with _np.errstate(invalid = 'ignore', divide = 'ignore'):
+                mean = _np.where(finite, v, 0).sum(axis = 1) / count
+                std = _np.sqrt(_np.where(finite, (v - mean[:, None])**2, 0).sum(axis = 1) / count)
+            out[name] = mean
+            out[f'{name}_std'] = std
+            out[f'{name}_count'] = count
+        for name, value in reversed(list(columns.items())):
+            out.insert(0, name, value)
+        return out
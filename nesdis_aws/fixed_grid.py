@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+Conversions between geographic coordinates and the ABI fixed grid.
+
+The formulas follow the GOES-R Product User Guide (PUG) Vol. 3, section
+4.2.8. The projection parameters are taken from the goes_imager_projection
+variable in the files, x and y are the scan angles in radians as they come
+out of xarray (after scale_factor and add_offset).
+"""
+import json as _json
+import pathlib as _pl
+import numpy as _np
+
+
+def projection_parameters(ds):
+    """
+    Projection parameters from the goes_imager_projection variable of an ABI
+    dataset.
+
+    Returns
+    -------
+    dict
+        r_eq, r_pol, H (distance satellite to earth center), and lon_0
+        (radians).
+
+    """
+    attrs = ds['goes_imager_projection'].attrs
+    r_eq = float(attrs['semi_major_axis'])
+    return dict(r_eq = r_eq,
+                r_pol = float(attrs['semi_minor_axis']),
+                H = float(attrs['perspective_point_height']) + r_eq,
+                lon_0 = _np.deg2rad(float(attrs['longitude_of_projection_origin'])))
+
+
+def latlon2xy(lat, lon, proj):
+    """
+    Convert latitude and longitude (degrees) to fixed grid scan angles.
+
+    Parameters
+    ----------
+    lat, lon : array-like
+        Degrees.
+    proj : dict
+        As returned by projection_parameters.
+
+    Returns
+    -------
+    x, y : numpy.ndarray
+        Scan angles in radians. NaN where the point is not visible from the
+        satellite.
+
+    """
+    lat = _np.deg2rad(_np.asarray(lat, dtype = float))
+    lon = _np.deg2rad(_np.asarray(lon, dtype = float))
+    r_eq, r_pol, H = proj['r_eq'], proj['r_pol'], proj['H']
+    e2 = 1 - r_pol**2 / r_eq**2
+    phi_c = _np.arctan(r_pol**2 / r_eq**2 * _np.tan(lat))
+    r_c = r_pol / _np.sqrt(1 - e2 * _np.cos(phi_c)**2)
+    s_x = H - r_c * _np.cos(phi_c) * _np.cos(lon - proj['lon_0'])
+    s_y = -r_c * _np.cos(phi_c) * _np.sin(lon - proj['lon_0'])
+    s_z = r_c * _np.sin(phi_c)
+    visible = H * (H - s_x) >= s_y**2 + r_eq**2 / r_pol**2 * s_z**2
+    x = _np.arcsin(-s_y / _np.sqrt(s_x**2 + s_y**2 + s_z**2))
+    y = _np.arctan(s_z / s_x)
+    return _np.where(visible, x, _np.nan), _np.where(visible, y, _np.nan)
+
+
+def nearest_index(coord, values):
+    """
+    Index of the closest coordinate value for each value. coord has to be
+    monotonic (ascending or descending, like y in ABI files).
+    """
+    coord = _np.asarray(coord)
+    values = _np.asarray(values)
+    descending = coord[0] > coord[-1]
+    c = coord[::-1] if descending else coord
+    idx = _np.clip(_np.searchsorted(c, values), 1, c.size - 1)
+    idx -= _np.abs(values - c[idx - 1]) < _np.abs(values - c[idx])
+    if descending:
+        idx = c.size - 1 - idx
+    return idx
+
+
+def _bbox_outline(bbox, no_of_points = 50):
+    lon_min, lat_min, lon_max, lat_max = bbox
+    lons = _np.linspace(lon_min, lon_max, no_of_points)
+    lats = _np.linspace(lat_min, lat_max, no_of_points)
+    lat = _np.concatenate([_np.full(no_of_points, lat_min), _np.full(no_of_points, lat_max), lats, lats])
+    lon = _np.concatenate([lons, lons, _np.full(no_of_points, lon_min), _np.full(no_of_points, lon_max)])
+    return lat, lon
+
+
+class FixedGridWindow(object):
+    def __init__(self, bbox = None, points = None, margin = 1, path2cache = None):
+        """
+        Index window (slices in x and y) of an ABI dataset that covers a
+        bounding box or a set of points. Instances are meant to be passed as
+        isel to remote_read.read_subset.
+
+        The window only depends on the grid, so it is computed once per grid
+        (platform, scene, shape, and position of the first pixel; mesoscale
+        sectors move) and cached.
+
+        Parameters
+        ----------
+        bbox : tuple, optional
+            (lon_min, lat_min, lon_max, lat_max) in degrees.
+        points : list of tuple, optional
+            [(lat, lon), ...] in degrees.
+        margin : int, optional
+            Number of pixels added on each side. The default is 1.
+        path2cache : str, optional
+            JSON file to keep the cached windows between sessions and
+            processes. The default is None, only cached in memory.
+
+        """
+        assert(not (isinstance(bbox, type(None)) and isinstance(points, type(None)))), 'Either bbox or points has to be given.'
+        lat = []
+        lon = []
+        if not isinstance(bbox, type(None)):
+            blat, blon = _bbox_outline(bbox)
+            lat.append(blat)
+            lon.append(blon)
+        if not isinstance(points, type(None)):
+            points = _np.asarray(points, dtype = float).reshape(-1, 2)
+            lat.append(points[:, 0])
+            lon.append(points[:, 1])
+        self.lat = _np.concatenate(lat)
+        self.lon = _np.concatenate(lon)
+        self.bbox = bbox
+        self.margin = margin
+        self.path2cache = path2cache
+        self._cache = {}
+        if not isinstance(path2cache, type(None)) and _pl.Path(path2cache).is_file():
+            with open(path2cache) as f:
+                self._cache = _json.load(f)
+
+    @staticmethod
+    def grid_key(ds):
+        x = ds['x'].values
+        y = ds['y'].values
+        return f"{ds.attrs.get('platform_ID')}_{ds.attrs.get('scene_id')}_{x.size}x{y.size}_{x[0]:.6f}_{y[0]:.6f}"
+
+    def get_window(self, ds):
+        """
+        Returns
+        -------
+        dict
+            {'x': slice, 'y': slice}. Empty slices if nothing is visible.
+
+        """
+        key = self.grid_key(ds)
+        if key not in self._cache:
+            x = ds['x'].values
+            y = ds['y'].values
+            px, py = latlon2xy(self.lat, self.lon, projection_parameters(ds))
+            visible = ~_np.isnan(px)
+            window = [0, 0, 0, 0]
+            if visible.any():
+                # all pixels whose centers are within half a pixel of the covered range
+                dx = abs(x[1] - x[0]) / 2
+                dy = abs(y[1] - y[0]) / 2
+                ix = _np.nonzero((x >= px[visible].min() - dx) & (x <= px[visible].max() + dx))[0]
+                iy = _np.nonzero((y >= py[visible].min() - dy) & (y <= py[visible].max() + dy))[0]
+                if ix.size > 0 and iy.size > 0:
+                    window = [max(0, int(ix.min()) - self.margin), min(x.size, int(ix.max()) + 1 + self.margin),
+                              max(0, int(iy.min()) - self.margin), min(y.size, int(iy.max()) + 1 + self.margin)]
+            self._cache[key] = window
+            if not isinstance(self.path2cache, type(None)):
+                with open(self.path2cache, 'w') as f:
+                    _json.dump(self._cache, f)
+        x0, x1, y0, y1 = self._cache[key]
+        return {'x': slice(x0, x1), 'y': slice(y0, y1)}
+
+    def __call__(self, ds):
+        return self.get_window(ds)
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+Footprints of polar orbiter (JPSS) granules, to filter them by area before
+anything is downloaded.
+
+The bounding box of a granule is taken from the global attributes
+geospatial_lat_min/max and geospatial_lon_min/max, which are read remotely
+(only the HDF5 metadata is transferred). If they are missing, it is taken
+from the latitude and longitude variables. Granules do not change, so their
+footprints can be kept in a SQLite file forever.
+
+h5netcdf is only needed when footprints are read.
+"""
+import pathlib as _pl
+import concurrent.futures as _futures
+import numpy as _np
+import pandas as _pd
+from nesdis_aws import utils as _utils
+
+columns = ['lat_min', 'lat_max', 'lon_min', 'lon_max']
+
+_schema = """
+CREATE TABLE IF NOT EXISTS footprints (
+    key TEXT PRIMARY KEY,
+    lat_min REAL,
+    lat_max REAL,
+    lon_min REAL,
+    lon_max REAL
+);
+"""
+
+_lat_names = ['Latitude', 'latitude', 'lat']
+_lon_names = ['Longitude', 'longitude', 'lon']
+
+
+def read_footprint(fs, key, block_size = 2**16):
+    """
+    Bounding box of a remote granule.
+
+    Returns
+    -------
+    tuple
+        (lat_min, lat_max, lon_min, lon_max) in degrees.
+
+    """
+    import h5netcdf as _h5netcdf
+    with fs.open(_pl.Path(key).as_posix(), 'rb', block_size = block_size, cache_type = 'blockcache') as fileobj:
+        with _h5netcdf.File(fileobj, 'r') as f:
+            attrs = f.attrs
+            names = [f'geospatial_{c}' for c in columns]
+            if all(name in attrs for name in names):
+                return tuple(float(_np.asarray(attrs[name]).ravel()[0]) for name in names)
+            lat = f.variables[[n for n in _lat_names if n in f.variables][0]][...]
+            lon = f.variables[[n for n in _lon_names if n in f.variables][0]][...]
+            # fill values are outside of the valid range
+            lat = lat[(lat >= -90) & (lat <= 90)]
+            lon = lon[(lon >= -180) & (lon <= 180)]
+            return float(lat.min()), float(lat.max()), float(lon.min()), float(lon.max())
+
+
+def read_footprints(fs, keys, max_concurrency = 16):
+    """
+    Footprints of many granules, read concurrently.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Index are the keys, columns lat_min, lat_max, lon_min, lon_max.
+        NaN if the footprint could not be read.
+
+    """
+    def read(key):
+        try:
+            return read_footprint(fs, key)
+        except Exception:
+            return (_np.nan,) * 4
+    keys = list(keys)
+    with _futures.ThreadPoolExecutor(max_workers = max_concurrency) as executor:
+        results = list(executor.map(read, keys))
+    return _pd.DataFrame(results, index = _pd.Index(keys, dtype = object), columns = columns, dtype = float)
+
+
+def intersects(footprints, bbox):
+    """
+    Which footprints overlap the bounding box.
+
+    Parameters
+    ----------
+    footprints : pandas.DataFrame
+        As returned by read_footprints.
+    bbox : tuple
+        (lon_min, lat_min, lon_max, lat_max) in degrees. lon_min > lon_max
+        stands for a box across the antimeridian.
+
+    Returns
+    -------
+    pandas.Series of bool
+        Footprints that are unknown (NaN) are kept.
+
+    """
+    lon_min, lat_min, lon_max, lat_max = bbox
+    lat = (footprints.lat_max >= lat_min) & (footprints.lat_min <= lat_max)
+    if lon_min <= lon_max:
+        lon = (footprints.lon_max >= lon_min) & (footprints.lon_min <= lon_max)
+    else:
+        lon = (footprints.lon_max >= lon_min) | (footprints.lon_min <= lon_max)
+    unknown = footprints[columns].isna().any(axis = 1)
+    return (lat & lon) | unknown
+
+
+class FootprintIndex(object):
+    def __init__(self, path2db):
+        """
+        SQLite file with the footprints of granules, shared between queries
+        and processes.
+        """
+        self.path2db = _pl.Path(path2db)
+        self.path2db.parent.mkdir(parents = True, exist_ok = True)
+        with _utils.connect(self.path2db) as con:
+            con.executescript(_schema)
+
+    def get(self, keys):
+        """Footprints of the keys that are in the index (see read_footprints)."""
+        keys = list(keys)
+        rows = []
+        with _utils.connect(self.path2db) as con:
+            for i in range(0, len(keys), 500):
+                sub = keys[i:i+500]
+                marks = ','.join('?' * len(sub))
+                rows += con.execute(f'SELECT key, lat_min, lat_max, lon_min, lon_max FROM footprints WHERE key IN ({marks})', sub).fetchall()
+        return _pd.DataFrame(rows, columns = ['key'] + columns).set_index('key').astype(float)
+
+    def put(self, footprints):
+        """Store footprints, those that could not be read (NaN) are left out."""
+        footprints = footprints.dropna()
+        with _utils.connect(self.path2db) as con:
+            con.executemany('INSERT OR REPLACE INTO footprints (key, lat_min, lat_max, lon_min, lon_max) VALUES (?,?,?,?,?)',
+                            [(key, *row) for key, row in zip(footprints.index, footprints[columns].itertuples(index = False))])
+        return
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Crash-safe journal of the state of each file of a (long) run.
+
+Every key on AWS goes through the states listed -> downloading -> downloaded
+-> processed, or ends up as failed (with the error). Since files are written
+to a temporary name and only renamed when complete, a file is only
+considered done if the journal says so. A restarted run skips everything
+that is done without looking at the files.
+"""
+import time as _time
+import pathlib as _pl
+from nesdis_aws import utils as _utils
+
+states = ['listed', 'downloading', 'downloaded', 'processed', 'failed']
+
+_schema = """
+CREATE TABLE IF NOT EXISTS journal (
+    key TEXT PRIMARY KEY,
+    state TEXT,
+    error TEXT,
+    updated REAL
+);
+CREATE INDEX IF NOT EXISTS journal_state ON journal (state);
+"""
+
+
+class RunJournal(object):
+    def __init__(self, path2db):
+        """
+        SQLite backed journal of the state of each key.
+
+        Parameters
+        ----------
+        path2db : str or pathlib.Path
+            Path to the SQLite file. It is created if it does not exist.
+
+        """
+        self.path2db = _pl.Path(path2db)
+        self.path2db.parent.mkdir(parents=True, exist_ok=True)
+        with _utils.connect(self.path2db) as con:
+            con.executescript(_schema)
+
+    def set_state(self, keys, state, errors = None):
+        """
+        Parameters
+        ----------
+        keys : iterable of str
+        state : str
+            One of states.
+        errors : iterable of str, optional
+            One error message per key, only for state 'failed'.
+
+        """
+        assert(state in states), f'state has to be one of {states}, not {state}.'
+        keys = [str(k) for k in keys]
+        if isinstance(errors, type(None)):
+            errors = [None] * len(keys)
+        now = _time.time()
+        with _utils.connect(self.path2db) as con:
+            con.executemany('INSERT OR REPLACE INTO journal (key, state, error, updated) VALUES (?,?,?,?)',
+                            [(k, state, e, now) for k, e in zip(keys, errors)])
+        return
+
+    def add_listed(self, keys):
+        """Add keys in the state 'listed', keys that are already in the journal are left alone."""
+        now = _time.time()
+        with _utils.connect(self.path2db) as con:
+            con.executemany('INSERT OR IGNORE INTO journal (key, state, error, updated) VALUES (?,?,NULL,?)',
+                            [(str(k), 'listed', now) for k in keys])
+        return
+
+    def get_state(self, key):
+        """State of one key, None if it is not in the journal."""
+        with _utils.connect(self.path2db) as con:
+            out = con.execute('SELECT state FROM journal WHERE key = ?', (str(key),)).fetchone()
+        return None if isinstance(out, type(None)) else out[0]
+
+    def keys_in_state(self, state, keys = None):
+        """
+        Set of the keys in the given state (str) or states (list).
+
+        Parameters
+        ----------
+        state : str or list
+        keys : iterable of str, optional
+            Only these keys are looked up, e.g. the ones of a workplan, 
+            instead of all keys in the journal. They are joined against the
+            journal in a temporary table. The default is None.
+
+        """
+        if isinstance(state, str):
+            state = [state]
+        marks = ','.join('?' * len(state))
+        with _utils.connect(self.path2db) as con:
+            if isinstance(keys, type(None)):
+                return set(k for (k,) in con.execute(f'SELECT key FROM journal WHERE state IN ({marks})', state))
+            # the temporary table lives as long as the connection
+            con.execute('CREATE TEMP TABLE wanted (key TEXT PRIMARY KEY)')
+            con.executemany('INSERT OR IGNORE INTO wanted (key) VALUES (?)', [(str(k),) for k in keys])
+            return set(k for (k,) in con.execute(f'SELECT journal.key FROM wanted JOIN journal ON journal.key = wanted.key WHERE journal.state IN ({marks})', state))
+
+    def summary(self):
+        """Number of keys in each state."""
+        with _utils.connect(self.path2db) as con:
+            return dict(con.execute('SELECT state, COUNT(*) FROM journal GROUP BY state').fetchall())
+
+    def errors(self):
+        """dict of key -> error for all failed keys."""
+        with _utils.connect(self.path2db) as con:
+            return dict(con.execute("SELECT key, error FROM journal WHERE state = 'failed'").fetchall())
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent local index of the keys on AWS.
+
+Folders of past hours (noaa-goesNN/<product><sector>/<year>/<doy>/<hour>)
+never change once the hour is over and the last files came in. Those are
+listed once and then served from the index forever. Only hours that are
+still filling up are listed again, and not more often than a given ttl.
+"""
+import time as _time
+import pathlib as _pl
+import pandas as _pd
+from nesdis_aws import utils as _utils
+
+_schema = """
+CREATE TABLE IF NOT EXISTS folders (
+    folder TEXT PRIMARY KEY,
+    satellite TEXT,
+    product TEXT,
+    scan_sector TEXT,
+    hour TEXT,
+    listed_at REAL,
+    closed INTEGER
+);
+CREATE TABLE IF NOT EXISTS keys (
+    key TEXT PRIMARY KEY,
+    folder TEXT,
+    size INTEGER,
+    etag TEXT
+);
+CREATE INDEX IF NOT EXISTS keys_folder ON keys (folder);
+"""
+
+
+class KeyIndex(object):
+    def __init__(self, path2db, ttl = 600, closed_after = '1h'):
+        """
+        SQLite backed index of the files in the hour folders on AWS.
+
+        Parameters
+        ----------
+        path2db : str or pathlib.Path
+            Path to the SQLite file. It is created if it does not exist.
+            Several processes can share the same file.
+        ttl : float, optional
+            Seconds after which the listing of an hour that is not closed
+            yet is considered outdated. The default is 600.
+        closed_after : str or pandas.Timedelta, optional
+            Time after the end of an hour after which no new files are
+            expected in its folder. Folders of hours that ended longer ago
+            than this are cached permanently. The default is '1h'.
+
+        """
+        self.path2db = _pl.Path(path2db)
+        self.ttl = ttl
+        self.closed_after = _pd.to_timedelta(closed_after)
+        self.path2db.parent.mkdir(parents=True, exist_ok=True)
+        with _utils.connect(self.path2db) as con:
+            con.executescript(_schema)
+
+    def is_closed(self, hour):
+        """True if the folder of this hour (start of hour, UTC) will not change anymore."""
+        now = _pd.Timestamp.now(tz = 'UTC').tz_localize(None)
+        return _pd.to_datetime(hour) + _pd.Timedelta('1h') + self.closed_after < now
+
+    def get(self, folders):
+        """
+        Look up the files of hour folders.
+
+        Parameters
+        ----------
+        folders : iterable of str
+            Hour folders.
+
+        Returns
+        -------
+        cached : dict
+            Maps folders that are up to date in the index to a list of
+            info dicts (name, size, ETag), the same format as
+            transfer.list_folders.
+        missing : list
+            Folders that need to be listed (again).
+
+        """
+        folders = list(folders)
+        now = _time.time()
+        cached = {}
+        with _utils.connect(self.path2db) as con:
+            # sqlite limits the number of parameters per query
+            for i in range(0, len(folders), 500):
+                sub = folders[i:i+500]
+                marks = ','.join('?' * len(sub))
+                rows = con.execute(f'SELECT folder, listed_at, closed FROM folders WHERE folder IN ({marks})', sub).fetchall()
+                fresh = [folder for folder, listed_at, closed in rows if closed or (now - listed_at) < self.ttl]
+                for folder in fresh:
+                    cached[folder] = []
+                if len(fresh) == 0:
+                    continue
+                marks = ','.join('?' * len(fresh))
+                for key, folder, size, etag in con.execute(f'SELECT key, folder, size, etag FROM keys WHERE folder IN ({marks}) ORDER BY key', fresh):
+                    cached[folder].append({'name': key, 'size': size, 'ETag': etag, 'type': 'file'})
+        missing = [folder for folder in folders if folder not in cached]
+        return cached, missing
+
+    def put(self, listings, hours, satellite = None, product = None, scan_sector = None):
+        """
+        Store the results of listing hour folders. Previous entries of
+        these folders are replaced.
+
+        Parameters
+        ----------
+        listings : dict
+            Maps hour folders to lists of info dicts as returned by 
+            transfer.list_folders.
+        hours : dict or pandas.Series
+            Maps the same hour folders to the start of the hour (UTC) they 
+            stand for.
+        satellite, product, scan_sector : str, optional
+            Stored alongside for inspection of the index.
+
+        """
+        now = _time.time()
+        with _utils.connect(self.path2db) as con:
+            for folder, files in listings.items():
+                hour = _pd.to_datetime(hours[folder])
+                con.execute('DELETE FROM keys WHERE folder = ?', (folder,))
+                con.executemany('INSERT OR REPLACE INTO keys (key, folder, size, etag) VALUES (?,?,?,?)',
+                                [(f['name'], folder, f.get('size'), f.get('ETag')) for f in files])
+                con.execute('INSERT OR REPLACE INTO folders (folder, satellite, product, scan_sector, hour, listed_at, closed) VALUES (?,?,?,?,?,?,?)',
+                            (folder, satellite, product, scan_sector, hour.isoformat(), now, int(self.is_closed(hour))))
+        return
+
+    def clear(self):
+        """Remove all entries."""
+        with _utils.connect(self.path2db) as con:
+            con.execute('DELETE FROM keys')
+            con.execute('DELETE FROM folders')
+        return
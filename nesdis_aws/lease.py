@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+"""
+Lease based sharding of a workplan between several hosts.
+
+All hosts point at the same folder on a shared file system (e.g. NFS). The
+first host saves its workplan there (workplan.parquet), all others use that
+one, so every host sees the same rows in the same order. The rows are cut
+into batches of batch_size. A host claims a batch by creating its lease file
+with O_CREAT | O_EXCL, which is atomic on NFS as well (SQLite locking is
+not reliable there). While the batch is processed the lease is renewed
+(mtime of the lease file). When all rows of the batch reported back a done
+file is written, rows that failed are listed in a failed file next to it;
+if the batch is interrupted the lease is removed, so another host can take
+it. Leases that
+were not renewed for lease_seconds (the host died) are taken over. The
+clocks of the hosts need to agree to well within lease_seconds.
+"""
+import os as _os
+import json as _json
+import time as _time
+import uuid as _uuid
+import random as _random
+import hashlib as _hashlib
+import threading as _threading
+import pathlib as _pl
+from nesdis_aws import workplan as _workplan
+from nesdis_aws import utils as _utils
+
+
+def _create_exclusive(path, content):
+    """Create path with content, False if it exists already."""
+    try:
+        fd = _os.open(path, _os.O_CREAT | _os.O_EXCL | _os.O_WRONLY, 0o644)
+    except FileExistsError:
+        return False
+    with _os.fdopen(fd, 'w') as f:
+        f.write(content)
+    return True
+
+
+def _read(path):
+    """Content of path, None if it does not exist (anymore)."""
+    try:
+        with open(path) as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+class Lease(object):
+    def __init__(self, store, batch, token):
+        """
+        A claimed batch, see LeaseStore.claim. Used as context manager: the
+        lease is renewed in the background, on exit the batch is marked
+        done, or released if an exception was raised. Without the context
+        manager call start, and done or release.
+        """
+        self.store = store
+        self.batch = batch
+        self.token = token
+        self.path = store._lease_path(batch)
+        self.rows = range(batch * store.batch_size, min((batch + 1) * store.batch_size, store.no_of_rows))
+        self._stop = _threading.Event()
+        self._heartbeat = None
+
+    def is_mine(self):
+        """False if the lease expired and was taken over by another host."""
+        return _read(self.path) == self.token
+
+    def renew(self):
+        if self.is_mine():
+            _os.utime(self.path)
+        return
+
+    def _renew_until_stopped(self):
+        while not self._stop.wait(self.store.lease_seconds / 3):
+            self.renew()
+
+    def start(self):
+        """Renew the lease in the background until done or release."""
+        self._heartbeat = _threading.Thread(target = self._renew_until_stopped, daemon = True)
+        self._heartbeat.start()
+        return self
+
+    def done(self, failed = []):
+        """
+        Mark the batch as done and remove the lease.
+
+        Parameters
+        ----------
+        failed : list of int, optional
+            Rows of the batch that failed, recorded in the failed file (see
+            LeaseStore.failed). The default is [].
+
+        """
+        if len(failed) > 0:
+            # written before the done file, so whoever sees the batch done sees its failures
+            with _utils.atomic_path(self.store._failed_path(self.batch)) as part:
+                part.write_text(_json.dumps({'owner': self.token, 'rows': sorted(int(i) for i in failed)}))
+        _create_exclusive(self.store._done_path(self.batch), self.token)
+        self.store._done.add(self.batch)
+        self.release()
+        return
+
+    def release(self):
+        """Remove the lease, the batch can be claimed again."""
+        self._stop.set()
+        if not isinstance(self._heartbeat, type(None)):
+            self._heartbeat.join()
+        if self.is_mine():
+            self.path.unlink(missing_ok = True)
+        self.store._held.discard(self.batch)
+        return
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if isinstance(exc_type, type(None)):
+            self.done()
+        else:
+            self.release()
+        return False
+
+
+class LeaseStore(object):
+    def __init__(self, path2leases, batch_size = 100, lease_seconds = 600, poll_interval = 30, owner = None):
+        """
+        Parameters
+        ----------
+        path2leases : str or pathlib.Path
+            Folder on a file system that all hosts share.
+        batch_size : int, optional
+            Number of workplan rows per batch. Has to be the same on all
+            hosts, the first host decides. The default is 100.
+        lease_seconds : float, optional
+            A lease that was not renewed for this long is taken over by
+            another host. Leases are renewed every lease_seconds / 3. The
+            default is 600.
+        poll_interval : float, optional
+            Seconds between looking for batches again when all remaining
+            ones are leased by other hosts. The default is 30.
+        owner : str, optional
+            Written to the leases. The default is None, <hostname>:<pid>.
+
+        """
+        self.path2leases = _pl.Path(path2leases)
+        self.path2leases.mkdir(parents = True, exist_ok = True)
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.owner = _utils.owner() if isinstance(owner, type(None)) else owner
+        self.path2settings = self.path2leases.joinpath('settings.json')
+        _create_exclusive(self.path2settings, _json.dumps({'batch_size': batch_size}))
+        self.batch_size = _json.loads(_read(self.path2settings))['batch_size']
+        assert(self.batch_size == batch_size), f'The leases in {self.path2leases} are for batches of {self.batch_size} rows, not {batch_size}.'
+        self.path2workplan = self.path2leases.joinpath('workplan.parquet')
+        self.no_of_rows = None
+        # batches leased by this store and not done or released yet
+        self._held = set()
+        # batches known to be done, they are not looked at again
+        self._done = set()
+
+    def _lease_path(self, batch):
+        return self.path2leases.joinpath(f'batch_{batch:07d}.lease')
+
+    def _done_path(self, batch):
+        return self.path2leases.joinpath(f'batch_{batch:07d}.done')
+
+    def _failed_path(self, batch):
+        return self.path2leases.joinpath(f'batch_{batch:07d}.failed')
+
+    @property
+    def no_of_batches(self):
+        return -(-self.no_of_rows // self.batch_size)
+
+    def shared_workplan(self, make):
+        """
+        The workplan all hosts work on. If there is none yet, make() is
+        called and the result (workplan.CompactWorkplan) is saved; if
+        another host was faster, its workplan is used.
+        """
+        if not self.path2workplan.is_file():
+            part = self.path2leases.joinpath(f'.workplan_{_uuid.uuid4().hex}.parquet')
+            make().to_parquet(part)
+            try:
+                # a hard link fails if the target exists, unlike a rename
+                _os.link(part, self.path2workplan)
+            except FileExistsError:
+                pass
+            part.unlink()
+        workplan = _workplan.CompactWorkplan.read_parquet(self.path2workplan)
+        self.no_of_rows = len(workplan)
+        return workplan
+
+    def _acquire(self, batch):
+        """Lease for batch, None if another host holds a valid lease."""
+        lease = self._create_lease(batch)
+        if not isinstance(lease, type(None)) and self._done_path(batch).is_file():
+            # finished by another host right before (done is written before its lease is removed)
+            self._done.add(batch)
+            lease.release()
+            return None
+        return lease
+
+    def _create_lease(self, batch):
+        path = self._lease_path(batch)
+        token = f'{self.owner} {_uuid.uuid4().hex}'
+        if _create_exclusive(path, token):
+            return Lease(self, batch, token)
+        stale = _read(path)
+        try:
+            age = _time.time() - path.stat().st_mtime
+        except FileNotFoundError:
+            # released just now, try again next round
+            return None
+        if isinstance(stale, type(None)) or age < self.lease_seconds:
+            return None
+        # only one host may take over this particular stale lease
+        steal = self.path2leases.joinpath(f'batch_{batch:07d}.steal_{_hashlib.sha1(stale.encode()).hexdigest()[:16]}')
+        if not _create_exclusive(steal, token):
+            try:
+                if _time.time() - steal.stat().st_mtime > self.lease_seconds:
+                    # the host that took over died in between
+                    steal.unlink(missing_ok = True)
+            except FileNotFoundError:
+                pass
+            return None
+        try:
+            if _read(path) != stale:
+                return None
+            path.unlink(missing_ok = True)
+            if not _create_exclusive(path, token):
+                return None
+        finally:
+            steal.unlink(missing_ok = True)
+        return Lease(self, batch, token)
+
+    def claim(self, wait = True):
+        """
+        Yields leases (see Lease) of batches that are not done, until all
+        batches are done. If the remaining batches are leased by other
+        hosts, it waits for them to finish, or to expire and be taken over.
+        Call shared_workplan first.
+        
+        Each look at the batches starts at a random one, so hosts that start
+        together do not all race for the same leases. Batches seen done are
+        remembered and not looked at again.
+
+        Parameters
+        ----------
+        wait : bool, optional
+            If False, None is yielded instead of sleeping while there is 
+            nothing to claim, so the caller can go on with the leases it 
+            holds. The batches are looked at again after poll_interval, or
+            as soon as one of the held leases is done or released. The 
+            default is True.
+
+        """
+        assert(not isinstance(self.no_of_rows, type(None))), 'Call shared_workplan first.'
+        if self.no_of_batches == 0:
+            return
+        while True:
+            pending = False
+            claimed = False
+            offset = _random.randrange(self.no_of_batches)
+            for i in range(self.no_of_batches):
+                batch = (offset + i) % self.no_of_batches
+                if batch in self._done:
+                    continue
+                if self._done_path(batch).is_file():
+                    self._done.add(batch)
+                    continue
+                lease = self._acquire(batch)
+                if isinstance(lease, type(None)):
+                    pending = True
+                    continue
+                claimed = True
+                self._held.add(batch)
+                yield lease
+            if not pending:
+                return
+            if claimed:
+                continue
+            if wait:
+                _time.sleep(self.poll_interval)
+                continue
+            held = set(self._held)
+            next_look = _time.time() + self.poll_interval
+            while True:
+                yield None
+                if _time.time() >= next_look or self._held != held:
+                    break
+
+    def failed(self):
+        """
+        Returns
+        -------
+        list of int
+            Workplan rows that failed in batches that are done (by any 
+            host).
+
+        """
+        rows = []
+        for path in sorted(self.path2leases.glob('batch_*.failed')):
+            rows += _json.loads(path.read_text())['rows']
+        return rows
+
+    def progress(self):
+        """
+        Returns
+        -------
+        dict
+            no_of_batches, done, leased (by any host), free, and failed 
+            (number of rows, see failed).
+
+        """
+        assert(not isinstance(self.no_of_rows, type(None))), 'Call shared_workplan first.'
+        names = set(p.name for p in self.path2leases.iterdir())
+        done = sum(f'batch_{b:07d}.done' in names for b in range(self.no_of_batches))
+        leased = sum(f'batch_{b:07d}.lease' in names and f'batch_{b:07d}.done' not in names for b in range(self.no_of_batches))
+        return dict(no_of_batches = self.no_of_batches, done = done, leased = leased, free = self.no_of_batches - done - leased,
+                    failed = len(self.failed()))
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+Memory instrumentation for long running processing.
+
+The resident set size (RSS) of the process is sampled before and after each
+stage of each file (fetch, process, cleanup), so growth can be attributed to
+a stage. Optionally tracemalloc snapshots are dumped every so many files.
+The monitor also decides when the filesystem client should be replaced
+because memory grew beyond a threshold since it was created.
+"""
+import os as _os
+import time as _time
+import pathlib as _pl
+import tracemalloc as _tracemalloc
+import contextlib as _contextlib
+import pandas as _pd
+
+
+def rss():
+    """Resident set size of the current process in bytes."""
+    import psutil as _psutil
+    return _psutil.Process(_os.getpid()).memory_info().rss
+
+
+class MemoryMonitor(object):
+    def __init__(self, recycle_fs_growth_mb = None, snapshot_every = None, path2snapshots = None, nframes = 10):
+        """
+        Records the memory use per file and stage, see AwsQuery.process.
+
+        Parameters
+        ----------
+        recycle_fs_growth_mb : float, optional
+            If the RSS grew by more than this since the filesystem client
+            was created (or last recycled), fs_recycle_due returns True and
+            AwsQuery.process replaces the client. The default is None,
+            never.
+        snapshot_every : int, optional
+            Dump a tracemalloc snapshot every this many files. Starts
+            tracemalloc, which slows things down noticeably. The default is
+            None, no snapshots.
+        path2snapshots : str, optional
+            Folder for the snapshots (snapshot_<no of files>.tracemalloc),
+            they can be loaded with tracemalloc.Snapshot.load. The default
+            is None, snapshots are only kept in memory (see top_growth).
+        nframes : int, optional
+            Number of frames tracemalloc keeps per allocation. The default
+            is 10.
+
+        """
+        self.recycle_fs_growth_mb = recycle_fs_growth_mb
+        self.snapshot_every = snapshot_every
+        self.path2snapshots = None if isinstance(path2snapshots, type(None)) else _pl.Path(path2snapshots)
+        self.no_of_files = 0
+        self.no_of_fs_recycles = 0
+        self._records = []
+        self._first_snapshot = None
+        self._last_snapshot = None
+        if not isinstance(snapshot_every, type(None)):
+            if not _tracemalloc.is_tracing():
+                _tracemalloc.start(nframes)
+            if not isinstance(self.path2snapshots, type(None)):
+                self.path2snapshots.mkdir(parents = True, exist_ok = True)
+        self.rss_start = self._rss_fs = rss()
+
+    @_contextlib.contextmanager
+    def stage(self, name, key = None):
+        """
+        Context manager that records the RSS before and after a stage.
+
+        Parameters
+        ----------
+        name : str
+            E.g. 'fetch', 'process', 'cleanup'.
+        key : str, optional
+            The file the stage worked on.
+
+        """
+        rss_before = rss()
+        start_time = _time.perf_counter()
+        try:
+            yield
+        finally:
+            rss_after = rss()
+            self._records.append(dict(key = key, stage = name,
+                                      rss_before = rss_before, rss_after = rss_after,
+                                      growth = rss_after - rss_before,
+                                      seconds = _time.perf_counter() - start_time))
+
+    def file_done(self):
+        """Count a finished file and take a tracemalloc snapshot if due."""
+        self.no_of_files += 1
+        if isinstance(self.snapshot_every, type(None)) or self.no_of_files % self.snapshot_every != 0:
+            return
+        snapshot = _tracemalloc.take_snapshot()
+        if isinstance(self._first_snapshot, type(None)):
+            self._first_snapshot = snapshot
+        self._last_snapshot = snapshot
+        if not isinstance(self.path2snapshots, type(None)):
+            snapshot.dump(self.path2snapshots.joinpath(f'snapshot_{self.no_of_files:07d}.tracemalloc').as_posix())
+        return
+
+    def fs_recycle_due(self):
+        """True if the RSS grew more than recycle_fs_growth_mb since the client was (re)created."""
+        if isinstance(self.recycle_fs_growth_mb, type(None)):
+            return False
+        return (rss() - self._rss_fs) * 1e-6 > self.recycle_fs_growth_mb
+
+    def fs_recycled(self):
+        """Call after the filesystem client was replaced, resets the reference."""
+        self.no_of_fs_recycles += 1
+        self._rss_fs = rss()
+        return
+
+    @property
+    def records(self):
+        """pandas.DataFrame with one row per stage and file, memory in bytes."""
+        return _pd.DataFrame(self._records, columns = ['key', 'stage', 'rss_before', 'rss_after', 'growth', 'seconds'])
+
+    def summary(self):
+        """
+        Memory growth attributed to each stage.
+
+        Returns
+        -------
+        pandas.DataFrame
+            Per stage: number of calls, total and mean growth (MB), and
+            total time (s).
+
+        """
+        records = self.records
+        out = records.groupby('stage').agg(no_of_calls = ('growth', 'size'),
+                                           growth_mb = ('growth', 'sum'),
+                                           mean_growth_mb = ('growth', 'mean'),
+                                           seconds = ('seconds', 'sum'))
+        out['growth_mb'] *= 1e-6
+        out['mean_growth_mb'] *= 1e-6
+        return out
+
+    def top_growth(self, top = 10):
+        """
+        Source lines that allocated the most memory between the first and
+        the last snapshot.
+
+        Returns
+        -------
+        list of tracemalloc.StatisticDiff
+
+        """
+        assert(not isinstance(self._first_snapshot, type(None))), 'No snapshots taken, set snapshot_every.'
+        return self._last_snapshot.compare_to(self._first_snapshot, 'lineno')[:top]
+
+    def info(self):
+        """Short text summary."""
+        now = rss()
+        return (f'files: {self.no_of_files}\n'
+                f'rss: {now * 1e-6:0.0f} mb (growth since start: {(now - self.rss_start) * 1e-6:0.0f} mb)\n'
+                f'filesystem recycled: {self.no_of_fs_recycles} times\n')
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+Per-stage timing and throughput metrics.
+
+A Metrics object collects counters (e.g. bytes downloaded), gauges (e.g.
+queue depth), and summaries (count, sum, min, max of e.g. the seconds a
+listing request took), each optionally with labels. It is thread safe and
+can be exported to a local file as JSON lines or in the Prometheus text
+format (e.g. for the textfile collector of the node exporter).
+
+Names used by nesdis_aws (times in seconds, sizes in bytes):
+
+    list_requests, list_keys       counters, label kind (folder, recursive)
+    list_seconds                   summary per listing request
+    download_files                 counter, label status
+    download_bytes                 counter
+    download_seconds               summary per file
+    process_seconds                summary per file, label status
+    queue_depth                    gauge, label queue (prefetch, workers)
+    workers_busy                   gauge
+    retries                        counter, keys that failed before and are tried again
+"""
+import json as _json
+import time as _time
+import threading as _threading
+import contextlib as _contextlib
+import pathlib as _pl
+import pandas as _pd
+from nesdis_aws import utils as _utils
+
+formats = ['jsonl', 'prometheus']
+
+
+def _labels2str(labels):
+    return ','.join(f'{k}="{v}"' for k, v in labels)
+
+
+class Metrics(object):
+    def __init__(self, path2file = None, format = 'jsonl', export_interval = 60, prefix = 'nesdis_aws'):
+        """
+        Parameters
+        ----------
+        path2file : str, optional
+            File the metrics are exported to by export and maybe_export.
+            JSON lines are appended, the Prometheus file is replaced. The
+            default is None, metrics are only kept in memory.
+        format : str, optional
+            'jsonl' or 'prometheus'. The default is 'jsonl'.
+        export_interval : float, optional
+            Min seconds between two exports by maybe_export. The default is
+            60.
+        prefix : str, optional
+            Prefix of the metric names in the Prometheus format. The default
+            is 'nesdis_aws'.
+
+        """
+        assert(format in formats), f'format has to be one of {formats}, not {format}.'
+        self.path2file = None if isinstance(path2file, type(None)) else _pl.Path(path2file)
+        self.format = format
+        self.export_interval = export_interval
+        self.prefix = prefix
+        self.start_time = _time.time()
+        self._last_export = 0
+        self._lock = _threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._summaries = {}
+
+    def inc(self, name, value = 1, **labels):
+        """Increase a counter."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        """Set a gauge."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name, value, **labels):
+        """Add an observation to a summary."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            s = self._summaries.get(key)
+            if isinstance(s, type(None)):
+                self._summaries[key] = [1, value, value, value]
+            else:
+                s[0] += 1
+                s[1] += value
+                s[2] = min(s[2], value)
+                s[3] = max(s[3], value)
+
+    @_contextlib.contextmanager
+    def timer(self, name, **labels):
+        """Context manager that observes the seconds it took."""
+        start_time = _time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, _time.perf_counter() - start_time, **labels)
+
+    def _rows(self):
+        rows = []
+        with self._lock:
+            for (name, labels), value in self._counters.items():
+                rows.append(dict(name = name, labels = dict(labels), type = 'counter', value = value))
+            for (name, labels), value in self._gauges.items():
+                rows.append(dict(name = name, labels = dict(labels), type = 'gauge', value = value))
+            for (name, labels), (count, total, vmin, vmax) in self._summaries.items():
+                rows.append(dict(name = name, labels = dict(labels), type = 'summary',
+                                 count = count, sum = total, min = vmin, max = vmax, mean = total / count))
+        return rows
+
+    def to_frame(self):
+        """
+        Returns
+        -------
+        pandas.DataFrame
+            One row per metric and label set with the columns name,
+            labels, type, value (counters and gauges), and count, sum, min,
+            max, mean (summaries).
+
+        """
+        rows = self._rows()
+        for row in rows:
+            row['labels'] = _labels2str(sorted(row['labels'].items()))
+        columns = ['name', 'labels', 'type', 'value', 'count', 'sum', 'min', 'max', 'mean']
+        return _pd.DataFrame(rows, columns = columns).sort_values(['name', 'labels']).reset_index(drop = True)
+
+    def info(self):
+        """
+        Where the time went: total seconds spent listing, downloading, and
+        processing, and the download throughput. Downloads and listings
+        overlap if they run concurrently, so the sums can exceed the wall
+        time.
+        """
+        df = self.to_frame()
+        def total(name, column):
+            return df[df.name == name][column].sum()
+        wall = _time.time() - self.start_time
+        download_seconds = total('download_seconds', 'sum')
+        download_bytes = total('download_bytes', 'value')
+        mbps = download_bytes * 1e-6 / download_seconds if download_seconds > 0 else float('nan')
+        return (f'wall time: {wall:0.1f} s\n'
+                f'listing: {total("list_requests", "value"):0.0f} requests, {total("list_seconds", "sum"):0.1f} s\n'
+                f'download: {total("download_files", "value"):0.0f} files, {download_bytes * 1e-6:0.1f} mb, {download_seconds:0.1f} s ({mbps:0.1f} mb/s per file)\n'
+                f'process: {total("process_seconds", "count"):0.0f} files, {total("process_seconds", "sum"):0.1f} s\n'
+                f'retries: {total("retries", "value"):0.0f}\n')
+
+    def to_jsonl(self, path2file):
+        """Append one JSON line per metric, all with the same timestamp."""
+        now = _time.time()
+        with open(path2file, 'a') as f:
+            for row in self._rows():
+                f.write(_json.dumps(dict(time = now, **row)) + '\n')
+
+    def to_prometheus(self, path2file = None):
+        """
+        Metrics in the Prometheus text format. Counters get the suffix
+        _total, summaries are exported as summary families (_count and 
+        _sum) plus the gauges _min and _max. All samples of a family are
+        written together under its TYPE line. If path2file is given the 
+        file is replaced atomically, otherwise the text is returned.
+        """
+        # family name -> (type, sample lines), in the order of first appearance
+        families = {}
+        def sample(family, kind, name, labels, value):
+            lines = families.setdefault(family, (kind, []))[1]
+            lines.append(f'{name}{{{_labels2str(labels)}}} {value}' if len(labels) > 0 else f'{name} {value}')
+        with self._lock:
+            for (name, labels), value in sorted(self._counters.items()):
+                family = f'{self.prefix}_{name}_total'
+                sample(family, 'counter', family, labels, value)
+            for (name, labels), value in sorted(self._gauges.items()):
+                family = f'{self.prefix}_{name}'
+                sample(family, 'gauge', family, labels, value)
+            for (name, labels), (count, total, vmin, vmax) in sorted(self._summaries.items()):
+                family = f'{self.prefix}_{name}'
+                sample(family, 'summary', f'{family}_count', labels, count)
+                sample(family, 'summary', f'{family}_sum', labels, total)
+                sample(f'{family}_min', 'gauge', f'{family}_min', labels, vmin)
+                sample(f'{family}_max', 'gauge', f'{family}_max', labels, vmax)
+        out = []
+        for family, (kind, lines) in families.items():
+            out.append(f'# TYPE {family} {kind}')
+            out += lines
+        text = '\n'.join(out) + '\n'
+        if isinstance(path2file, type(None)):
+            return text
+        with _utils.atomic_path(path2file) as part:
+            with open(part, 'w') as f:
+                f.write(text)
+        return
+
+    def export(self):
+        """Export to path2file in the format given at initiation."""
+        assert(not isinstance(self.path2file, type(None))), 'path2file was not given.'
+        if self.format == 'jsonl':
+            self.to_jsonl(self.path2file)
+        else:
+            self.to_prometheus(self.path2file)
+        self._last_export = _time.time()
+
+    def maybe_export(self):
+        """Export if path2file is given and the last export is older than export_interval."""
+        if isinstance(self.path2file, type(None)):
+            return
+        if _time.time() - self._last_export >= self.export_interval:
+            self.export()
@@ -1,15 +1,30 @@
 # -*- coding: utf-8 -*-
 import pathlib as _pl
+import os as _os
 import pandas as _pd
-import s3fs as _s3fs
 # import urllib as _urllib
 # import html2text as _html2text
-import psutil as _psutil
 import numpy as _np
 # import xarray as _xr
 import warnings
-from functools import partial
-import multiprocessing as mp
+import traceback as _traceback
+import time as _time
+import io as _io
+import concurrent.futures as _futures
+import contextlib as _contextlib
+from nesdis_aws import transfer as _transfer
+from nesdis_aws import key_index as _key_index
+from nesdis_aws import pipeline as _pipeline
+from nesdis_aws import workers as _workers
+from nesdis_aws import remote_read as _remote_read
+from nesdis_aws import fixed_grid as _fixed_grid
+from nesdis_aws import journal as _journal
+from nesdis_aws import metrics as _metrics
+from nesdis_aws import backends as _backends
+from nesdis_aws import footprint as _footprint
+from nesdis_aws import workplan as _workplan
+from nesdis_aws import lease as _lease
+from nesdis_aws import utils as _utils
 
 def readme():
     url = 'https://docs.opendata.aws/noaa-goes16/cics-readme.html'
@@ -51,148 +66,345 @@ variable_info = {'ABI-L1b-Rad': 'Radiances',
 
      
 
-def get_available_JPSS_products(sensor = 'VIIRS'):
+goes_satellites = ['noaa-goes16', 'noaa-goes17', 'noaa-goes18', 'noaa-goes19']
+jpss_satellites = ['NOAA20', 'NOAA21', 'SNPP']
+path2catalog_cache = _pl.Path.home().joinpath('.cache', 'nesdis_aws')
+
+def _subfolders(listing):
+    """Sorted paths of the sub-folders in a listing (see transfer.list_folders)."""
+    return sorted(f['name'].rstrip('/') for f in listing if f['type'] == 'directory')
+
+def _first_year_folder(year_folders):
+    """
+    First year folder of a product. There is this strange folder from 2000 
+    in some products, no Idea what that is about?!? It is ignored.
+
+    Parameters
+    ----------
+    year_folders : list of str
+        Paths of year folders.
+
+    Returns
+    -------
+    str or None
+        None if there is no (real) year folder.
+
+    """
+    year_folders = sorted(f for f in year_folders if f.rstrip('/').split('/')[-1] != '2000')
+    if len(year_folders) == 0:
+        return None
+    return year_folders[0]
+
+def _crawl_first_days(aws, product_folders, layout = 'doy', max_concurrency = 32):
+    """
+    Find the first day with data for many products with as few listings as
+    possible: all product folders, then the first year of each, then (for
+    the ymd layout) the first month of each, all concurrently.
+
+    Parameters
+    ----------
+    aws : s3fs.S3FileSystem
+    product_folders : list of str
+    layout : str, optional
+        'doy' for <year>/<day of year> (GOES), 'ymd' for <year>/<month>/<day>
+        (JPSS). The default is 'doy'.
+    max_concurrency : int, optional
+        The default is 32.
+
+    Returns
+    -------
+    dict
+        Maps product folders to the first day (pandas.Timestamp) or None.
+
+    """
+    listings = _transfer.list_folders(aws, product_folders, max_concurrency = max_concurrency, include_dirs = True)
+    first = {pf: _first_year_folder(_subfolders(listings[pf])) for pf in product_folders}
+    levels = 1 if layout == 'doy' else 2
+    for level in range(levels):
+        folders = [f for f in first.values() if not isinstance(f, type(None))]
+        listings = _transfer.list_folders(aws, folders, max_concurrency = max_concurrency, include_dirs = True)
+        for pf, f in first.items():
+            if isinstance(f, type(None)):
+                continue
+            sub = _subfolders(listings[f])
+            first[pf] = sub[0] if len(sub) > 0 else None
+    
+    out = {}
+    for pf, f in first.items():
+        if isinstance(f, type(None)):
+            out[pf] = None
+            continue
+        parts = f.split('/')
+        if layout == 'doy':
+            out[pf] = _pd.to_datetime(parts[-2]) + _pd.to_timedelta(int(parts[-1]) - 1, "D")
+        else:
+            out[pf] = _pd.Timestamp(int(parts[-3]), int(parts[-2]), int(parts[-1]))
+    return out
+
+def _cached_catalog(name, build, path2cache, refresh_interval, refresh):
+    """
+    Return the cached catalog if it is younger than refresh_interval, else 
+    build and cache it.
+    """
+    if isinstance(path2cache, type(None)):
+        path2cache = path2catalog_cache
+    path2file = _pl.Path(path2cache).joinpath(f'{name}.csv')
+    if not refresh and path2file.is_file():
+        age = _pd.Timestamp.now() - _pd.Timestamp.fromtimestamp(path2file.stat().st_mtime)
+        if age < _pd.to_timedelta(refresh_interval):
+            return _pd.read_csv(path2file, index_col = 0, dtype = str, keep_default_na = False)
+    catalog = build()
+    path2file.parent.mkdir(parents = True, exist_ok = True)
+    catalog.to_csv(path2file)
+    return catalog
+
+def _format_first_day(fd):
+    if isinstance(fd, type(None)):
+        return '-'
+    return f'{fd.year:04d}-{fd.month:02d}-{fd.day:02d}'
+
+def get_available_JPSS_products(sensor = 'VIIRS', satellites = None, 
+                                path2cache = None, refresh_interval = '7D', refresh = False):
     """
     In deveolpment. There is not much on the AWS anyway ... got to go back to CLAss ... boooooo
 
     Parameters
     ----------
-    sensor : TYPE, optional
-        DESCRIPTION. The default is 'VIIRS'.
+    sensor : str, optional
+        The default is 'VIIRS'.
+    satellites : list, optional
+        The default is None, which uses jpss_satellites.
+    path2cache : str, optional
+        Folder in which the result is cached. The default is None, which 
+        uses path2catalog_cache (~/.cache/nesdis_aws).
+    refresh_interval : str, optional
+        The cached result is used if it is younger than this. The default is
+        '7D'.
+    refresh : bool, optional
+        Ignore the cached result. The default is False.
 
     Returns
     -------
-    TYPE
-        DESCRIPTION.
+    pandas.DataFrame
+        First day with data for each product (rows) and satellite (columns).
 
     """
     assert(sensor == 'VIIRS'), 'only VIIRS available at this point'
-    satellites = ['NOAA20', 'SNPP']
-    aws = _s3fs.S3FileSystem(anon=True)
-    jpss_base_folder = _pl.Path('noaa-jpss')
-    products = []
-    # for satellite in [16,17]:
-    for satellite in satellites:
-        # satellite = 16#16 (east) or 17(west)
-        base_folder = jpss_base_folder.joinpath(satellite)
-        products_available = aws.glob(base_folder.joinpath('VIIRS').joinpath('*').as_posix())
-        # df[satellite] = 
-        products += [p.split('/')[-1].replace(f'{satellite}_', '') for p in products_available if '.pdf' not in p]
-    products = _np.unique(products)
-    # return products
-    # products = _np.unique([p[:-1] for p in products])
-    # products = [p for p in products if p[:3] =='ABI']
-    product_avail = _pd.DataFrame(columns = satellites, index = products)
-
-    def get_first_day(product, satellite):
-        prod = f'{satellite}_{product}'
-        # product_folder = _pl.Path(f'{jpss_base_folder}/{sensor}/{prod}')
-        product_folder = _pl.Path(f'{jpss_base_folder}/{satellite}/{sensor}/{prod}')
-        # print(f'product_folder: {product_folder}')
-        years = aws.glob(product_folder.joinpath('*').as_posix())
-        # print(f'years: {years}')
-        if len(years) == 0:
-            return False
-
-        years.sort()
-        yearfolder = years[0]
-        firstyear = yearfolder.split('/')[-1]
-        # is2000 = True
-        # while is2000:
-        #     yearfolder = years.pop(0)
-        #     firstyear = yearfolder.split('/')[-1]
-        #     # print(firstyear)
-        #     if firstyear != '2000':
-        #         is2000 = False
-
-        yearfolder = _pl.Path(yearfolder)
-        days = aws.glob(yearfolder.joinpath('*').as_posix())
-        days.sort()
-        firstday = int(days[0].split('/')[-1])
-        fd = _pd.to_datetime(firstyear) + _pd.to_timedelta(firstday, "D")
-        return fd
-
-    for prod, row in product_avail.iterrows():
-        # break
-
-        for idx,val in row.iteritems():
-            # break
-            # satellite, scan_sector = idx.split('-')
-            satellite = idx
-            fd = get_first_day(prod, satellite)
-            if fd:
-                product_avail.loc[prod, idx] = f'{fd.year:04d}-{fd.month:02d}-{fd.day:02d}'
-            else:
-                product_avail.loc[prod, idx] = '-'
-                
-    # product_avail.insert(0,'longname', product_avail.apply(lambda row: variable_info[row.name], axis=1))
-    product_avail.index.name = 'product'
-    return product_avail
+    if isinstance(satellites, type(None)):
+        satellites = jpss_satellites
+    jpss_base_folder = 'noaa-jpss'
+    
+    def build():
+        aws = _backends.S3().make_filesystem()
+        sensor_folders = [f'{jpss_base_folder}/{satellite}/{sensor}' for satellite in satellites]
+        listings = _transfer.list_folders(aws, sensor_folders, include_dirs = True)
+        product_folders = {}
+        for satellite, sf in zip(satellites, sensor_folders):
+            for pf in _subfolders(listings[sf]):
+                product = pf.split('/')[-1].replace(f'{satellite}_', '')
+                product_folders[(product, satellite)] = pf
+        first_days = _crawl_first_days(aws, list(product_folders.values()), layout = 'ymd')
+        
+        products = _np.unique([product for product, satellite in product_folders])
+        product_avail = _pd.DataFrame('-', columns = satellites, index = products)
+        for (product, satellite), pf in product_folders.items():
+            product_avail.loc[product, satellite] = _format_first_day(first_days[pf])
+        product_avail.index.name = 'product'
+        return product_avail
+    
+    return _cached_catalog(f'JPSS_{sensor}_{"_".join(satellites)}', build, path2cache, refresh_interval, refresh)
+
+def get_available_GOES_products(sensor = 'ABI', satellites = None, 
+                                path2cache = None, refresh_interval = '1D', refresh = False):
+    """
+    First day with data for all products of the sensor on all satellites 
+    and scan sectors. Listings are done concurrently and the result is 
+    cached on disk.
+
+    Parameters
+    ----------
+    sensor : str, optional
+        The default is 'ABI'.
+    satellites : list, optional
+        The default is None, which uses goes_satellites.
+    path2cache : str, optional
+        Folder in which the result is cached. The default is None, which 
+        uses path2catalog_cache (~/.cache/nesdis_aws).
+    refresh_interval : str, optional
+        The cached result is used if it is younger than this. The default is
+        '1D'.
+    refresh : bool, optional
+        Ignore the cached result. The default is False.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Index is the product, columns are <satellite>-<scan sector>, e.g. 
+        16-C.
 
-def get_available_GOES_products(sensor = 'ABI'):
+    """
     assert(sensor == 'ABI'), 'Only ABI sensors at this time'
-    satellites = ['noaa-goes16', 'noaa-goes17']
-    aws = _s3fs.S3FileSystem(anon=True)
-
-    products = []
-    # for satellite in [16,17]:
-    for satellite in satellites:
-        # satellite = 16#16 (east) or 17(west)
-        base_folder = _pl.Path(satellite)
-        products_available = aws.glob(base_folder.joinpath('*').as_posix())
-        # df[satellite] = 
-        products += [p.split('/')[-1] for p in products_available if '.pdf' not in p]
-        
-    products = _np.unique(products)
-    products = _np.unique([p[:-1] for p in products])
-    products = [p for p in products if p[:3] =='ABI']
-    product_avail = _pd.DataFrame(columns = ['16-C', '16-F', '16-M', '17-C', '17-F', '17-M'], index = products)
-
-    def get_first_day(product, satellite, scan_sector):
-        prod = product
-        product_folder = _pl.Path(f'noaa-goes{satellite}/{prod}{scan_sector}')
-
-        years = aws.glob(product_folder.joinpath('*').as_posix())
-        if len(years) == 0:
-            return False
-
-        years.sort()
-
-        # there is this strange folder from 2000, no Idea what that is about?!?
-        is2000 = True
-        while is2000:
-            yearfolder = years.pop(0)
-            firstyear = yearfolder.split('/')[-1]
-            # print(firstyear)
-            if firstyear != '2000':
-                is2000 = False
-
-        yearfolder = _pl.Path(yearfolder)
-        days = aws.glob(yearfolder.joinpath('*').as_posix())
-        days.sort()
-        firstday = int(days[0].split('/')[-1])
-        fd = _pd.to_datetime(firstyear) + _pd.to_timedelta(firstday, "D")
-        return fd
-
-    for prod, row in product_avail.iterrows():
-        # break
-
-        for idx,val in row.iteritems():
-            # break
-            satellite, scan_sector = idx.split('-')
-            fd = get_first_day(prod, satellite, scan_sector)
-            if fd:
-                product_avail.loc[prod, idx] = f'{fd.year:04d}-{fd.month:02d}-{fd.day:02d}'
-            else:
-                product_avail.loc[prod, idx] = '-'
-                
-    product_avail.insert(0,'longname', product_avail.apply(lambda row: variable_info[row.name], axis=1))
-    product_avail.index.name = 'product'
-    return product_avail
+    if isinstance(satellites, type(None)):
+        satellites = goes_satellites
+    scan_sectors = ['C', 'F', 'M']
+    
+    def build():
+        aws = _backends.S3().make_filesystem()
+        listings = _transfer.list_folders(aws, satellites, include_dirs = True)
+        product_folders = {}
+        for satellite in satellites:
+            for pf in _subfolders(listings[satellite]):
+                prod = pf.split('/')[-1]
+                if prod[:3] != sensor or prod[-1] not in scan_sectors:
+                    continue
+                product_folders[(prod[:-1], f'{satellite.replace("noaa-goes", "")}-{prod[-1]}')] = pf
+        first_days = _crawl_first_days(aws, list(product_folders.values()), layout = 'doy')
+        
+        products = _np.unique([product for product, column in product_folders])
+        columns = [f'{satellite.replace("noaa-goes", "")}-{sector}' for satellite in satellites for sector in scan_sectors]
+        product_avail = _pd.DataFrame('-', columns = columns, index = products)
+        for (product, column), pf in product_folders.items():
+            product_avail.loc[product, column] = _format_first_day(first_days[pf])
+        product_avail.insert(0,'longname', [variable_info.get(product, '') for product in product_avail.index])
+        product_avail.index.name = 'product'
+        return product_avail
+    
+    return _cached_catalog(f'GOES_{sensor}_{"_".join(satellites)}', build, path2cache, refresh_interval, refresh)
 
 get_available_products = get_available_GOES_products
 
+def _scan_start_times(names):
+    """
+    Parse the scan start (the s part, e.g. s20202211200000) from many ABI file
+    names at once.
+
+    Parameters
+    ----------
+    names : pandas.Series
+        File names (str).
+
+    Returns
+    -------
+    pandas.DatetimeIndex
+
+    """
+    sos = names.str.extract(r'_s(\d{13})\d_', expand = False)
+    assert(not sos.isna().any()), f'Something needs fixing, could not find the start time (s...) in file names like {names[sos.isna()].iloc[0]}.'
+    # YYYYJJJHHMMSS as one integer, the digits are picked apart arithmetically
+    sos = sos.astype(_np.int64).values
+    year = sos // 10**9
+    doy = sos // 10**6 % 1000
+    seconds = (sos // 10**4 % 100) * 3600 + (sos // 100 % 100) * 60 + sos % 100
+    ts = ((year - 1970).astype('datetime64[Y]').astype('datetime64[s]') 
+          + ((doy - 1) * 86400 + seconds).astype('timedelta64[s]'))
+    return _pd.DatetimeIndex(ts.astype('datetime64[ns]'))
+
+def _granule_start_times(names):
+    """
+    Parse the granule start (the s part, e.g. s202302050000000) from many
+    JPSS file names at once.
+
+    Returns
+    -------
+    pandas.DatetimeIndex
+
+    """
+    sos = names.str.extract(r'_s(\d{14})', expand = False)
+    assert(not sos.isna().any()), f'Something needs fixing, could not find the start time (s...) in file names like {names[sos.isna()].iloc[0]}.'
+    return _pd.DatetimeIndex(_pd.to_datetime(sos, format = '%Y%m%d%H%M%S'))
+
+def _keys(workplan):
+    """The keys on aws (str) of the workplan rows."""
+    return _pd.Series([_pl.Path(p).as_posix() for p in workplan.path2file_aws], index = workplan.index, dtype = object)
+
+def _is_file(paths):
+    """
+    Vectorized is_file for many paths. Each distinct folder is scanned once.
+
+    Parameters
+    ----------
+    paths : pandas.Series
+        pathlib.Path objects.
+
+    Returns
+    -------
+    pandas.Series
+        bool, same index as paths.
+
+    """
+    folders = {}
+    out = []
+    for p in paths:
+        if p.parent not in folders:
+            folders[p.parent] = _files_in_folder(p.parent)
+        out.append(p.name in folders[p.parent])
+    return _pd.Series(out, index = paths.index, dtype = bool)
+
+def _files_in_folder(path2folder):
+    """Names of all entries in a folder as a set (empty if the folder does not exist)."""
+    try:
+        return set(_os.listdir(path2folder))
+    except FileNotFoundError:
+        return set()
+
+def _memory_stage(memory, name, row):
+    """memory.stage for a workplan row, or a context that does nothing if memory is None."""
+    if isinstance(memory, type(None)):
+        return _contextlib.nullcontext()
+    return memory.stage(name, key = _pl.Path(row.path2file_aws).as_posix())
+
+def _files2listing(files):
+    """Listing DataFrame (see AwsQuery._list_remote) from a list of info dicts."""
+    return _pd.DataFrame({'path2file_aws': [f['name'] for f in files],
+                          'size_bytes': _pd.array([f.get('size') for f in files], dtype = 'Int64'),
+                          'etag': [f.get('ETag') for f in files]})
+
+def _list_hour_folders(aws, hour_folders, max_concurrency = 32, metrics = None, group_days = True):
+    """
+    List hour folders concurrently. Days of which all 24 hours are needed
+    are listed with a single recursive listing of the day folder, the 
+    remaining hours individually. The folders can belong to different 
+    satellites and products.
+
+    Parameters
+    ----------
+    aws : s3fs.S3FileSystem
+    hour_folders : iterable of str
+    max_concurrency : int, optional
+        The default is 32.
+    metrics : metrics.Metrics, optional
+        Passed to transfer.list_folders.
+    group_days : bool, optional
+        If False, each folder is listed individually, e.g. for folders that
+        are days rather than hours. The default is True.
+
+    Returns
+    -------
+    dict
+        Maps each hour folder to a list of info dicts.
+
+    """
+    hour_folders = _pd.Series(list(hour_folders), dtype = object)
+    day_folders = hour_folders.apply(lambda folder: folder.rsplit('/', 1)[0])
+    hours_per_day = day_folders.value_counts()
+    full_days = hours_per_day.index[hours_per_day == 24] if group_days else hours_per_day.index[:0]
+    partial_hours = hour_folders[~day_folders.isin(full_days)]
+
+    listings = {folder: [] for folder in hour_folders}
+    if len(full_days) > 0:
+        for day, files in _transfer.list_folders(aws, full_days, max_concurrency = max_concurrency, recursive = True, metrics = metrics).items():
+            for f in files:
+                listings[f['name'].rsplit('/', 1)[0]].append(f)
+    if len(partial_hours) > 0:
+        listings.update(_transfer.list_folders(aws, partial_hours, max_concurrency = max_concurrency, metrics = metrics))
+    return listings
+
 class AwsQuery(object):
+    # folder layout below the product folder: <year>/<day of year>/<hour>
+    _layout = 'doy'
+    _folder_span = _pd.Timedelta('1h')
+    _group_hours = True
+    
     def __init__(self,
                  path2folder_local = '/mnt/telg/tmp/aws_tmp/',
                  satellite = '16',
@@ -203,6 +415,23 @@ class AwsQuery(object):
                  process = None,
                  keep_files = None,
                  verbose = False,
+                 max_listing_concurrency = 32,
+                 path2index = None,
+                 index_ttl = 600,
+                 variables = None,
+                 bbox = None,
+                 points = None,
+                 path2journal = None,
+                 aws = None,
+                 path2mirror = None,
+                 mirror_listing = False,
+                 endpoint_url = None,
+                 metrics = None,
+                 cache = None,
+                 target_times = None,
+                 tolerance = None,
+                 decimate = None,
+                 extractor = None,
                  # check_if_file_exist = True,
                  # no_of_days = None,
                  # last_x_days = None, 
@@ -234,9 +463,100 @@ class AwsQuery(object):
                      function = lambda row: some_function(row, *args, **kwargs),
                      prefix = 'ABI_L2_AOD_processed',
                      path2processed = '/path2processed/')
+            Optionally, aggregate = aggregate.Aggregator(...) appends each
+            processed file, as soon as it is done, to daily or monthly 
+            stores (see aggregate.Aggregator).
         keep_files: bool, optional
             Default is True unless process is given which changes the default
             False.
+        max_listing_concurrency: int, optional
+            Max number of folder listings that are in flight at the same time
+            when the workplan is generated. The default is 32.
+        path2index: str, optional
+            Path to a SQLite file in which the listings of the folders on 
+            aws are cached (see key_index.KeyIndex). Folders of past hours
+            are only listed once, the folder of the current hour is listed
+            again if the cached listing is older than index_ttl. The index
+            can be shared between queries and processes. The default is 
+            None, which lists everything every time.
+        index_ttl: float, optional
+            Seconds after which the cached listing of the current (still 
+            filling) hour is outdated. The default is 600.
+        variables: list of str, optional
+            Only these variables (e.g. ['AOD', 'DQF']) are read from the 
+            files on aws, using ranged reads of only the respective HDF5 
+            chunks and metadata. The local files then only contain these 
+            variables (plus coordinates and goes_imager_projection). 
+            Requires xarray and h5netcdf. The default is None, entire files
+            are downloaded.
+        bbox: tuple, optional
+            (lon_min, lat_min, lon_max, lat_max) in degrees. Only the part
+            of the ABI fixed grid that covers this box is read from the files
+            on aws and saved (see fixed_grid.FixedGridWindow). Can be 
+            combined with variables. The default is None.
+        points: list of tuple, optional
+            [(lat, lon), ...] in degrees, e.g. ground stations. Like bbox, 
+            only the part of the grid that covers all points is read. The 
+            default is None.
+        path2journal: str, optional
+            Path to a SQLite file that keeps the state of each file 
+            (journal.RunJournal). Files are then written to a temporary name
+            and renamed when complete, processed files included. Only what 
+            the journal marks as downloaded (or processed) is skipped, 
+            files on disk are not trusted otherwise. A restarted run resumes
+            where it stopped. The default is None.
+        aws: s3fs.S3FileSystem, optional
+            Filesystem (and with it the connection pool) to use, e.g. to
+            share one between several queries, or a backends.BackendChain.
+            The default is None, the filesystem is created on first use from
+            path2mirror and endpoint_url (see backends.make_filesystem).
+        path2mirror: str, optional
+            Local (e.g. NFS) directory with a copy of some of the buckets 
+            in the same layout (noaa-goes16/ABI-L2-AODC/...). Files found 
+            there are read from there instead of S3. Listings still come 
+            from S3, unless mirror_listing. The default is None.
+        mirror_listing: bool, optional
+            If True, folders that exist in the mirror are listed from there
+            (see backends.Mirror), which is only right if the mirror always
+            has all files of a folder. The default is False.
+        endpoint_url: str, optional
+            S3 compatible service that is tried after the mirror and 
+            before public AWS. The default is None.
+        metrics: metrics.Metrics, optional
+            Collects timings and throughput of listing, downloading, and 
+            processing (see metrics.Metrics), available as self.metrics. 
+            Pass one with path2file to export them as JSON lines or 
+            Prometheus text. The default is None, a new one is created 
+            that is only kept in memory.
+        cache: cache.RawFileCache, optional
+            Shared cache for the raw files. Files are then stored in the 
+            cache (under their key on aws) instead of path2folder_local, 
+            and files that other queries or processes put there are not 
+            downloaded again. Downloads wait for the cache to make room 
+            instead of failing on low disk space, raw files are released 
+            after processing instead of deleted (keep_files has no 
+            effect). Can not be combined with variables, bbox or points. 
+            The default is None.
+        target_times: list-like of datetime, optional
+            Only the scan closest to each of these times (e.g. ground 
+            station observations) is kept, if it is within tolerance. Only
+            the hour folders within tolerance of a target are listed. start
+            and end are ignored. The default is None, all scans.
+        tolerance: str or pandas.Timedelta, optional
+            Max distance between a target time and the start of its scan.
+            The default is None, which is half of decimate, or '5min' for 
+            target_times.
+        decimate: str or pandas.Timedelta, optional
+            Keep one scan per this interval (e.g. '15min' out of the 5 min
+            CONUS cadence), the one closest to each multiple of the 
+            interval between start and end. The default is None. In follow
+            and watch the selection is made among the new files of each 
+            poll.
+        extractor: extract.StationExtractor, optional
+            Extracts the values at stations from each file into one table 
+            (see extract). Use extract instead of process. Files whose key 
+            is in the table already are not in the workplan. The default 
+            is None.
 
         Returns
         -------
@@ -260,6 +580,7 @@ class AwsQuery(object):
             self._process_function = process['function']
             self._process_name_prefix = process['prefix']
             self._process_path2processed = _pl.Path(process['path2processed'])
+            self._process_aggregate = process.get('aggregate')
             # self._process_path2processed_tmp = self._process_path2processed.joinpath('tmp')
             # self._process_path2processed_tmp.mkdir(exist_ok=True)
             if keep_files:
@@ -269,14 +590,64 @@ class AwsQuery(object):
             # self.check_if_file_exist = False
         else:
             self._process = False
+            self._process_aggregate = None
         
-        #### TODO memoryleak initiate aws only when its needed
-        self.aws = _s3fs.S3FileSystem(anon=True, skip_instance_cache=True)
+        # the filesystem is created on first use (see aws)
+        self._aws = aws
+        self.path2mirror = path2mirror
+        self.mirror_listing = mirror_listing
+        self.endpoint_url = endpoint_url
+        if isinstance(metrics, type(None)):
+            metrics = _metrics.Metrics()
+        self.metrics = metrics
         # self.aws.clear_instance_cache() # strange things happen if the is not the only query one is doing during a session
         # properties
         self._workplan = None
+        self._compact_workplan = None
         self._verbose = verbose
+        self.max_listing_concurrency = max_listing_concurrency
+        self.variables = variables
+        if isinstance(path2journal, type(None)):
+            self.journal = None
+        else:
+            self.journal = _journal.RunJournal(path2journal)
+        if isinstance(bbox, type(None)) and isinstance(points, type(None)):
+            self.grid_window = None
+        else:
+            self.grid_window = _fixed_grid.FixedGridWindow(bbox = bbox, points = points)
+        if isinstance(path2index, type(None)):
+            self.key_index = None
+        else:
+            self.key_index = _key_index.KeyIndex(path2index, ttl = index_ttl)
+        self.cache = cache
+        assert(isinstance(cache, type(None)) or isinstance(self._subset_kwargs, type(None))), 'The cache holds entire raw files, it can not be combined with variables, bbox or points.'
+        assert(isinstance(target_times, type(None)) or isinstance(decimate, type(None))), 'Give either target_times or decimate, not both.'
+        self.decimate = None if isinstance(decimate, type(None)) else _pd.to_timedelta(decimate)
+        if isinstance(tolerance, type(None)):
+            tolerance = '5min' if isinstance(decimate, type(None)) else self.decimate / 2
+        self.tolerance = _pd.to_timedelta(tolerance)
+        if isinstance(target_times, type(None)):
+            self.target_times = None
+        else:
+            self.target_times = _pd.DatetimeIndex(_pd.to_datetime(target_times)).unique().sort_values()
+            self.start = self.target_times[0] - self.tolerance
+            self.end = self.target_times[-1] + self.tolerance
+        self.extractor = extractor
         
+    @property
+    def aws(self):
+        if isinstance(self._aws, type(None)):
+            self._aws = self._make_aws()
+        return self._aws
+    
+    @aws.setter
+    def aws(self, value):
+        self._aws = value
+    
+    def _make_aws(self):
+        return _backends.make_filesystem(path2mirror = self.path2mirror, endpoint_url = self.endpoint_url,
+                                         mirror_listing = self.mirror_listing)
+    
     @property
     def product(self):
         return self._product
@@ -295,9 +666,11 @@ class AwsQuery(object):
         else:
             du = self.estimate_disk_usage()
             disk_space_needed = du['disk_space_needed'] * 1e-6
+            disk_space_on_disk = du['disk_space_on_disk'] * 1e-6
             disk_space_free_after_download = du['disk_space_free_after_download']
             info = (f'no of files: {nooffiles}\n'
                     f'estimated disk usage: {disk_space_needed:0.0f} mb\n'
+                    f'already on disk: {disk_space_on_disk:0.0f} mb\n'
                     f'remaining disk space after download: {disk_space_free_after_download:0.0f} %\n')
         return info
     
@@ -307,26 +680,252 @@ class AwsQuery(object):
     #     out = _html2text.html2text(html)
     #     print(out)
     
-    def estimate_disk_usage(self, sample_size = 10): #mega bites
-        step_size = int(self.workplan.shape[0]/sample_size)
-        if step_size < 1:
-            step_size = 1
-        #### TODO memory leak: reload instance
-        # self.aws = _s3fs.S3FileSystem(anon=True, skip_instance_cache=True)
-        sizes = self.workplan.iloc[::step_size].apply(lambda row: self.aws.disk_usage(row.path2file_aws), axis = 1)
-        # sizes = self.workplan.iloc[::int(self.workplan.shape[0]/sample_size)].apply(lambda row: self.aws.disk_usage(row.path2file_aws), axis = 1)
-        disk_space_needed = sizes.mean() * self.workplan.shape[0]
+    def estimate_disk_usage(self, sample_size = 10, workplan = None): #mega bites
+        """
+        Disk space needed to download the files in the workplan that are not
+        on disk yet. If the workplan has the column size_bytes (it is filled
+        when listing) the totals are exact and no requests are made. 
+        Otherwise the size of sample_size files is requested and 
+        extrapolated.
+
+        Parameters
+        ----------
+        sample_size : int, optional
+            Only used if the workplan has no size_bytes column. The default 
+            is 10.
+        workplan : pandas.DataFrame, optional
+            Workplan to consider instead of the instance workplan. The 
+            default is None.
+
+        Returns
+        -------
+        out : dict
+            disk_space_needed and disk_space_on_disk (bytes), and 
+            disk_space_free_after_download (%).
+
+        """
+        if isinstance(workplan, type(None)):
+            workplan = self.workplan
+        on_disk = _is_file(workplan.path2file_local)
+        if 'size_bytes' in workplan.columns:
+            sizes = workplan.size_bytes.astype(float)
+            disk_space_needed = sizes[~on_disk].sum()
+            disk_space_on_disk = sizes[on_disk].sum()
+        else:
+            step_size = int(workplan.shape[0]/sample_size)
+            if step_size < 1:
+                step_size = 1
+            #### TODO memory leak: reload instance
+            # self.aws = _s3fs.S3FileSystem(anon=True, skip_instance_cache=True)
+            sizes = workplan.iloc[::step_size].apply(lambda row: self.aws.disk_usage(row.path2file_aws.as_posix()), axis = 1)
+            disk_space_needed = sizes.mean() * (~on_disk).sum()
+            disk_space_on_disk = sizes.mean() * on_disk.sum()
         
         # get remaining disk space after download
+        import psutil as _psutil
         du = _psutil.disk_usage(self.path2folder_local)
         disk_space_free_after_download = 100 - (100* (du.used + disk_space_needed)/du.total )
         out = {}
         out['disk_space_needed'] = disk_space_needed
+        out['disk_space_on_disk'] = disk_space_on_disk
         out['disk_space_free_after_download'] = disk_space_free_after_download
         return out
         
+    def _get_hour_folders(self):
+        """
+        Folders on aws (one per hour) that are touched by the time range.
+
+        Returns
+        -------
+        pandas.Series
+            Index is the start of each hour, values are the folder paths 
+            (str).
+
+        """
+        hours = self._hours()
+        product_folder = self.product_folder
+        folders = [f'{product_folder}/{h.year}/{h.day_of_year:03d}/{h.hour:02d}' for h in hours]
+        return _pd.Series(folders, index = hours, dtype = object)
+    
+    def _hours(self):
+        """Start of the hours that are touched by the time range (or the target times)."""
+        targets = self._targets()
+        if isinstance(targets, type(None)):
+            return _pd.date_range(self.start.floor('h'), self.end, freq='h')
+        # only the hours within tolerance of a target
+        hours = set()
+        for first, last in zip((targets - self.tolerance).floor('h'), targets + self.tolerance):
+            hours.update(_pd.date_range(max(first, self.start.floor('h')), min(last, self.end), freq = 'h'))
+        return _pd.DatetimeIndex(sorted(hours))
+    
+    @property
+    def product_folder(self):
+        return self.path2folder_aws.joinpath(f'{self.product}{self.scan_sector}').as_posix()
+    
+    @staticmethod
+    def _start_times(names):
+        return _scan_start_times(names)
+    
+    def _targets(self):
+        """Times the scans are matched to, None if all scans are kept."""
+        if not isinstance(self.decimate, type(None)):
+            return _pd.date_range(self.start.ceil(self.decimate), self.end, freq = self.decimate)
+        return self.target_times
+    
+    def _select_area(self, workplan):
+        """Granules outside of the area of interest are removed, see JpssQuery."""
+        return workplan
+    
+    def _select_targets(self, workplan):
+        """
+        Keep only the scans closest to the target times (within tolerance).
+        All files of a selected scan start are kept, e.g. both meso sectors.
+        workplan needs to be sorted by time.
+        """
+        targets = self._targets()
+        if isinstance(targets, type(None)) or workplan.shape[0] == 0:
+            return workplan
+        times = workplan.index.unique()
+        idx = times.get_indexer(targets, method = 'nearest', tolerance = self.tolerance)
+        return workplan[workplan.index.isin(times[idx[idx >= 0]])]
+    
+    def _list_remote(self):
+        """
+        List all files in the hour folders of the time range. Folders that
+        are up to date in the key index (if path2index was given) are not 
+        listed again, the remaining ones are listed concurrently (see 
+        _list_hour_folders).
+
+        Returns
+        -------
+        pandas.DataFrame
+            Columns: path2file_aws (str), size_bytes, etag.
+
+        """
+        hour_folders = self._get_hour_folders()
+        listings, missing = self._cached_listings(hour_folders)
+        new_listings = _list_hour_folders(self.aws, missing, max_concurrency = self.max_listing_concurrency, metrics = self.metrics,
+                                          group_days = self._group_hours)
+        return self._store_listing(hour_folders, listings, missing, new_listings)
+    
+    def _cached_listings(self, hour_folders):
+        """
+        Returns
+        -------
+        listings : dict
+            Listings of the hour folders that are up to date in the key 
+            index (empty if there is no index).
+        missing : pandas.Series
+            The hour folders that need to be listed.
+
+        """
+        if isinstance(self.key_index, type(None)):
+            return {}, hour_folders
+        listings, missing = self.key_index.get(hour_folders)
+        return listings, hour_folders[hour_folders.isin(missing)]
+    
+    def _store_listing(self, hour_folders, listings, missing, new_listings):
+        """
+        Put the new listings of the missing folders in the key index and 
+        combine them with the cached ones to the listing of all hour 
+        folders. new_listings may contain other folders as well.
+        """
+        new_listings = {folder: new_listings[folder] for folder in missing}
+        if not isinstance(self.key_index, type(None)):
+            # the index takes the last hour of a folder to decide if it is closed
+            last_hours = missing.index + self._folder_span - _pd.Timedelta('1h')
+            self.key_index.put(new_listings, _pd.Series(last_hours, index = missing.values),
+                               satellite = self.satellite, product = self.product, scan_sector = self.scan_sector)
+        listings = dict(listings, **new_listings)
+        return _files2listing([f for folder in hour_folders for f in listings[folder]])
+    
+    def _listing2workplan(self, listing, paths = True):
+        """
+        Turn a listing (see _list_remote) into a workplan. Everything is 
+        done on entire columns, local files are checked by a single scan of
+        the respective directory.
+
+        Parameters
+        ----------
+        listing : pandas.DataFrame
+            Needs the column path2file_aws (str).
+        paths : bool, optional
+            If False, the path columns hold str instead of pathlib.Path 
+            objects (see compact_workplan). The default is True.
+
+        Returns
+        -------
+        workplan : pandas.DataFrame
+
+        """
+        keys = listing.path2file_aws.astype(str).reset_index(drop = True)
+        names = keys.str.rsplit('/', n = 1).str[-1]
+        workplan = _pd.DataFrame({'path2file_aws': keys.values, 'name': names.values}, 
+                                 index = self._start_times(names))
+        if 'size_bytes' in listing.columns:
+            workplan['size_bytes'] = listing.size_bytes.values
+        
+        #### truncate ... remember so far we did not consider times in start and end, only the entire hours
+        workplan = workplan[(workplan.index >= self.start) & (workplan.index <= self.end)]
+        workplan = workplan.sort_index(kind = 'stable')
+        # before anything is removed, so a scan that is done is not replaced by the next best one
+        workplan = self._select_area(workplan)
+        workplan = self._select_targets(workplan)
+
+        #### remove what is done already
+        if not isinstance(self.extractor, type(None)):
+            # the table decides what is extracted, the journal only tracks the downloads
+            workplan = workplan[~workplan.path2file_aws.isin(self.extractor.table.keys())]
+            if not isinstance(self.journal, type(None)):
+                self.journal.add_listed(workplan.path2file_aws)
+        elif not isinstance(self.journal, type(None)):
+            # only the journal is trusted, files on disk might be incomplete
+            # only the keys of the workplan are looked up, not the whole journal
+            done = self.journal.keys_in_state('processed' if self._process else 'downloaded', keys = workplan.path2file_aws)
+            workplan = workplan[~workplan.path2file_aws.isin(done)]
+            self.metrics.inc('retries', int(workplan.path2file_aws.isin(self.journal.keys_in_state('failed', keys = workplan.path2file_aws)).sum()))
+            self.journal.add_listed(workplan.path2file_aws)
+        elif not self._process:
+            if isinstance(self.cache, type(None)):
+                workplan = workplan[~workplan['name'].isin(_files_in_folder(self.path2folder_local))]
+            else:
+                workplan = workplan[~workplan.path2file_aws.isin(self.cache.keys())]
+
+        #### processing additions
+        if self._process:
+            ### add path to processed file names and remove if file exists 
+            names_processed = self._process_name_prefix + '_' + workplan.index.strftime('%Y%m%d_%H%M%S') + '.nc'
+            if isinstance(self.journal, type(None)):
+                is_processed = names_processed.isin(_files_in_folder(self._process_path2processed))
+                workplan = workplan[~is_processed]
+                names_processed = names_processed[~is_processed]
+
+        # paths are only made for the remaining rows
+        if isinstance(self.cache, type(None)):
+            path2file_local = self.path2folder_local.as_posix() + '/' + workplan['name']
+        else:
+            path2file_local = self.cache.path2cache.as_posix() + '/' + workplan.path2file_aws.str.lstrip('/')
+        workplan = workplan.assign(path2file_local = path2file_local.values)
+        if self._process:
+            workplan['path2file_local_processed'] = (self._process_path2processed.as_posix() + '/' + names_processed).values
+        if paths:
+            for column in [c for c in workplan.columns if c.startswith('path2')]:
+                workplan[column] = [_pl.Path(f) for f in workplan[column]]
+        workplan = workplan.drop(columns = ['name'])
+        if 'size_bytes' in workplan.columns:
+            workplan = workplan[[c for c in workplan.columns if c != 'size_bytes'] + ['size_bytes']]
+        return workplan
+    
+    def _make_workplan(self, paths = True):
+        """List the files on aws and turn them into the workplan."""
+        listing = self._list_remote()
+        return self._listing2workplan(listing, paths = paths)
+    
     @property
     def workplan(self):
+        if isinstance(self._workplan, type(None)) and not isinstance(self._compact_workplan, type(None)):
+            # e.g. loaded with load_workplan
+            self._workplan = self._compact_workplan.to_frame()
         if isinstance(self._workplan, type(None)):
             if self._verbose:
                 print('Get workplan:')
@@ -354,55 +953,10 @@ class AwsQuery(object):
 #                     files_available += last_glob
             
             #### make a data frame to all the available files in the time range
-            # create a dataframe with all hours in the time range
-            df = _pd.DataFrame(index = _pd.date_range(self.start, self.end, freq='h'), columns=['path'])
-            
-            # create the path to the directory of each row above (one per houre)
-            product_folder = self.path2folder_aws.joinpath(f'{self.product}{self.scan_sector}')
-            df['path'] = df.apply(lambda row: product_folder.joinpath(str(row.name.year)).joinpath(f'{row.name.day_of_year:03d}').joinpath(f'{row.name.hour:02d}').joinpath('*'), axis= 1)
-            
-            # get the path to each file in all the folders 
-            files_available = []
-            
             #### TODO memory leak: below reload aws instance            
             # self.aws = _s3fs.S3FileSystem(anon=True, skip_instance_cache=True)
-            for idx,row in df.iterrows():
-                files_available += self.aws.glob(row.path.as_posix())
-
-            #### Make workplan
-
-            workplan = _pd.DataFrame([_pl.Path(f) for f in files_available], columns=['path2file_aws'])
-            workplan['path2file_local'] = workplan.apply(lambda row: self.path2folder_local.joinpath(row.path2file_aws.name), axis = 1)
-
-            #### remove if local file exists
-            if not self._process:
-                workplan = workplan[~workplan.apply(lambda row: row.path2file_local.is_file(), axis = 1)]
-            
-            # get file sizes ... takes to long to do for each file
-#             workplan['file_size_mb'] = workplan.apply(lambda row: self.aws.disk_usage(row.path2file_aws)/1e6, axis = 1)
-            
-            #### get the timestamp
-            def row2timestamp(row):
-                sos = row.path2file_aws.name.split('_')[-3]
-                assert(sos[0] == 's'), f'Something needs fixing, this string ({sos}) should start with s.'
-                ts = _pd.to_datetime(sos[1:-1],format = '%Y%j%H%M%S')
-                return ts
-
-            workplan.index = workplan.apply(lambda row: row2timestamp(row), axis = 1)
-
-            #### truncate ... remember so far we did not consider times in start and end, only the entire days
-            workplan = workplan.sort_index()
-            workplan = workplan.truncate(self.start, self.end)
-            if workplan.shape[0] != 0:
-                #### processing additions
-                if self._process:
-                    ### add path to processed file names
-                    workplan["path2file_local_processed"] = workplan.apply(lambda row: self._process_path2processed.joinpath(f'{self._process_name_prefix}_{row.name.year}{row.name.month:02d}{row.name.day:02d}_{row.name.hour:02d}{row.name.minute:02d}{row.name.second:02d}.nc'), axis = 1)
-                    ### remove if file exists 
-                    workplan = workplan[~workplan.apply(lambda row: row.path2file_local_processed.is_file(), axis = True)]
-                    # workplan['path2file_tmp'] = workplan.apply(lambda row: self._process_path2processed_tmp.joinpath(row.name.__str__()), axis = 1)
-            
-            else:
+            workplan = self._make_workplan()
+            if workplan.shape[0] == 0:
                 if self._verbose:
                     print('workplan is empty')
             
@@ -415,30 +969,48 @@ class AwsQuery(object):
     @workplan.setter
     def workplan(self, new_workplan):
         self._workplan = new_workplan
+        self._compact_workplan = None
+    
+    @property
+    def compact_workplan(self):
+        """
+        The workplan as workplan.CompactWorkplan, which needs a fraction of
+        the memory. If the workplan was not made yet it is made without 
+        building the regular one (no pathlib.Path objects). Used by 
+        process_parallel, see also save_workplan and load_workplan.
+        """
+        if not isinstance(self._workplan, type(None)):
+            # the regular one might have been changed, e.g. by follow
+            return _workplan.CompactWorkplan.from_frame(self._workplan)
+        if isinstance(self._compact_workplan, type(None)):
+            self._compact_workplan = _workplan.CompactWorkplan.from_frame(self._make_workplan(paths = False))
+        return self._compact_workplan
+    
+    def save_workplan(self, path2file):
+        """
+        Save the workplan (as compact_workplan) to a Parquet file, so it 
+        can be loaded by other processes or hosts without listing aws 
+        again (see load_workplan). Requires pyarrow.
+        """
+        self.compact_workplan.to_parquet(path2file)
+        return
+    
+    def load_workplan(self, path2file):
+        """
+        Use the workplan saved by save_workplan instead of listing aws. 
+        Local paths are the ones of the query that saved it.
+        """
+        self._workplan = None
+        self._compact_workplan = _workplan.CompactWorkplan.read_parquet(path2file)
+        return
     
     @property
     def product_available_since(self):
-        product_folder = self.path2folder_aws.joinpath(f'{self.product}{self.scan_sector}')
-        years = self.aws.glob(product_folder.joinpath('*').as_posix())
-        years.sort()
-        
-        is2000 = True
-        while is2000:
-            yearfolder = years.pop(0)
-            firstyear = yearfolder.split('/')[-1]
-            # print(firstyear)
-            if firstyear != '2000':
-                is2000 = False
-                
-        yearfolder = _pl.Path(yearfolder)
-        days = self.aws.glob(yearfolder.joinpath('*').as_posix())
-        days.sort()
-        firstday = int(days[0].split('/')[-1])
-        firstday_ts = _pd.to_datetime(firstyear) + _pd.to_timedelta(firstday, "D")
-        return firstday_ts
+        return _crawl_first_days(self.aws, [self.product_folder], layout = self._layout)[self.product_folder]
         
     def download(self, test = False, overwrite = False, alternative_workplan = False,
-                 error_if_low_disk_space = True):
+                 error_if_low_disk_space = True,
+                 max_concurrency = None, chunk_size = 32 * 2**20):
         """
         
 
@@ -452,12 +1024,26 @@ class AwsQuery(object):
             This will ignore the instance workplan and use the provided one 
             instead. The default is False.
         error_if_low_disk_space : TYPE, optional
-            DESCRIPTION. The default is True.
+            DESCRIPTION. The default is True. Ignored if there is a cache,
+            which makes room or waits instead.
+        max_concurrency : int, optional
+            If given, files are downloaded concurrently using the async core
+            of s3fs with at most this many requests in flight. If None
+            (default) files are downloaded one after another. If only a 
+            subset of each file is read (variables, bbox or points), or 
+            there is a cache, this is the number of files read at the same 
+            time.
+        chunk_size : int, optional
+            Only used when max_concurrency is given. Files larger than this
+            (in bytes) are downloaded in parallel byte ranges of this size. 
+            The default is 32 MiB.
 
         Returns
         -------
         out : TYPE
-            DESCRIPTION.
+            If max_concurrency is given this is a pandas.DataFrame with the 
+            status, size, duration, and bytes_per_sec for each file. This 
+            can be used to tune max_concurrency for a particular host.
 
         """
         if isinstance(alternative_workplan, _pd.DataFrame):
@@ -465,10 +1051,53 @@ class AwsQuery(object):
         else:
             workplan = self.workplan
         
-        if error_if_low_disk_space:
-            disk_space_free_after_download = self.estimate_disk_usage()['disk_space_free_after_download']
-            assert(disk_space_free_after_download<90), f"This download will bring the disk usage above 90% ({disk_space_free_after_download:0.0f}%). Turn off this error by setting error_if_low_disk_space to False."
+        if error_if_low_disk_space and isinstance(self.cache, type(None)):
+            disk_space_free_after_download = self.estimate_disk_usage(workplan = workplan)['disk_space_free_after_download']
+            assert(disk_space_free_after_download > 10), f"This download will bring the disk usage above 90% ({100 - disk_space_free_after_download:0.0f}%). Turn off this error by setting error_if_low_disk_space to False."
+        
+        if not isinstance(self.journal, type(None)):
+            # the journal decides what is done, not the files on disk
+            if not overwrite:
+                workplan = workplan[~_keys(workplan).isin(self.journal.keys_in_state('downloaded', keys = _keys(workplan)))]
+            overwrite = True
+            if test:
+                workplan = workplan.iloc[:1]
+            self.journal.set_state(_keys(workplan), 'downloading')
+        
+        if not isinstance(self._subset_kwargs, type(None)):
+            if test:
+                workplan = workplan.iloc[:1]
+            out = self._download_subsets(workplan, max_concurrency = max_concurrency or 1, overwrite = overwrite)
+            _transfer.record_downloads(self.metrics, out)
+            self._journal_report(out)
+            self.metrics.maybe_export()
+            return out
+        
+        if not isinstance(self.cache, type(None)):
+            if test:
+                workplan = workplan.iloc[:1]
+            out = self._download_cached(workplan, max_concurrency = max_concurrency or 1)
+            self._journal_report(out)
+            self.metrics.maybe_export()
+            return out
+        
+        if not isinstance(max_concurrency, type(None)):
+            if test:
+                workplan = workplan.iloc[:1]
+            out = _transfer.download_files(self.aws, 
+                                           workplan.path2file_aws, 
+                                           workplan.path2file_local,
+                                           sizes = workplan.size_bytes if 'size_bytes' in workplan.columns else None,
+                                           max_concurrency = max_concurrency, 
+                                           chunk_size = chunk_size,
+                                           overwrite = overwrite,
+                                           metrics = self.metrics)
+            out.index = workplan.index
+            self._journal_report(out)
+            self.metrics.maybe_export()
+            return out
         
+        out = None
         for idx, row in workplan.iterrows():
             if not overwrite:
                 if row.path2file_local.is_file():
@@ -477,13 +1106,316 @@ class AwsQuery(object):
             # self.aws.clear_instance_cache() 
             # next try: reload aws instance: not helping
             # self.aws = _s3fs.S3FileSystem(anon=True, skip_instance_cache=True)
-            out = self.aws.get(row.path2file_aws.as_posix(), row.path2file_local.as_posix())
+            try:
+                out = self._get_file(row.path2file_aws, row.path2file_local)
+            except Exception as e:
+                self.metrics.inc('download_files', status = 'failed')
+                if not isinstance(self.journal, type(None)):
+                    self.journal.set_state([row.path2file_aws.as_posix()], 'failed', [repr(e)])
+                raise
+            if not isinstance(self.journal, type(None)):
+                self.journal.set_state([row.path2file_aws.as_posix()], 'downloaded')
+            self.metrics.maybe_export()
             if test:
                 break
         return out
     
+    def _get_file(self, path2file_aws, path2file_local):
+        """Download one file to a temporary name and rename it when complete."""
+        start_time = _time.perf_counter()
+        with _utils.atomic_path(path2file_local) as part:
+            out = self.aws.get(_pl.Path(path2file_aws).as_posix(), part.as_posix())
+        self._record_download(_pl.Path(path2file_local).stat().st_size, _time.perf_counter() - start_time)
+        return out
+    
+    def _get_row(self, row):
+        """
+        Download the raw file of a workplan row, through the cache if there
+        is one. A cached file stays pinned until it is released with 
+        cache.unpin.
+
+        Returns
+        -------
+        bool
+            False if the file was in the cache already.
+
+        """
+        if isinstance(self.cache, type(None)):
+            self._get_file(row.path2file_aws, row.path2file_local)
+            return True
+        key = row.path2file_aws.as_posix()
+        if 'size_bytes' in row.index and not _pd.isna(row.size_bytes):
+            size = int(row.size_bytes)
+        else:
+            size = self.aws.size(key)
+        return self.cache.fetch(key, size, lambda path: self._get_file(row.path2file_aws, path))
+    
+    def _record_download(self, size_bytes, seconds):
+        self.metrics.inc('download_files', status = 'downloaded')
+        self.metrics.inc('download_bytes', size_bytes)
+        self.metrics.observe('download_seconds', seconds)
+        return
+    
+    def _journal_report(self, report):
+        """Update the journal from a download report (see transfer.download_files)."""
+        if isinstance(self.journal, type(None)):
+            return
+        # skipped files are on disk (or in the cache) already
+        for status, state in [('downloaded', 'downloaded'), ('skipped', 'downloaded'), ('failed', 'failed')]:
+            sel = report[report.status == status]
+            self.journal.set_state(_keys(sel), state, errors = sel.error if state == 'failed' else None)
+        return
+    
+    
+    @property
+    def _subset_kwargs(self):
+        """Keyword arguments to remote_read functions, None if entire files are downloaded."""
+        if isinstance(self.variables, type(None)) and isinstance(self.grid_window, type(None)):
+            return None
+        return dict(variables = self.variables, isel = self.grid_window)
+    
+    def _download_subsets(self, workplan, max_concurrency = 1, overwrite = False):
+        """
+        Like transfer.download_files, but only the subset defined at 
+        initiation (variables, bbox or points) is read and saved.
+        """
+        def run(row):
+            if not overwrite and row.path2file_local.is_file():
+                return 'skipped', _np.nan, _np.nan, None
+            try:
+                size, seconds = _remote_read.subset2netcdf(self.aws, row.path2file_aws, row.path2file_local, **self._subset_kwargs)
+                return 'downloaded', size, seconds, None
+            except Exception as e:
+                return 'failed', _np.nan, _np.nan, repr(e)
+        return self._download_rows(workplan, run, max_concurrency = max_concurrency)
+    
+    def _download_cached(self, workplan, max_concurrency = 1):
+        """
+        Like transfer.download_files, but into the cache. Each file is 
+        released right away, so it can be evicted again.
+        """
+        def run(row):
+            key = row.path2file_aws.as_posix()
+            start_time = _time.perf_counter()
+            try:
+                downloaded = self._get_row(row)
+            except Exception as e:
+                self.metrics.inc('download_files', status = 'failed')
+                return 'failed', _np.nan, _np.nan, repr(e)
+            self.cache.unpin(key)
+            if not downloaded:
+                return 'skipped', _np.nan, _np.nan, None
+            return 'downloaded', row.path2file_local.stat().st_size, _time.perf_counter() - start_time, None
+        return self._download_rows(workplan, run, max_concurrency = max_concurrency)
+    
+    def _download_rows(self, workplan, run, max_concurrency = 1):
+        """Apply run to the workplan rows in a thread pool and return the download report."""
+        with _futures.ThreadPoolExecutor(max_workers = max_concurrency) as executor:
+            results = list(executor.map(run, [row for idx, row in workplan.iterrows()]))
+        report = _pd.DataFrame(results, columns = ['status', 'size_bytes', 'seconds', 'error'], index = workplan.index)
+        report.insert(0, 'path2file_local', workplan.path2file_local)
+        report.insert(0, 'path2file_aws', workplan.path2file_aws)
+        report['bytes_per_sec'] = report.size_bytes / report.seconds
+        return report
+    
+    def _fetch_raw(self, row, in_memory = False):
+        """
+        Download the raw file of a workplan row unless it is already on disk
+        or the row was already processed.
+
+        Parameters
+        ----------
+        row : pandas.Series
+            Workplan row.
+        in_memory : bool, optional
+            If True, the file is not written to disk but returned as an 
+            io.BytesIO (read from disk if it is there already). The default
+            is False.
+
+        Returns
+        -------
+        bool, io.BytesIO or xarray.Dataset
+            False if the processed file already exists and the row can be
+            skipped. Otherwise True, or if in_memory the file object or the 
+            loaded dataset if only a subset is read (variables, bbox or points).
+
+        """
+        key = row.path2file_aws.as_posix()
+        if isinstance(self.journal, type(None)):
+            if 'path2file_local_processed' in row.index and row.path2file_local_processed.is_file():
+                return False
+            raw_on_disk = row.path2file_local.is_file()
+        else:
+            state = self.journal.get_state(key)
+            if state == 'processed':
+                return False
+            raw_on_disk = state == 'downloaded' and row.path2file_local.is_file()
+        
+        subset = self._subset_kwargs
+        if not isinstance(self.cache, type(None)):
+            # pinned until the cleanup in process
+            raw_on_disk = not isinstance(self.cache.get(key, pin = True), type(None))
+        if in_memory and raw_on_disk:
+            # no need to download it again
+            try:
+                return self._read_raw(row)
+            finally:
+                if not isinstance(self.cache, type(None)):
+                    self.cache.unpin(key)
+        if raw_on_disk:
+            return True
+        
+        if not isinstance(self.journal, type(None)):
+            self.journal.set_state([key], 'downloading')
+        try:
+            if in_memory:
+                start_time = _time.perf_counter()
+                if not isinstance(subset, type(None)):
+                    raw = _remote_read.read_subset(self.aws, row.path2file_aws, **subset)
+                    self._record_download(raw.nbytes, _time.perf_counter() - start_time)
+                else:
+                    data = self.aws.cat_file(key)
+                    self._record_download(len(data), _time.perf_counter() - start_time)
+                    raw = _io.BytesIO(data)
+            elif not isinstance(subset, type(None)):
+                self._record_download(*_remote_read.subset2netcdf(self.aws, row.path2file_aws, row.path2file_local, **subset))
+            else:
+                #### TODO memory leak ... i did not notice that the download is done separately here... maybe try out the cach purch only
+                # self.aws.clear_instance_cache()     #-> not helping           
+                # self.aws = _s3fs.S3FileSystem(anon=True, skip_instance_cache=True) - not helping
+                self._get_row(row)
+        except Exception as e:
+            self.metrics.inc('download_files', status = 'failed')
+            if not isinstance(self.journal, type(None)):
+                self.journal.set_state([key], 'failed', [repr(e)])
+            raise
+        if not isinstance(self.journal, type(None)):
+            self.journal.set_state([key], 'downloaded')
+        if in_memory:
+            return raw
+        return True
+    
+    def _read_raw(self, row):
+        """
+        The raw file of a row that is on disk, like _fetch_raw returns it 
+        with in_memory: the loaded dataset if only a subset is read (the 
+        file on disk is that subset, see remote_read.subset2netcdf), else 
+        an io.BytesIO.
+        """
+        if not isinstance(self._subset_kwargs, type(None)):
+            import xarray as _xr
+            with _xr.open_dataset(row.path2file_local, engine = 'h5netcdf') as ds:
+                return ds.load()
+        return _io.BytesIO(row.path2file_local.read_bytes())
+    
+    def _release_raw(self, row, raw, in_memory = False, keep_files = False):
+        """
+        Done with the raw file of a row: close the file object (in_memory),
+        unpin it in the cache, or remove it unless keep_files. raw is what
+        _fetch_raw returned.
+        """
+        if isinstance(raw, bool) and not raw:
+            # skipped, nothing was fetched
+            return
+        if in_memory:
+            if isinstance(raw, _io.BytesIO):
+                raw.close()
+        elif not isinstance(self.cache, type(None)):
+            self.cache.unpin(row.path2file_aws.as_posix())
+        elif not keep_files:
+            row.path2file_local.unlink(missing_ok = True)
+        return
+    
+    def _use_tmp_processed(self, row):
+        """
+        With a journal, the process function writes to a temporary name 
+        which is renamed by _journal_processed when it is done.
+        """
+        if isinstance(self.journal, type(None)) or 'path2file_local_processed' not in row.index:
+            return row
+        row = row.copy()
+        row['path2file_local_processed'] = _utils.part_path(row.path2file_local_processed)
+        return row
+    
+    def _journal_processed(self, path2file_aws, path2file_processed, error = None):
+        """
+        Record the outcome of processing a file in the journal and move the
+        processed file from its temporary name (see _use_tmp_processed) 
+        in place.
+        """
+        if isinstance(self.journal, type(None)):
+            return
+        key = _pl.Path(path2file_aws).as_posix()
+        # written by the process function, possibly in another process, so it is moved here
+        tmp = _utils.part_path(path2file_processed)
+        if isinstance(error, type(None)):
+            if tmp.is_file():
+                _os.replace(tmp, path2file_processed)
+            self.journal.set_state([key], 'processed')
+        else:
+            tmp.unlink(missing_ok = True)
+            self.journal.set_state([key], 'failed', [error])
+        return
+    
+    @property
+    def _aggregators(self):
+        return [] if isinstance(self._process_aggregate, type(None)) else [self._process_aggregate]
+    
+    def _aggregator(self, row):
+        return self._process_aggregate
     
-    def process(self, raise_exception = False, verbose = False):
+    def _aggregate(self, row, path2file_processed):
+        """Add a processed file to its aggregation store, if aggregate was given in process."""
+        aggregator = self._aggregator(row)
+        if isinstance(aggregator, type(None)) or not _pl.Path(path2file_processed).is_file():
+            return
+        aggregator.add(path2file_processed, time = row.name)
+        return
+    
+    def process(self, raise_exception = False, verbose = False, prefetch = 0, in_memory = False,
+                memory = None):
+        """
+        Download and process the files in the workplan with the process 
+        function given at initiation.
+
+        Parameters
+        ----------
+        raise_exception : bool, optional
+            If False, errors in the process function are printed and the 
+            next file is processed. The default is False.
+        verbose : bool, optional
+            The default is False.
+        prefetch : int, optional
+            If larger than 0, up to this many files are downloaded in 
+            background threads while the current file is processed. Since 
+            raw files are removed before the next download starts (unless 
+            keep_files is True), at most prefetch raw files are on disk at 
+            any time. The default is 0, which downloads and processes one 
+            file after another.
+        in_memory : bool, optional
+            If True, raw files are never written to disk (raw files that 
+            are on disk already are read from there). Instead, the row
+            handed to the process function has the additional entry fileobj,
+            an io.BytesIO with the content of the raw file that can be 
+            opened directly, e.g. with 
+            xarray.open_dataset(row.fileobj, engine = 'h5netcdf'). Memory 
+            use is capped by the number of files in flight, max(1, prefetch).
+            If only a subset is read (variables, bbox or points) the row gets the entry
+            dataset instead, the loaded xarray.Dataset of the subset.
+            keep_files has no effect in this mode. The default is False.
+        memory : memory.MemoryMonitor, optional
+            If given, the resident memory is recorded before and after the
+            fetch, process, and cleanup stage of each file (see 
+            memory.summary()), and the filesystem client is replaced by a 
+            fresh one whenever the monitor says so. With prefetch the fetch
+            stages run in threads, so their attribution is only 
+            approximate. The default is None.
+
+        Returns
+        -------
+        None.
+
+        """
     # deprecated first grouping is required
         # group = self.workplan.groupby('path2file_local_processed')
         # for p2flp, p2flpgrp in group:
@@ -491,169 +1423,730 @@ class AwsQuery(object):
         ## for each file in group
         if verbose:
             print(f'start processing ({self.workplan.shape[0]}): ', end = '')
-        for dt, row in self.workplan.iterrows():
-            if verbose:
-                print('.', end = '')
-            if row.path2file_local_processed.is_file():
-                continue
-            if not row.path2file_local.is_file():
-    #             print('downloading')
-                #### download
-                # download_output = 
-                
-                #### TODO memory leak ... i did not notice that the download is done separately here... maybe try out the cach purch only
-                # self.aws.clear_instance_cache()     #-> not helping           
-                # self.aws = _s3fs.S3FileSystem(anon=True, skip_instance_cache=True) - not helping
-                self.aws.get(row.path2file_aws.as_posix(), row.path2file_local.as_posix())
-            #### process
-            try:
-                #### TODO memory leak check if row is the same before and after
-                rowold = row.copy()
-                self._process_function(row)
-                if not row.equals(rowold):
-                    print('row changed ... return')
-                    return row, rowold
+        rows = (row for dt, row in self.workplan.iterrows())
+        def fetch(row):
+            with _memory_stage(memory, 'fetch', row):
+                return self._fetch_raw(row, in_memory = in_memory)
+        def release(row, is_todo):
+            self._release_raw(row, is_todo, in_memory = in_memory, keep_files = self.keep_files)
+        if prefetch > 0:
+            # rows fetched ahead are released if this stops early (e.g. raise_exception)
+            fetched = _pipeline.prefetch(rows, fetch, prefetch, metrics = self.metrics, discard = release)
+        else:
+            fetched = ((row, fetch(row), None) for row in rows)
+        
+        try:
+            for row, is_todo, error in fetched:
                 if verbose:
-                    print(':', end = '')
-            except:
-                if raise_exception:
-                    raise
-                else:
-                    print(f'error applying function on one file {row.path2file_local.name}. The raw fill will still be removed (unless keep_files is True) to avoid storage issues')
-            #### remove raw file
-            if not self.keep_files:
-                row.path2file_local.unlink()
-            if verbose:
-                print('|', end = '')
+                    print('.', end = '')
+                if not isinstance(error, type(None)):
+                    raise error
+                if isinstance(is_todo, bool) and not is_todo:
+                    continue
+                try:
+                    if in_memory:
+                        row = row.copy()
+                        if isinstance(is_todo, _io.BytesIO):
+                            row['fileobj'] = is_todo
+                        else:
+                            row['dataset'] = is_todo
+                    path2file_processed = row.path2file_local_processed
+                    row = self._use_tmp_processed(row)
+                    #### process
+                    process_start = _time.perf_counter()
+                    try:
+                        #### TODO memory leak check if row is the same before and after
+                        rowold = row.copy()
+                        with _memory_stage(memory, 'process', row):
+                            self._process_function(row)
+                        self.metrics.observe('process_seconds', _time.perf_counter() - process_start, status = 'success')
+                        if not row.equals(rowold):
+                            print('row changed ... return')
+                            return row, rowold
+                        self._journal_processed(row.path2file_aws, path2file_processed)
+                        self._aggregate(row, path2file_processed)
+                        if verbose:
+                            print(':', end = '')
+                    except:
+                        self.metrics.observe('process_seconds', _time.perf_counter() - process_start, status = 'error')
+                        self._journal_processed(row.path2file_aws, path2file_processed, error = _traceback.format_exc())
+                        if raise_exception:
+                            raise
+                        else:
+                            print(f'error applying function on one file {row.path2file_local.name}. The raw fill will still be removed (unless keep_files is True) to avoid storage issues')
+                finally:
+                    #### remove raw file
+                    with _memory_stage(memory, 'cleanup', row):
+                        release(row, is_todo)
+                if not isinstance(memory, type(None)):
+                    memory.file_done()
+                    if memory.fs_recycle_due():
+                        self._recycle_aws()
+                        memory.fs_recycled()
+                self.metrics.maybe_export()
+                if verbose:
+                    print('|', end = '')
+        finally:
+            fetched.close()
+        for aggregator in self._aggregators:
+            aggregator.flush()
+        if not isinstance(self.metrics.path2file, type(None)):
+            self.metrics.export()
         if verbose:
             print('Done')      
         return
     
+    def extract(self, prefetch = 0, in_memory = False, keep_files = False, raise_exception = False, verbose = False):
+        """
+        Extract the values at the stations of the extractor given at 
+        initiation from each file in the workplan into its table. The 
+        gather is cheap, so this runs in this process, the downloads 
+        overlap with it if prefetch is given.
+
+        Parameters
+        ----------
+        prefetch, in_memory, raise_exception, verbose
+            See process.
+        keep_files : bool, optional
+            If False, raw files are removed (or released, if there is a 
+            cache) after the extraction. The default is False.
+
+        Returns
+        -------
+        None.
+
+        """
+        import xarray as _xr
+        assert(not isinstance(self.extractor, type(None))), 'No extractor was given at initiation.'
+        if verbose:
+            print(f'start extracting ({self.workplan.shape[0]}): ', end = '')
+        rows = (row for dt, row in self.workplan.iterrows())
+        def fetch(row):
+            return self._fetch_raw(row, in_memory = in_memory)
+        def release(row, raw):
+            self._release_raw(row, raw, in_memory = in_memory, keep_files = keep_files)
+        if prefetch > 0:
+            fetched = _pipeline.prefetch(rows, fetch, prefetch, metrics = self.metrics, discard = release)
+        else:
+            fetched = ((row, fetch(row), None) for row in rows)
+        
+        try:
+            for row, raw, error in fetched:
+                if not isinstance(error, type(None)):
+                    raise error
+                start_time = _time.perf_counter()
+                try:
+                    if isinstance(raw, _xr.Dataset):
+                        ds = raw
+                    else:
+                        ds = _xr.open_dataset(raw if in_memory else row.path2file_local, engine = 'h5netcdf')
+                    with ds:
+                        columns = {c: row[c] for c in ['satellite', 'product', 'scan_sector'] if c in row.index}
+                        self.extractor.table.append(self.extractor.extract(ds, time = row.name, key = row.path2file_aws.as_posix(), **columns))
+                    self.metrics.observe('process_seconds', _time.perf_counter() - start_time, status = 'success')
+                    if verbose:
+                        print('.', end = '')
+                except:
+                    self.metrics.observe('process_seconds', _time.perf_counter() - start_time, status = 'error')
+                    if raise_exception:
+                        raise
+                    else:
+                        print(f'error extracting from {row.path2file_local.name}')
+                finally:
+                    #### remove raw file
+                    release(row, raw)
+                self.metrics.maybe_export()
+        finally:
+            # rows fetched ahead are released if this stops early
+            fetched.close()
+        self.extractor.table.flush()
+        if not isinstance(self.metrics.path2file, type(None)):
+            self.metrics.export()
+        if verbose:
+            print('Done')
+        return
+    
+    def _recycle_aws(self):
+        """Replace the filesystem client by a fresh instance with the same options."""
+        if isinstance(self._aws, type(None)):
+            return
+        self.aws = type(self.aws)(*self.aws.storage_args, **dict(self.aws.storage_options, skip_instance_cache = True))
+        return
+    
+    def follow(self, poll_interval = 30, lookback = '1h', include_existing = True, max_polls = None):
+        """
+        Generator for near real time operation. Every poll_interval seconds
+        only the newest hour folders (those within lookback) are listed and
+        the files that were not seen before are yielded as a workplan. The
+        number of requests per poll therefore does not grow with time. 
+        start and end of the query are moved along with the current time.
+
+        Parameters
+        ----------
+        poll_interval : float, optional
+            Seconds between polls. The default is 30.
+        lookback : str or pandas.Timedelta, optional
+            How far back files are considered. Folders of hours that are 
+            completely older than that are not listed anymore. Needs to be 
+            long enough to catch files that arrive late. The default is '1h'.
+        include_existing : bool, optional
+            If False, files that are already there at the first poll are 
+            not yielded, only files that show up afterwards. The default is
+            True.
+        max_polls : int, optional
+            Stop after this many polls. The default is None, poll forever.
+
+        Yields
+        ------
+        pandas.DataFrame
+            Workplan with the new files (can be empty). Files that are on 
+            disk or processed already are removed, just like in workplan.
+
+        """
+        lookback = _pd.to_timedelta(lookback)
+        seen = {}
+        no_of_polls = 0
+        while isinstance(max_polls, type(None)) or no_of_polls < max_polls:
+            poll_start = _time.time()
+            now = _pd.Timestamp.now(tz = 'UTC').tz_localize(None)
+            workplan = self._poll(now, lookback, seen, keep_new = include_existing or no_of_polls > 0)
+            self._workplan = workplan
+            if self._verbose:
+                print(f'{now}: {workplan.shape[0]} new files')
+            yield workplan
+            
+            no_of_polls += 1
+            if isinstance(max_polls, type(None)) or no_of_polls < max_polls:
+                _time.sleep(max(0, poll_interval - (_time.time() - poll_start)))
+    
+    def _follow_folders(self, now, lookback):
+        """Move start and end along with now and return the hour folders to poll."""
+        self.start = now - lookback
+        self.end = now + _pd.Timedelta('1h')
+        hour_folders = self._get_hour_folders()
+        return hour_folders[hour_folders.index <= now]
+    
+    def _poll(self, now, lookback, seen, keep_new = True):
+        """One poll of follow, returns the workplan of the new files."""
+        hour_folders = self._follow_folders(now, lookback)
+        listings = _transfer.list_folders(self.aws, hour_folders, max_concurrency = self.max_listing_concurrency, metrics = self.metrics)
+        return self._new_files2workplan(hour_folders, listings, seen, keep_new = keep_new)
+    
+    def _new_files2workplan(self, hour_folders, listings, seen, keep_new = True):
+        """
+        Workplan of the files in listings that are not in seen (dict of 
+        hour folder -> set of keys). seen is updated in place to what was
+        listed this time. If keep_new is False the new files are only 
+        remembered as seen.
+        """
+        files = [f for folder in hour_folders for f in listings[folder] if f['name'] not in seen.get(folder, set())]
+        seen.clear()
+        seen.update({folder: set(f['name'] for f in listings[folder]) for folder in hour_folders})
+        if not keep_new:
+            files = []
+        return self._listing2workplan(_files2listing(files))
+    
+    def watch(self, poll_interval = 30, lookback = '1h', include_existing = True, max_polls = None,
+              max_concurrency = None, prefetch = 0, in_memory = False, raise_exception = False):
+        """
+        Near real time mode: new files (see follow) are downloaded, or 
+        processed if a process function was given at initiation (extracted
+        if an extractor was given), as soon as they show up on aws.
+
+        Parameters
+        ----------
+        poll_interval, lookback, include_existing, max_polls
+            See follow.
+        max_concurrency : int, optional
+            Passed to download. The default is None.
+        prefetch, in_memory, raise_exception
+            Passed to process (or extract).
+
+        Returns
+        -------
+        None.
+
+        """
+        for workplan in self.follow(poll_interval = poll_interval, lookback = lookback,
+                                    include_existing = include_existing, max_polls = max_polls):
+            if workplan.shape[0] == 0:
+                continue
+            if self._process:
+                self.process(raise_exception = raise_exception, verbose = self._verbose,
+                             prefetch = prefetch, in_memory = in_memory)
+            elif not isinstance(self.extractor, type(None)):
+                self.extract(raise_exception = raise_exception, verbose = self._verbose,
+                             prefetch = prefetch, in_memory = in_memory)
+            else:
+                self.download(max_concurrency = max_concurrency)
+        return
+    
     #### TODO now since I am using multiprossing.Process instead of Pool we might want to separate the nesdis packages again.
     def process_parallel(self, process_function = None, args = {}, no_of_cpu = 2, 
                          raise_exception = False, 
                          path2log= None, 
                          subprocess = '',server = '', comment = '', 
+                         max_tasks_per_worker = None,
+                         max_worker_rss_mb = None,
+                         path2leases = None,
+                         batch_size = 100,
+                         lease_seconds = 600,
+                         poll_interval = 30,
                          verbose = True):
-    # deprecated first grouping is required
-        # group = self.workplan.groupby('path2file_local_processed')
-        # for p2flp, p2flpgrp in group:
-        #     break
-        ## for each file in group
+        """
+        Process the workplan rows in a pool of no_of_cpu spawned worker 
+        processes. Each worker takes the next row as soon as it is done with
+        the previous one.
+        
+        With path2leases several hosts work on the same workplan together
+        (see lease): the first host saves its workplan into path2leases, 
+        and all hosts claim batches of rows from it until every batch is 
+        done. Run the same query with the same path2leases on each host. 
+        The rows of the claimed batches go into the same pool of workers; a
+        batch is marked done once all its rows reported back, rows that 
+        failed are recorded in the lease store (see lease.LeaseStore.failed).
+
+        Parameters
+        ----------
+        process_function : callable
+            Called as process_function(row, **args) for each workplan row. 
+            Needs to be defined at module level (importable) since workers 
+            are spawned.
+        args : dict, optional
+            Keyword arguments to process_function. The default is {}.
+        no_of_cpu : int, optional
+            Number of worker processes. The default is 2.
+        raise_exception : bool, optional
+            If True, processing stops at the first error and a RuntimeError
+            is raised. The default is False.
+        path2log : str, optional
+            If given, a line with the number of errors and successes is 
+            appended to this file every no_of_cpu rows. The default is None.
+        subprocess, server, comment : str, optional
+            Written to the log. server is also written to the leases.
+        max_tasks_per_worker : int, optional
+            Workers are replaced by a fresh process after this many rows, 
+            which contains memory leaks in the process function. The 
+            default is None (no recycling).
+        max_worker_rss_mb : float, optional
+            Workers whose resident memory is above this after a row are 
+            replaced by a fresh process, so leaks only cost a restart 
+            instead of an OOM kill. The default is None.
+        path2leases : str, optional
+            Folder on a file system all hosts share (e.g. NFS). The default
+            is None, this host processes the entire workplan.
+        batch_size : int, optional
+            Rows per batch, see lease.LeaseStore. The default is 100.
+        lease_seconds : float, optional
+            Batches of hosts that did not renew their lease for this long 
+            are taken over by others. The default is 600.
+        poll_interval : float, optional
+            Seconds between looking for batches to claim while all 
+            remaining ones are leased by other hosts. The default is 30.
+        verbose : bool, optional
+            The default is True.
+
+        Returns
+        -------
+        pandas.DataFrame
+            Index of the workplan with the columns status ('success' or 
+            'error'), error (traceback of the worker), worker_pid, 
+            worker_rss (bytes, after the row), worker_rss_growth (bytes,
+            during the row), and seconds (the process function took). With
+            path2leases only the rows processed by this host.
+
+        """
+        if isinstance(path2leases, type(None)):
+            leases = None
+            workplan = self.compact_workplan
+        else:
+            leases = _lease.LeaseStore(path2leases, batch_size = batch_size, lease_seconds = lease_seconds,
+                                       poll_interval = poll_interval,
+                                       owner = None if server == '' else f'{server}:{_os.getpid()}')
+            workplan = leases.shared_workplan(lambda: self.compact_workplan)
         if verbose:
-            print(f'start processing ({self.workplan.shape[0]}): ', end = '')
-        # for dt, row in self.workplan.iterrows():
-        
-  
-        
-  
-        if 0:
-            #### TODO this if can be removed
-            # pool = mp.Pool(processes=no_of_cpu)
-            pool = mp.get_context('spawn').Pool(processes=no_of_cpu)
-            idx, rows = zip(*list(self.workplan.iterrows()))
-            pool.map(partial(process_function, **args), rows)
-            pool.close()
-            pool.join()
-        
-        elif 0:
-            #### TODO this elif can be removed
-            # the following lead to a truncation of the workplan. Only when mod(len(workplan), no_of_cpu) = 0 all rows would be considered
-            mp.set_start_method('spawn')
-            if self.workplan.shape[0] == 0:
-                if verbose:
-                    print('workplan is empty, nothing to do here')
-                return
-            idx, rows = zip(*list(self.workplan.iterrows()))
-            print('====idx')
-            print(idx)
-            print('====rows')
-            print(rows)
-            print(f'no_of_cpu: {no_of_cpu} {type(no_of_cpu)}')
-            print(zip(*[list(l) for l in _np.array_split(rows, no_of_cpu)]))
-                  
-            for row_sub in zip(*[list(l) for l in _np.array_split(rows, no_of_cpu)]):
-                print('=', end = '', flush = True)
-                subproslist = []
-                
-                # print(f'row_sub: {row_sub}', flush = True)
-                for row in row_sub:
-                    rowt= rows[0].copy()
-                    rowt.iloc[:] = row
-                    row = rowt
-                    print(',',  end = '', flush = True)
-                    # print(f'row: {row}', flush = True)
-                    process = mp.Process(target=process_function, args = (row,), kwargs = args)
-                    process.start()
-                    subproslist.append(process)
-                [p.join() for p in subproslist]
-                
+            print(f'start processing ({len(workplan)}): ', end = '')
+        
+        counts = {'success': 0, 'error': 0}
+        def write_log():
+            if not isinstance(path2log, type(None)):
                 datetime = _pd.Timestamp.now()
                 run_status = 1
-                error = 0
-                success = no_of_cpu
                 warning = 0
-                if not isinstance(path2log, type(None)):
-                    with open(path2log, 'a') as log_out:
-                            log_out.write(f'{datetime},{run_status},{error},{success},{warning},{subprocess},{server},{comment}\n')
-                
-                # break
-            
+                with open(path2log, 'a') as log_out:
+                        log_out.write(f'{datetime},{run_status},{counts["error"]},{counts["success"]},{warning},{subprocess},{server},{comment}\n')
+            counts['success'] = counts['error'] = 0
+        
+        def callback(idx, status, error):
+            row = workplan.row(idx)
+            if 'path2file_local_processed' in row.index:
+                self._journal_processed(row.path2file_aws, row.path2file_local_processed, 
+                                        error = None if status == 'success' else error)
+                if status == 'success':
+                    self._aggregate(row, row.path2file_local_processed)
+            self.metrics.maybe_export()
+            if verbose:
+                print(',' if status == 'success' else 'x',  end = '', flush = True)
+            counts[status] += 1
+            if counts['success'] + counts['error'] >= no_of_cpu:
+                write_log()
+            if not isinstance(leases, type(None)):
+                batch_done(idx, status)
         
+        use_tmp = not isinstance(self.journal, type(None)) and 'path2file_local_processed' in workplan.columns
+        def task(i):
+            # rows are only made in the workers, from records that are cheap to pickle
+            time, values = workplan.record(i)
+            if use_tmp:
+                values['path2file_local_processed'] = _utils.part_path(values['path2file_local_processed']).as_posix()
+            return i, (time, values)
+        
+        # batch -> [lease, rows that did not report back yet, rows that failed]
+        held = {}
+        def lease_tasks():
+            # tasks of one batch after the other, a batch is only claimed when the workers need more rows
+            for lease in leases.claim(wait = False):
+                if isinstance(lease, type(None)):
+                    yield None
+                    continue
+                held[lease.batch] = [lease.start(), set(lease.rows), []]
+                for i in lease.rows:
+                    yield task(i)
+        
+        def batch_done(idx, status):
+            batch = idx // leases.batch_size
+            lease, outstanding, failed = held[batch]
+            outstanding.discard(idx)
+            if status != 'success':
+                failed.append(idx)
+            if len(outstanding) == 0:
+                del held[batch]
+                lease.done(failed = failed)
+                self.metrics.inc('batches', status = 'done')
+        
+        if isinstance(leases, type(None)):
+            tasks = _workplan.LazySequence(task, len(workplan))
         else:
-            if isinstance(mp.get_start_method(allow_none=True), type(None)):
-                mp.set_start_method('spawn')
-            else:
-                assert(mp.get_start_method() == 'spawn'), f'This should not be possible, we want to "spawn" new processes, not to "{mp.get_start_method()}" them.'
-
-            self.workplan['grp'] = range(self.workplan.shape[0])
-            self.workplan['grp'] +=1
-            #no_of_cpu = 3
-            self.workplan.grp /=no_of_cpu
-            self.workplan.grp = _np.ceil(self.workplan.grp)
-            
-            for idx, grp in self.workplan.groupby('grp'):
-                print('=', end = '', flush = True)
-                subproslist = []
-                
-                for grpidx, row in grp.iterrows():
-                    print(',',  end = '', flush = True)
-                    # print(f'row: {row}', flush = True)
-                    process = mp.Process(target=process_function, args = (row,), kwargs = args)
-                    process.start()
-                    subproslist.append(process)
-                [p.join() for p in subproslist]
-                
-                datetime = _pd.Timestamp.now()
-                run_status = 1
-                error = 0
-                success = no_of_cpu
-                warning = 0
-                if not isinstance(path2log, type(None)):
-                    with open(path2log, 'a') as log_out:
-                            log_out.write(f'{datetime},{run_status},{error},{success},{warning},{subprocess},{server},{comment}\n')
-                            
+            tasks = lease_tasks()
+        try:
+            results = _workers.run(process_function, tasks, args = args, 
+                                   make_row = _workplan.record2row,
+                                   no_of_workers = no_of_cpu, 
+                                   max_tasks_per_worker = max_tasks_per_worker,
+                                   max_rss_mb = max_worker_rss_mb,
+                                   raise_exception = raise_exception,
+                                   callback = callback, 
+                                   metrics = self.metrics)
+        finally:
+            # batches that were interrupted can be claimed again
+            for lease, outstanding, failed in held.values():
+                lease.release()
+        if counts['success'] + counts['error'] > 0:
+            write_log()
+        for aggregator in self._aggregators:
+            aggregator.flush()
+        
+        rows = sorted(results)
+        report = _pd.DataFrame([results[i] for i in rows], 
+                               columns = ['status', 'error', 'worker_pid', 'worker_rss', 'worker_rss_growth', 'seconds'], 
+                               index = workplan.index[rows])
+        if not isinstance(self.metrics.path2file, type(None)):
+            self.metrics.export()
         if verbose:
             print('Done')
-        return
-        #### todo: concatenate 
-        # if this is actually desired I would think this should be done seperately, not as part of this package
-        # try:
-        #     ds = _xr.open_mfdataset(p2flpgrp.path2file_tmp)
-
-        #     #### save final product
-        #     ds.to_netcdf(p2flp)
-        
-        #     #### remove all tmp files
-        #     if not keep_tmp_files:
-        #         for dt, row in p2flpgrp.iterrows():
-        #             try:
-        #                 row.path2file_tmp.unlink()
-        #             except FileNotFoundError:
-        #                 pass
-        # except:
-        #     print('something went wrong with the concatenation. The file will not be removed')
+        return report
         
+class BatchQuery(AwsQuery):
+    # state that is shared with (not copied to) the queries of the combinations
+    _shared_kwargs = ['path2index', 'index_ttl', 'path2journal', 'bbox', 'points', 'metrics']
+    
+    def __init__(self,
+                 satellites = ['16'],
+                 products = ['ABI-L2-AOD'],
+                 scan_sectors = ['C'],
+                 process = None,
+                 **kwargs):
+        """
+        Query several satellites, products, and scan sectors (all 
+        combinations) at once. All of them share one S3FileSystem (one 
+        connection pool), the hour folders of all combinations are listed
+        concurrently, and the result is a single workplan, sorted by time, 
+        with the additional columns satellite, product, and scan_sector. 
+        download, process, process_parallel, and watch work on this 
+        combined workplan, so files of all products are scheduled 
+        together.
+
+        Parameters
+        ----------
+        satellites : str or list of str, optional
+            E.g. ['16', '18']. The default is ['16'].
+        products : str or list of str, optional
+            Product names without the scan sector, e.g. 
+            ['ABI-L2-AOD', 'ABI-L2-ACM']. The default is ['ABI-L2-AOD'].
+        scan_sectors : str or list of str, optional
+            The default is ['C'].
+        process: dict, optional
+            Like in AwsQuery. The process function is applied to the rows 
+            of all products, it can tell them apart by the row entries 
+            satellite, product, and scan_sector. Processed files go into 
+            the subfolders noaa-goes<satellite>/<product><scan_sector> of 
+            path2processed, and are aggregated into the same subfolders of 
+            the path2stores of aggregate.
+        **kwargs
+            Passed to AwsQuery. They apply to all combinations, raw files of
+            all products go into path2folder_local (the file names are 
+            unique), or the cache.
+
+        Returns
+        -------
+        None.
+
+        """
+        if isinstance(satellites, str):
+            satellites = [satellites]
+        if isinstance(products, str):
+            products = [products]
+        if isinstance(scan_sectors, str):
+            scan_sectors = [scan_sectors]
+        self.satellites = list(satellites)
+        self.products = list(products)
+        self.scan_sectors = list(scan_sectors)
+        # the instance itself stands for the first combination, the queries for all of them
+        super().__init__(satellite = self.satellites[0], product = self.products[0], scan_sector = self.scan_sectors[0],
+                         process = process, **kwargs)
+        
+        self.queries = {}
+        for satellite in self.satellites:
+            for product in self.products:
+                for scan_sector in self.scan_sectors:
+                    process_combi = None
+                    if isinstance(process, dict):
+                        process_combi = dict(process)
+                        path2processed = _pl.Path(process['path2processed']).joinpath(f'noaa-goes{satellite}', f'{product}{scan_sector}')
+                        path2processed.mkdir(parents = True, exist_ok = True)
+                        process_combi['path2processed'] = path2processed
+                        if not isinstance(process.get('aggregate'), type(None)):
+                            subfolder = _pl.Path(f'noaa-goes{satellite}', f'{product}{scan_sector}')
+                            process_combi['aggregate'] = process['aggregate'].like(path2stores = process['aggregate'].path2stores.joinpath(subfolder))
+                    query = AwsQuery(satellite = satellite, product = product, scan_sector = scan_sector,
+                                     process = process_combi, 
+                                     **dict({k: v for k, v in kwargs.items() if k not in self._shared_kwargs}, verbose = False))
+                    # share the state that is not specific to the combination
+                    query.key_index = self.key_index
+                    query.journal = self.journal
+                    query.grid_window = self.grid_window
+                    query.metrics = self.metrics
+                    self.queries[(satellite, product, scan_sector)] = query
+    
+    def _combine_workplans(self, workplans):
+        """Concatenate the workplans of the combinations, sorted by time."""
+        parts = []
+        for (satellite, product, scan_sector), workplan in workplans.items():
+            workplan = workplan.copy()
+            workplan.insert(0, 'scan_sector', scan_sector)
+            workplan.insert(0, 'product', product)
+            workplan.insert(0, 'satellite', satellite)
+            parts.append(workplan)
+        return _pd.concat(parts).sort_index(kind = 'stable')
+    
+    def _make_workplan(self, paths = True):
+        """
+        The hour folders of all combinations that are not in the key index
+        are listed in one go, so they share max_listing_concurrency.
+        """
+        parts = {}
+        for key, query in self.queries.items():
+            query.start, query.end = self.start, self.end
+            hour_folders = query._get_hour_folders()
+            listings, missing = query._cached_listings(hour_folders)
+            parts[key] = (hour_folders, listings, missing)
+        missing = [folder for hour_folders, listings, missing in parts.values() for folder in missing]
+        new_listings = _list_hour_folders(self.aws, missing, max_concurrency = self.max_listing_concurrency, metrics = self.metrics)
+        workplans = {}
+        for key, query in self.queries.items():
+            listing = query._store_listing(*parts[key], new_listings)
+            workplans[key] = query._listing2workplan(listing, paths = paths)
+        return self._combine_workplans(workplans)
+    
+    def _poll(self, now, lookback, seen, keep_new = True):
+        """One poll of follow over all combinations with a single concurrent listing."""
+        self.start = now - lookback
+        self.end = now + _pd.Timedelta('1h')
+        hour_folders = {key: query._follow_folders(now, lookback) for key, query in self.queries.items()}
+        listings = _transfer.list_folders(self.aws, [folder for folders in hour_folders.values() for folder in folders],
+                                          max_concurrency = self.max_listing_concurrency, metrics = self.metrics)
+        workplans = {key: query._new_files2workplan(hour_folders[key], listings, seen.setdefault(key, {}), keep_new = keep_new) 
+                     for key, query in self.queries.items()}
+        return self._combine_workplans(workplans)
+    
+    @property
+    def _aggregators(self):
+        return [a for query in self.queries.values() for a in query._aggregators]
+    
+    def _aggregator(self, row):
+        return self.queries[(row['satellite'], row['product'], row['scan_sector'])]._process_aggregate
+    
+    def _make_aws(self):
+        aws = super()._make_aws()
+        for query in self.queries.values():
+            query.aws = aws
+        return aws
+    
+    def _recycle_aws(self):
+        super()._recycle_aws()
+        for query in self.queries.values():
+            query.aws = self._aws
+        return
+    
+    @property
+    def product_available_since(self):
+        """First day with data for each combination."""
+        product_folders = {key: query.product_folder for key, query in self.queries.items()}
+        first_days = _crawl_first_days(self.aws, list(product_folders.values()), layout = 'doy')
+        return _pd.Series({key: first_days[folder] for key, folder in product_folders.items()})
+    
+    
+class JpssQuery(AwsQuery):
+    # folder layout below the product folder: <year>/<month>/<day>
+    _layout = 'ymd'
+    _folder_span = _pd.Timedelta('1D')
+    _group_hours = False
+    
+    def __init__(self,
+                 path2folder_local = '/mnt/telg/tmp/aws_tmp/',
+                 satellite = 'NOAA20',
+                 sensor = 'VIIRS',
+                 product = 'VIIRS_JRR-AOD',
+                 start = '2023-02-05 00:00:00', 
+                 end = '2023-02-05 23:59:59',
+                 bbox = None,
+                 path2footprints = None,
+                 max_footprint_concurrency = 16,
+                 **kwargs,
+                ):
+        """
+        Search for granules of a polar orbiter (noaa-jpss bucket, e.g. 
+        VIIRS on NOAA20). Granules are selected by their start time (s part
+        of the file name) and, if bbox is given, by their footprint, so 
+        only granules that overlap the area of interest are downloaded or
+        processed. Otherwise this works like AwsQuery.
+
+        Parameters
+        ----------
+        path2folder_local : str, optional
+            The default is '/mnt/telg/tmp/aws_tmp/'.
+        satellite : str, optional
+            'SNPP', 'NOAA20', or 'NOAA21'. The default is 'NOAA20'.
+        sensor : str, optional
+            The default is 'VIIRS'.
+        product : str, optional
+            Product as in get_available_JPSS_products, the folder is 
+            noaa-jpss/<satellite>/<sensor>/<satellite>_<product>. The 
+            default is 'VIIRS_JRR-AOD'.
+        start : str, optional
+            The default is '2023-02-05 00:00:00'.
+        end : str, optional
+            The default is '2023-02-05 23:59:59'.
+        bbox : tuple, optional
+            (lon_min, lat_min, lon_max, lat_max) in degrees, lon_min > 
+            lon_max for a box across the antimeridian. Only granules whose
+            footprint overlaps the box are kept. Footprints are read 
+            remotely from the granule metadata (see footprint), granules 
+            whose footprint can not be read are kept. The default is None,
+            all granules.
+        path2footprints : str, optional
+            SQLite file in which footprints are kept (see 
+            footprint.FootprintIndex), so each granule is only read once, 
+            also between sessions and queries. The default is None, only
+            kept in memory.
+        max_footprint_concurrency : int, optional
+            Max number of footprints read at the same time. The default is
+            16.
+        **kwargs
+            Passed to AwsQuery (process, keep_files, path2index, ...). The
+            index keeps the listings of day folders.
+
+        Returns
+        -------
+        None.
+
+        """
+        super().__init__(path2folder_local = path2folder_local, satellite = satellite, product = product, scan_sector = '',
+                         start = start, end = end, **kwargs)
+        self.sensor = sensor
+        self.path2folder_aws = _pl.Path('noaa-jpss', satellite, sensor)
+        self.bbox = bbox
+        self.max_footprint_concurrency = max_footprint_concurrency
+        if isinstance(path2footprints, type(None)):
+            self.footprint_index = None
+        else:
+            self.footprint_index = _footprint.FootprintIndex(path2footprints)
+        self._footprints = _pd.DataFrame(columns = _footprint.columns, dtype = float)
+    
+    @property
+    def product_folder(self):
+        return self.path2folder_aws.joinpath(f'{self.satellite}_{self.product}').as_posix()
+    
+    def _get_hour_folders(self):
+        """
+        Folders on aws (one per day) that are touched by the time range.
+
+        Returns
+        -------
+        pandas.Series
+            Index is the start of each day, values are the folder paths 
+            (str).
+
+        """
+        days = self._hours().floor('D').unique()
+        product_folder = self.product_folder
+        folders = [f'{product_folder}/{d.year}/{d.month:02d}/{d.day:02d}' for d in days]
+        return _pd.Series(folders, index = days, dtype = object)
+    
+    @staticmethod
+    def _start_times(names):
+        return _granule_start_times(names)
+    
+    def footprints(self, keys):
+        """
+        Footprints of granules, from memory, the footprint index, or read 
+        from aws (in that order).
+
+        Parameters
+        ----------
+        keys : list-like of str
+            Keys on aws.
+
+        Returns
+        -------
+        pandas.DataFrame
+            See footprint.read_footprints.
+
+        """
+        keys = _pd.Index([_pl.Path(k).as_posix() for k in keys], dtype = object)
+        missing = keys[~keys.isin(self._footprints.index)]
+        if len(missing) > 0 and not isinstance(self.footprint_index, type(None)):
+            self._footprints = _pd.concat([self._footprints, self.footprint_index.get(missing)])
+            missing = keys[~keys.isin(self._footprints.index)]
+        if len(missing) > 0:
+            with self.metrics.timer('footprints_seconds'):
+                new = _footprint.read_footprints(self.aws, missing, max_concurrency = self.max_footprint_concurrency)
+            self.metrics.inc('footprints_read', len(missing))
+            if not isinstance(self.footprint_index, type(None)):
+                self.footprint_index.put(new)
+            # those that could not be read are tried again next time
+            self._footprints = _pd.concat([self._footprints, new.dropna()])
+            return _pd.concat([self._footprints, new[new.isna().any(axis = 1)]]).reindex(keys)
+        return self._footprints.reindex(keys)
+    
+    def _select_area(self, workplan):
+        """Keep only the granules whose footprint overlaps bbox."""
+        if isinstance(self.bbox, type(None)) or workplan.shape[0] == 0:
+            return workplan
+        footprints = self.footprints(workplan.path2file_aws)
+        return workplan[_footprint.intersects(footprints, self.bbox).values]
+    
+    
 def test(f1):
     def f(x):
         f1(x)
@@ -674,6 +2167,7 @@ def process_row(row):#, process_function = None):
         
         #### TODO memory leak ... i did not notice that the download is done separately here... maybe try out the cach purch only
         # self.aws.clear_instance_cache()     #-> not helping           
+        import s3fs as _s3fs
         aws = _s3fs.S3FileSystem(anon=True, skip_instance_cache=True) #- not helping
         aws.get(row.path2file_aws.as_posix(), row.path2file_local.as_posix())
         aws.close()
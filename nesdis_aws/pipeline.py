@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+Producer/consumer helpers to overlap fetching and processing of files.
+"""
+import threading as _threading
+
+
+def prefetch(items, fetch, no_of_slots, metrics = None, discard = None):
+    """
+    Run fetch on the items in background threads while the consumer works
+    on the items that are already fetched.
+
+    At most no_of_slots items are fetched or waiting to be consumed at any 
+    time. The slot of an item is only freed when the consumer asks for the
+    next item, so whatever the consumer does with an item (e.g. removing a 
+    file) happens before the slot is reused. If fetch downloads one file per
+    item this caps the number of raw files on disk to no_of_slots.
+    
+    Items are handed to the consumer in the order of items. Items that are
+    fetched before the ones ahead of them wait in a reorder buffer, which 
+    is bounded by the slots as well.
+
+    Parameters
+    ----------
+    items : iterable
+        Items to fetch, e.g. workplan rows. It is consumed lazily, one item
+        per free slot.
+    fetch : callable
+        Called with one item. Has to be thread safe.
+    no_of_slots : int
+        Max number of items fetched ahead. This is also the number of 
+        threads.
+    metrics : metrics.Metrics, optional
+        The number of fetched items waiting for the consumer is set as 
+        gauge queue_depth (queue prefetch). If it stays at 0 the consumer 
+        waits for fetching, if it stays at no_of_slots fetching waits for 
+        the consumer. The default is None.
+    discard : callable, optional
+        Called as discard(item, result of fetch) for items that were 
+        fetched but never handed to the consumer, because it stopped early
+        (e.g. an exception or close()). Fetches that are running at that 
+        point are waited for. Use it to remove the fetched files. The 
+        default is None.
+
+    Yields
+    ------
+    tuple
+        (item, result of fetch, exception or None) in the order of items.
+
+    """
+    assert(no_of_slots >= 1), 'no_of_slots has to be at least 1.'
+    slots = _threading.Semaphore(no_of_slots)
+    items = iter(items)
+    taking = _threading.Lock()
+    #### sequence number -> (item, result, error), guarded by ready
+    done = {}
+    ready = _threading.Condition()
+    stop = _threading.Event()
+    #### number of items taken so far and, once items is exhausted, the total
+    count = {'taken': 0, 'total': None}
+
+    def take():
+        with taking:
+            if not isinstance(count['total'], type(None)):
+                return None
+            try:
+                item = next(items)
+            except StopIteration:
+                with ready:
+                    count['total'] = count['taken']
+                    ready.notify_all()
+                return None
+            seq = count['taken']
+            count['taken'] += 1
+            return seq, item
+
+    def worker():
+        while not stop.is_set():
+            if not slots.acquire(timeout = 0.1):
+                continue
+            taken = take()
+            if isinstance(taken, type(None)):
+                slots.release()
+                return
+            seq, item = taken
+            try:
+                out = (item, fetch(item), None)
+            except Exception as e:
+                out = (item, None, e)
+            with ready:
+                done[seq] = out
+                ready.notify_all()
+
+    threads = [_threading.Thread(target = worker, daemon = True) for i in range(no_of_slots)]
+    for thread in threads:
+        thread.start()
+    try:
+        #### items are taken in order, so the next one to yield is always
+        #### fetching or done and the slots held by later items can not block it
+        seq = 0
+        while True:
+            with ready:
+                depth = len(done)
+                while seq not in done and (isinstance(count['total'], type(None)) or seq < count['total']):
+                    ready.wait()
+                if seq not in done:
+                    break
+                out = done.pop(seq)
+            if not isinstance(metrics, type(None)):
+                metrics.set('queue_depth', depth, queue = 'prefetch')
+            yield out
+            slots.release()
+            seq += 1
+    finally:
+        stop.set()
+        if not isinstance(discard, type(None)):
+            for thread in threads:
+                thread.join()
+            for item, result, error in done.values():
+                if isinstance(error, type(None)):
+                    discard(item, result)
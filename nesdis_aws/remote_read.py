@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+Read parts of NetCDF files on AWS without downloading the entire file.
+
+The file is opened remotely and xarray/h5netcdf only read the HDF5 metadata
+and the chunks of the requested variables. With s3fs every read is a ranged
+GET, so only a fraction of the object is transferred.
+
+xarray and h5netcdf are only needed when these functions are used.
+"""
+import time as _time
+import pathlib as _pl
+from nesdis_aws import utils as _utils
+
+# encoding entries that still make sense after variables were dropped or
+# the dataset was cut; chunksizes etc. of the original file might not
+_keep_encoding = ['dtype', '_FillValue', 'scale_factor', 'add_offset', 'units', 'calendar', 'zlib', 'complevel', 'shuffle']
+
+# these are needed to make sense of the ABI data and cost next to nothing
+_always_keep = ['goes_imager_projection', 't', 'time_bounds']
+
+
+def read_subset(fs, path2file_aws, variables = None, isel = None, block_size = 2**20):
+    """
+    Read a subset of a remote NetCDF file into memory.
+
+    Parameters
+    ----------
+    fs : fsspec filesystem, e.g. s3fs.S3FileSystem
+    path2file_aws : str or pathlib.Path
+    variables : list of str, optional
+        Data variables to read. Coordinates of these variables and the ABI
+        projection variable (goes_imager_projection) are read as well. The
+        default is None, all variables.
+    isel : dict or callable, optional
+        Passed to xarray.Dataset.isel before loading, e.g.
+        {'x': slice(100, 200), 'y': slice(50, 80)}. If callable, it is 
+        called with the (not yet loaded) dataset and has to return such a 
+        dict, e.g. fixed_grid.FixedGridWindow. The default is None.
+    block_size : int, optional
+        Size of the ranged reads in bytes. The default is 1 MiB.
+
+    Returns
+    -------
+    xarray.Dataset
+        Loaded into memory, the remote file is closed.
+
+    """
+    import xarray as _xr
+    with fs.open(_pl.Path(path2file_aws).as_posix(), 'rb', block_size = block_size, cache_type = 'blockcache') as fileobj:
+        with _xr.open_dataset(fileobj, engine = 'h5netcdf') as ds:
+            if not isinstance(variables, type(None)):
+                keep = list(variables) + [v for v in _always_keep if v in ds.variables and v not in variables]
+                ds = ds[keep]
+            if callable(isel):
+                isel = isel(ds)
+            if not isinstance(isel, type(None)):
+                ds = ds.isel(**{dim: idx for dim, idx in isel.items() if dim in ds.dims})
+            ds = ds.load()
+    for var in ds.variables.values():
+        var.encoding = {k: v for k, v in var.encoding.items() if k in _keep_encoding}
+    return ds
+
+
+def subset2netcdf(fs, path2file_aws, path2file_local, variables = None, isel = None, block_size = 2**20):
+    """
+    Read a subset of a remote NetCDF file (see read_subset) and save it
+    locally. The file is written to a temporary name first and renamed when
+    complete.
+
+    Returns
+    -------
+    size_bytes : int
+        Size of the written file.
+    seconds : float
+        Time it took.
+
+    """
+    start_time = _time.perf_counter()
+    path2file_local = _pl.Path(path2file_local)
+    ds = read_subset(fs, path2file_aws, variables = variables, isel = isel, block_size = block_size)
+    with _utils.atomic_path(path2file_local) as part:
+        ds.to_netcdf(part, engine = 'h5netcdf')
+    return path2file_local.stat().st_size, _time.perf_counter() - start_time
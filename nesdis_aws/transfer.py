@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""
+Concurrent listings and transfers from S3.
+
+The functions in here drive the async core of s3fs (the coroutine methods
+like _ls or _cat_file) directly, so many requests can be in flight at the 
+same time without needing a thread per request. Large objects are split into
+byte ranges which are fetched in parallel and written into place.
+"""
+import asyncio as _asyncio
+import time as _time
+import pathlib as _pl
+import pandas as _pd
+import fsspec.asyn as _fsasyn
+from nesdis_aws import utils as _utils
+
+
+def _byte_ranges(size, chunk_size):
+    if size == 0:
+        # nothing to request, a range request of an empty object fails
+        return []
+    if not chunk_size or size <= chunk_size:
+        return [(0, size)]
+    return [(start, min(start + chunk_size, size)) for start in range(0, size, chunk_size)]
+
+
+async def _download_one(fs, rpath, lpath, size, semaphore, chunk_size):
+    start_time = _time.perf_counter()
+    if size is None:
+        async with semaphore:
+            size = (await fs._info(rpath))['size']
+
+    _pl.Path(lpath).parent.mkdir(parents=True, exist_ok=True)
+    with _utils.atomic_path(lpath) as part:
+        # create (or truncate) the file so the chunks can be written at their offsets
+        with open(part, 'wb') as out:
+            out.truncate(size)
+
+        async def fetch(start, end):
+            async with semaphore:
+                data = await fs._cat_file(rpath, start=start, end=end)
+            with open(part, 'r+b') as out:
+                out.seek(start)
+                out.write(data)
+            return len(data)
+
+        received = await _asyncio.gather(*[fetch(s, e) for s, e in _byte_ranges(size, chunk_size)])
+        assert(sum(received) == size), f'Received {sum(received)} bytes but expected {size} for {rpath}.'
+    return size, _time.perf_counter() - start_time
+
+
+async def _download_many(fs, jobs, max_concurrency, chunk_size):
+    semaphore = _asyncio.Semaphore(max_concurrency)
+    # files in flight, so only that many part files exist at any time
+    files = _asyncio.Semaphore(max_concurrency)
+
+    async def run(job):
+        rpath, lpath, size = job
+        try:
+            async with files:
+                size, seconds = await _download_one(fs, rpath, lpath, size, semaphore, chunk_size)
+            return 'downloaded', size, seconds, None
+        except Exception as e:
+            return 'failed', size, float('nan'), repr(e)
+
+    return await _asyncio.gather(*[run(job) for job in jobs])
+
+
+def download_files(fs, path2files_aws, path2files_local, sizes = None,
+                   max_concurrency = 16, chunk_size = 32 * 2**20,
+                   overwrite = False, metrics = None):
+    """
+    Download many files concurrently.
+
+    Parameters
+    ----------
+    fs : s3fs.S3FileSystem
+        The filesystem to download from. It has to be an async fsspec
+        filesystem (s3fs is).
+    path2files_aws : iterable of str or pathlib.Path
+        Remote paths.
+    path2files_local : iterable of str or pathlib.Path
+        Local paths, same length as path2files_aws.
+    sizes : iterable of int, optional
+        Object sizes in bytes if already known (e.g. from a detailed
+        listing). If not given, one HEAD request is made per file.
+    max_concurrency : int, optional
+        Max number of requests in flight at any time. This counts byte
+        range requests, not files. It is also the max number of files in
+        flight, so there are never more partial files on disk. The 
+        default is 16.
+    chunk_size : int, optional
+        Objects larger than this are fetched in parallel byte ranges of this
+        size. None disables chunking. The default is 32 MiB.
+    overwrite : bool, optional
+        If False, files that already exist locally are skipped. The default
+        is False.
+    metrics : metrics.Metrics, optional
+        Records files, bytes, and seconds of the downloads (see 
+        record_downloads). The default is None.
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per file with the columns path2file_aws, path2file_local,
+        status ('downloaded', 'skipped', 'failed'), size_bytes, seconds,
+        bytes_per_sec, and error.
+
+    """
+    assert(getattr(fs, 'async_impl', False)), 'Concurrent downloads require an async filesystem like s3fs.'
+    assert(max_concurrency >= 1), 'max_concurrency has to be at least 1.'
+    path2files_aws = [_pl.Path(p).as_posix() for p in path2files_aws]
+    path2files_local = [_pl.Path(p) for p in path2files_local]
+    if isinstance(sizes, type(None)):
+        sizes = [None] * len(path2files_aws)
+    else:
+        sizes = [None if _pd.isna(s) else int(s) for s in sizes]
+    assert(len(path2files_aws) == len(path2files_local) == len(sizes)), 'Number of remote paths, local paths and sizes do not match.'
+
+    status = ['skipped'] * len(path2files_aws)
+    seconds = [float('nan')] * len(path2files_aws)
+    errors = [None] * len(path2files_aws)
+    todo = [i for i, p in enumerate(path2files_local) if overwrite or not p.is_file()]
+    jobs = [(path2files_aws[i], path2files_local[i], sizes[i]) for i in todo]
+    results = _fsasyn.sync(fs.loop, _download_many, fs, jobs, max_concurrency, chunk_size)
+    for i, (stat, size, secs, error) in zip(todo, results):
+        status[i], sizes[i], seconds[i], errors[i] = stat, size, secs, error
+
+    report = _pd.DataFrame({'path2file_aws': path2files_aws,
+                            'path2file_local': path2files_local,
+                            'status': status,
+                            'size_bytes': _pd.array(sizes, dtype='Int64'),
+                            'seconds': seconds,
+                            'error': errors})
+    report['bytes_per_sec'] = report.size_bytes.astype(float) / report.seconds
+    if not isinstance(metrics, type(None)):
+        record_downloads(metrics, report)
+    return report
+
+
+def record_downloads(metrics, report):
+    """
+    Add a download report (see download_files) to metrics: download_files
+    by status, and download_bytes and download_seconds of the downloaded 
+    files.
+    """
+    for status, count in report.status.value_counts().items():
+        metrics.inc('download_files', int(count), status = status)
+    downloaded = report[report.status == 'downloaded']
+    metrics.inc('download_bytes', int(downloaded.size_bytes.astype(float).sum()))
+    for seconds in downloaded.seconds:
+        metrics.observe('download_seconds', float(seconds))
+    return
+
+
+async def _list_many(fs, folders, max_concurrency, recursive, include_dirs = False, metrics = None):
+    semaphore = _asyncio.Semaphore(max_concurrency)
+
+    async def run(folder):
+        async with semaphore:
+            start_time = _time.perf_counter()
+            try:
+                if recursive:
+                    out = list((await fs._find(folder, detail=True)).values())
+                else:
+                    out = await fs._ls(folder, detail=True, refresh=True)
+            except FileNotFoundError:
+                out = []
+            if not isinstance(metrics, type(None)):
+                kind = 'recursive' if recursive else 'folder'
+                metrics.observe('list_seconds', _time.perf_counter() - start_time, kind = kind)
+                metrics.inc('list_requests', kind = kind)
+                metrics.inc('list_keys', len(out), kind = kind)
+        return [o for o in out if include_dirs or o['type'] == 'file']
+
+    return await _asyncio.gather(*[run(folder) for folder in folders])
+
+
+def list_folders(fs, folders, max_concurrency = 32, recursive = False, include_dirs = False,
+                 metrics = None):
+    """
+    List many folders concurrently.
+
+    Parameters
+    ----------
+    fs : s3fs.S3FileSystem
+        An async fsspec filesystem.
+    folders : iterable of str
+        Folders (prefixes) to list. Folders that do not exist are returned 
+        as empty.
+    max_concurrency : int, optional
+        Max number of listings in flight. The default is 32.
+    recursive : bool, optional
+        If True, everything below a folder is listed (no delimiter). This 
+        needs only one request per 1000 keys, regardless of the number of 
+        sub-folders. The default is False.
+    include_dirs : bool, optional
+        If True, sub-folders (type 'directory') are returned as well. The 
+        default is False.
+    metrics : metrics.Metrics, optional
+        Records the number and latency of the listing requests. A 
+        recursive listing of a large folder is one call to s3fs but can be
+        several requests to S3. The default is None.
+
+    Returns
+    -------
+    dict
+        Maps each folder to a list of info dicts (name, size, ETag, type,
+        ...) of the files in it.
+
+    """
+    assert(getattr(fs, 'async_impl', False)), 'Concurrent listing requires an async filesystem like s3fs.'
+    folders = list(folders)
+    results = _fsasyn.sync(fs.loop, _list_many, fs, folders, max_concurrency, recursive, include_dirs, metrics)
+    return dict(zip(folders, results))
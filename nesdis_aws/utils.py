@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+Small helpers that are shared by the modules of this package.
+"""
+import os as _os
+import socket as _socket
+import sqlite3 as _sqlite3
+import contextlib as _contextlib
+import pathlib as _pl
+
+
+def owner():
+    """<hostname>:<pid>, identifies this process in shared stores."""
+    return f'{_socket.gethostname()}:{_os.getpid()}'
+
+
+@_contextlib.contextmanager
+def connect(path2db, immediate = False):
+    """
+    Connection to a SQLite file that is shared between processes (WAL mode,
+    waits up to 60 s for locks). Everything in the with block is one
+    transaction, committed at the end (rolled back on an exception).
+
+    Parameters
+    ----------
+    path2db : str or pathlib.Path
+    immediate : bool, optional
+        Take the write lock before anything is read, so reading and writing
+        in the block are atomic. The default is False.
+
+    """
+    con = _sqlite3.connect(path2db, timeout = 60)
+    try:
+        con.execute('PRAGMA journal_mode=WAL')
+        with con:
+            if immediate:
+                con.execute('BEGIN IMMEDIATE')
+            yield con
+    finally:
+        con.close()
+
+
+def part_path(path2file):
+    """
+    Temporary name a file is written to before it is moved in place
+    (.<stem>.part<suffix>, the suffix is kept so writers that go by it
+    still work).
+    """
+    path2file = _pl.Path(path2file)
+    return path2file.parent.joinpath(f'.{path2file.stem}.part{path2file.suffix}')
+
+
+@_contextlib.contextmanager
+def atomic_path(path2file):
+    """
+    Yields the temporary name (see part_path) to write path2file to. When
+    the with block is done the file is moved in place (os.replace), if it
+    fails the temporary file is removed. Readers therefore never see a
+    partial file.
+    """
+    path2file = _pl.Path(path2file)
+    part = part_path(path2file)
+    try:
+        yield part
+        _os.replace(part, path2file)
+    except BaseException:
+        part.unlink(missing_ok = True)
+        raise
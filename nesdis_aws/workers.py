@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""
+A pool of long-lived worker processes that pull workplan rows from a shared
+queue.
+
+Unlike multiprocessing.Pool, workers can be recycled after a number of tasks
+(to contain memory leaks in the process functions), a worker that dies takes
+down only the row it was working on, and every row reports back whether it
+succeeded.
+"""
+import os as _os
+import time as _time
+import queue as _queue
+import traceback as _traceback
+import multiprocessing as _mp
+import collections.abc as _abc
+from nesdis_aws import memory as _memory
+
+
+def _worker(process_function, args, tasks, results, max_tasks, max_rss_mb, make_row = None):
+    pid = _os.getpid()
+    no_of_tasks = 0
+    while isinstance(max_tasks, type(None)) or no_of_tasks < max_tasks:
+        task = tasks.get()
+        if isinstance(task, type(None)):
+            results.put(('exit', pid, None, None, None))
+            return
+        idx, row = task
+        results.put(('start', pid, idx, None, None))
+        rss_before = _memory.rss()
+        start_time = _time.perf_counter()
+        try:
+            if not isinstance(make_row, type(None)):
+                row = make_row(row)
+            process_function(row, **args)
+            status, error = 'success', None
+        except Exception:
+            status, error = 'error', _traceback.format_exc()
+        seconds = _time.perf_counter() - start_time
+        rss_after = _memory.rss()
+        results.put((status, pid, idx, error, (rss_after, rss_after - rss_before, seconds)))
+        no_of_tasks += 1
+        if not isinstance(max_rss_mb, type(None)) and rss_after * 1e-6 > max_rss_mb:
+            break
+    results.put(('recycle', pid, None, None, None))
+
+
+def run(process_function, tasks, args = {}, no_of_workers = 2,
+        max_tasks_per_worker = None, max_rss_mb = None, 
+        raise_exception = False, callback = None, metrics = None, make_row = None):
+    """
+    Apply process_function to each task in spawned worker processes.
+
+    Parameters
+    ----------
+    process_function : callable
+        Called as process_function(row, **args). It has to be importable
+        (defined at module level) since workers are spawned.
+    tasks : sequence or iterable of tuple
+        (idx, row) pairs. idx is used to report back which task finished.
+        Tasks are only accessed as they are handed out, e.g. a 
+        workplan.LazySequence, or a generator that makes the tasks as they
+        are needed. A generator can yield None if it has no task right 
+        now, it is asked again shortly; all workers keep running until it
+        is exhausted.
+    args : dict, optional
+        Keyword arguments passed to process_function. The default is {}.
+    no_of_workers : int, optional
+        Number of worker processes. The default is 2.
+    max_tasks_per_worker : int, optional
+        Workers are replaced by a fresh process after this many tasks.
+        The default is None, workers live until all tasks are done.
+    max_rss_mb : float, optional
+        Workers whose resident memory (RSS) is above this after a task are
+        replaced by a fresh process. The default is None.
+    raise_exception : bool, optional
+        If True, all workers are terminated on the first error and a
+        RuntimeError with the traceback of the worker is raised. The
+        default is False.
+    callback : callable, optional
+        Called in the parent as callback(idx, status, error) after each
+        task, status is 'success' or 'error'.
+    metrics : metrics.Metrics, optional
+        Records process_seconds (by status), the number of busy workers
+        (workers_busy), and the number of tasks in the queue waiting for a
+        worker (queue_depth, queue workers). The default is None.
+    make_row : callable, optional
+        Called in the worker as make_row(row) to turn what was sent into
+        what process_function gets, e.g. workplan.record2row. The default
+        is None, the row as is.
+
+    Returns
+    -------
+    dict
+        Maps idx to (status, error, pid, rss, rss_growth, seconds). error is
+        the traceback of the worker or None. rss is the resident memory 
+        (bytes) of worker pid after the task, rss_growth how much it grew 
+        during the task, and seconds how long process_function took (None 
+        if the worker died).
+
+    """
+    ctx = _mp.get_context('spawn')
+    task_queue = ctx.Queue()
+    # messages a killed worker did not flush yet are covered by the check for lost tasks below
+    result_queue = ctx.Queue()
+    if isinstance(tasks, _abc.Sequence):
+        no_of_workers = max(1, min(no_of_workers, len(tasks)))
+    source = iter(tasks)
+    exhausted = False
+    out = {}
+    workers = {}
+    running = {}
+    # idx of the tasks handed out, so tasks are not accessed twice
+    fed = []
+    last_fed = _time.time()
+
+    def start_worker():
+        p = ctx.Process(target = _worker, args = (process_function, args, task_queue, result_queue, max_tasks_per_worker, max_rss_mb, make_row))
+        p.start()
+        workers[p.pid] = p
+
+    def feed():
+        # keep the queue short so rows are handed out as workers get free
+        nonlocal exhausted, last_fed
+        while not exhausted and len(fed) - len(out) < 2 * no_of_workers:
+            try:
+                task = next(source)
+            except StopIteration:
+                exhausted = True
+                break
+            if isinstance(task, type(None)):
+                # nothing to hand out right now
+                break
+            fed.append(task[0])
+            task_queue.put(task)
+            last_fed = _time.time()
+
+    def finish(idx, status, error, pid = None, memory = (None, None, None)):
+        out[idx] = (status, error, pid) + tuple(memory)
+        if not isinstance(metrics, type(None)) and not isinstance(memory[2], type(None)):
+            metrics.observe('process_seconds', memory[2], status = status)
+        if not isinstance(callback, type(None)):
+            callback(idx, status, error)
+        if status == 'error' and raise_exception:
+            raise RuntimeError(f'Processing of {idx} failed:\n{error}')
+
+    feed()
+    if exhausted and len(fed) == 0:
+        return out
+    for i in range(no_of_workers):
+        start_worker()
+
+    def tasks_left():
+        return not exhausted or len(out) + len(running) < len(fed)
+
+    dead = set()
+    # set when a worker died while not known to work on anything
+    lost_possible = False
+    last_check = last_message = _time.time()
+    try:
+        while not exhausted or len(out) < len(fed):
+            try:
+                message, pid, idx, error, memory = result_queue.get(timeout = 0.1)
+            except _queue.Empty:
+                message = None
+                feed()
+
+            if not isinstance(message, type(None)):
+                last_message = _time.time()
+            if message == 'start':
+                running[pid] = idx
+            elif message in ['success', 'error']:
+                running.pop(pid, None)
+                finish(idx, message, error, pid, memory)
+                feed()
+            elif message == 'recycle':
+                p = workers.pop(pid, None)
+                if not isinstance(p, type(None)):
+                    p.join()
+                    if tasks_left():
+                        start_worker()
+            if not isinstance(metrics, type(None)) and not isinstance(message, type(None)):
+                metrics.set('workers_busy', len(running))
+                metrics.set('queue_depth', len(fed) - len(out) - len(running), queue = 'workers')
+
+            if _time.time() - last_check > 1:
+                # check for workers that died without reporting back, e.g. killed
+                # by the OOM killer. A dead worker is only handled in the check
+                # after it was first seen dead, so all its messages are read by then.
+                last_check = _time.time()
+                for pid, p in list(workers.items()):
+                    if p.is_alive():
+                        continue
+                    if pid not in dead:
+                        dead.add(pid)
+                        continue
+                    p.join()
+                    workers.pop(pid)
+                    if pid in running:
+                        finish(running.pop(pid), 'error', f'worker died with exit code {p.exitcode}', pid)
+                        feed()
+                    else:
+                        lost_possible = True
+                    if tasks_left():
+                        start_worker()
+
+            if lost_possible and isinstance(message, type(None)) and len(running) == 0 and task_queue.empty() and _time.time() - max(last_message, last_fed) > 1:
+                # the handed out tasks are not in the queue and nobody works on anything, so 
+                # the remaining ones got lost with a worker that died before it could report
+                for idx in fed:
+                    if idx not in out:
+                        finish(idx, 'error', 'task got lost, the worker probably died')
+    except BaseException:
+        # e.g. raise_exception, an error in the callback, or KeyboardInterrupt; 
+        # workers would otherwise keep the interpreter from exiting
+        for p in workers.values():
+            p.terminate()
+        raise
+
+    for p in workers.values():
+        task_queue.put(None)
+    for p in workers.values():
+        p.join()
+    return out
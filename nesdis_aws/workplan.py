@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""
+Compact workplan for very long queries (e.g. multi-year meso backfills).
+
+The regular workplan (AwsQuery.workplan) holds a pathlib.Path object in each
+cell of the path columns, which costs several hundred bytes per cell. Here
+each path column is split into its folder, a categorical (there are only a
+few distinct folders), and the file name, an arrow backed string column.
+Names that are the same as the name on aws (the raw files) are only stored
+once. Scan starts are int64 (ns). Paths and rows are only built when they
+are needed, e.g. in the worker that processes a row.
+
+A CompactWorkplan can be saved to Parquet and loaded again (pyarrow
+required), so a workplan can be built once and shared between processes and
+hosts without listing the buckets again.
+"""
+import collections.abc as _abc
+import pathlib as _pl
+import pandas as _pd
+from nesdis_aws import utils as _utils
+
+
+def _string_dtype():
+    """Arrow backed strings if pyarrow is installed, objects otherwise."""
+    try:
+        import pyarrow
+    except ImportError:
+        return object
+    return 'string[pyarrow]'
+
+
+def _as_str(values):
+    return [v.as_posix() if isinstance(v, _pl.PurePath) else v for v in values]
+
+
+def _is_path_column(name):
+    return name.startswith('path2')
+
+
+def record2row(record):
+    """
+    Workplan row (pandas.Series with pathlib.Path objects, named by the scan
+    start, like the rows of DataFrame.iterrows) from a record (see
+    CompactWorkplan.record).
+    """
+    time, values = record
+    values = {c: _pl.Path(v) if _is_path_column(c) and isinstance(v, str) else v for c, v in values.items()}
+    return _pd.Series(values, name = _pd.Timestamp(time), dtype = object)
+
+
+class LazySequence(_abc.Sequence):
+    def __init__(self, get, length):
+        """Sequence whose items are made by get(i) when they are accessed."""
+        self._get = get
+        self._length = length
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._get(j) for j in range(*i.indices(self._length))]
+        if i < 0:
+            i += self._length
+        if not 0 <= i < self._length:
+            raise IndexError(i)
+        return self._get(i)
+
+
+class CompactWorkplan(object):
+    def __init__(self, table, paths):
+        """
+        Use from_frame or read_parquet.
+
+        Parameters
+        ----------
+        table : pandas.DataFrame
+            Column time (int64, ns), for each path column <column>_folder
+            (categorical, with the trailing /) and, unless the names are
+            those on aws, <column>_name, plus the other columns.
+        paths : list of str
+            Names of the path columns, in order.
+
+        """
+        self.table = table.reset_index(drop = True)
+        self.paths = list(paths)
+        self.columns = []
+        for c in self.table.columns:
+            if c.endswith('_folder') and c[:-len('_folder')] in self.paths:
+                self.columns.append(c[:-len('_folder')])
+            elif c != 'time' and not (c.endswith('_name') and c[:-len('_name')] in self.paths):
+                self.columns.append(c)
+        # plain arrays for fast access to single rows
+        self._folders = {c: (self.table[f'{c}_folder'].cat.codes.values, list(self.table[f'{c}_folder'].cat.categories))
+                         for c in self.paths}
+        self._names = {c: self.table[self._name_column(c)].array for c in self.paths}
+        self._times = self.table['time'].values
+        self._others = {c: self.table[c].array for c in self.columns if c not in self.paths}
+
+    def _name_column(self, column):
+        if f'{column}_name' in self.table.columns:
+            return f'{column}_name'
+        return 'path2file_aws_name'
+
+    @classmethod
+    def from_frame(cls, workplan):
+        """
+        Parameters
+        ----------
+        workplan : pandas.DataFrame
+            Workplan as returned by AwsQuery.workplan, the path columns can
+            hold pathlib.Path objects or str.
+        """
+        dtype = _string_dtype()
+        table = {'time': _pd.DatetimeIndex(workplan.index).as_unit('ns').asi8}
+        paths = [c for c in workplan.columns if _is_path_column(c)]
+        names_aws = None
+        for c in workplan.columns:
+            if not _is_path_column(c):
+                values = workplan[c]
+                if values.dtype == object:
+                    values = values.astype('category')
+                table[c] = values.values
+                continue
+            values = _pd.Series(_as_str(workplan[c]), dtype = object)
+            # rpartition of an empty Series has no columns
+            parts = values.str.rpartition('/') if len(values) > 0 else _pd.DataFrame({0: values, 1: values, 2: values})
+            table[f'{c}_folder'] = (parts[0] + parts[1]).astype('category').values
+            names = parts[2].astype(dtype)
+            if c == 'path2file_aws':
+                names_aws = names
+            elif not isinstance(names_aws, type(None)) and names.equals(names_aws):
+                continue
+            table[f'{c}_name'] = names.values
+        return cls(_pd.DataFrame(table), paths)
+
+    @classmethod
+    def read_parquet(cls, path2file):
+        """Load a workplan saved with to_parquet."""
+        table = _pd.read_parquet(path2file)
+        paths = [c[:-len('_folder')] for c in table.columns if c.endswith('_folder') and _is_path_column(c)]
+        dtype = _string_dtype()
+        for c in table.columns:
+            if c.endswith('_name') and c[:-len('_name')] in paths:
+                table[c] = table[c].astype(dtype)
+            elif c.endswith('_folder') and c[:-len('_folder')] in paths and not isinstance(table[c].dtype, _pd.CategoricalDtype):
+                # an empty categorical comes back as object
+                table[c] = table[c].astype('category')
+        return cls(table, paths)
+
+    def to_parquet(self, path2file):
+        """Save the workplan, written to a temporary name first."""
+        with _utils.atomic_path(path2file) as part:
+            self.table.to_parquet(part, index = False)
+        return
+
+    def __len__(self):
+        return self.table.shape[0]
+
+    @property
+    def shape(self):
+        return (len(self), len(self.columns))
+
+    @property
+    def index(self):
+        """Scan starts (pandas.DatetimeIndex)."""
+        return _pd.DatetimeIndex(self._times.astype('datetime64[ns]'))
+
+    def column(self, column):
+        """
+        One column as a pandas.Series of str (path columns) or the values,
+        e.g. column('path2file_aws') for the keys.
+        """
+        if column in self.paths:
+            values = self.table[f'{column}_folder'].astype(str) + self.table[self._name_column(column)].astype(str)
+        else:
+            values = self.table[column]
+        return _pd.Series(values.values, index = self.index, name = column)
+
+    def record(self, i):
+        """
+        Row i as (scan start in ns, dict), paths as str. Cheap to pickle,
+        see record2row.
+        """
+        values = {}
+        for c in self.columns:
+            if c in self.paths:
+                codes, folders = self._folders[c]
+                values[c] = folders[codes[i]] + self._names[c][i]
+            else:
+                values[c] = self._others[c][i]
+        return int(self._times[i]), values
+
+    def row(self, i):
+        """Row i like a row of the regular workplan (see record2row)."""
+        return record2row(self.record(i))
+
+    def iterrows(self):
+        """Like DataFrame.iterrows, the rows are made one at a time."""
+        for i in range(len(self)):
+            row = self.row(i)
+            yield row.name, row
+
+    def to_frame(self):
+        """The regular workplan, with pathlib.Path objects."""
+        workplan = _pd.DataFrame(index = self.index)
+        for c in self.columns:
+            if c in self.paths:
+                workplan[c] = [_pl.Path(p) for p in self.column(c)]
+            else:
+                values = self.table[c]
+                workplan[c] = values.astype(object).values if isinstance(values.dtype, _pd.CategoricalDtype) else values.values
+        return workplan
+
+    def memory_usage(self):
+        """Bytes."""
+        return int(self.table.memory_usage(deep = True).sum())
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Fixtures shared by the tests. The buckets are replaced by the offline
+stand-in of the benchmarks (benchmarks/standin.py), so no network is needed.
+"""
+import sys
+import pathlib
+import pytest
+
+path2repo = pathlib.Path(__file__).resolve().parents[1]
+sys.path[:0] = [path2repo.as_posix(), path2repo.joinpath('benchmarks').as_posix()]
+
+import nesdis_aws
+from standin import LocalS3, populate
+
+
+@pytest.fixture
+def path2root(tmp_path):
+    """Two hours of CONUS AOD of GOES-16 (24 files of 100 bytes)."""
+    root = tmp_path.joinpath('root')
+    populate(root.as_posix(), start = '2020-08-08', no_of_hours = 2, files_per_hour = 12, file_size = 100)
+    return root
+
+
+class Recorder(object):
+    def __init__(self):
+        """
+        Process function for AwsQuery.process. It records the rows it gets
+        (and, in memory mode, the content of fileobj), writes the processed
+        file, and raises a ValueError on the calls in fail_on (counted from
+        1). If journal is set, the state of each key at the time it is 
+        processed is recorded as well.
+        """
+        self.rows = []
+        self.contents = []
+        self.states = []
+        self.fail_on = []
+        self.journal = None
+
+    def __call__(self, row):
+        self.rows.append(row)
+        if 'fileobj' in row.index:
+            self.contents.append(row.fileobj.read())
+        if not isinstance(self.journal, type(None)):
+            self.states.append(self.journal.get_state(row.path2file_aws.as_posix()))
+        if len(self.rows) in self.fail_on:
+            raise ValueError('boom')
+        row.path2file_local_processed.write_text('x')
+
+    @property
+    def names(self):
+        """File names on aws of the rows, in the order they were processed."""
+        return [row.path2file_aws.name for row in self.rows]
+
+
+@pytest.fixture
+def recorder():
+    return Recorder()
+
+
+@pytest.fixture
+def make_query(tmp_path, path2root, recorder):
+    """
+    Makes AwsQuerys over the stand-in for the two hours in path2root. With
+    process = True the files are processed by recorder, into 
+    tmp_path/processed.
+    """
+    def make(process = False, **kwargs):
+        defaults = dict(path2folder_local = tmp_path.joinpath('local').as_posix(),
+                        start = '2020-08-08 00:00', end = '2020-08-08 01:59',
+                        aws = LocalS3(path2root.as_posix()))
+        if process:
+            path2processed = tmp_path.joinpath('processed')
+            path2processed.mkdir(exist_ok = True)
+            defaults['process'] = dict(function = recorder, path2processed = path2processed.as_posix(), prefix = 'p_')
+        return nesdis_aws.AwsQuery(**dict(defaults, **kwargs))
+    return make
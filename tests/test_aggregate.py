@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+import xarray as xr
+import h5netcdf
+import pytest
+from nesdis_aws import aggregate
+
+
+def scan(value):
+    return xr.Dataset({'aod': (('y', 'x'), np.full((2, 3), value, dtype = 'float32'))},
+                      coords = {'x': [0., 1., 2.], 'y': [1., 0.]})
+
+
+def times(*minutes):
+    return [pd.Timestamp('2020-08-08 00:00') + pd.Timedelta(minutes = m) for m in minutes]
+
+
+@pytest.fixture
+def aggregator(tmp_path):
+    return aggregate.Aggregator(tmp_path.joinpath('stores'), 'aod', buffer_size = 2)
+
+
+def test_append_and_dedupe(aggregator):
+    # two flushes: the second appends to the store of the first
+    for value, time in zip([0, 5, 10, 15], times(0, 5, 10, 15)):
+        aggregator.add(scan(value), time = time)
+    # late, and already stored
+    aggregator.add(scan(3), time = times(3)[0])
+    aggregator.add(scan(99), time = times(5)[0])
+    aggregator.flush()
+    path2store = aggregator.path(times(0)[0])
+    with h5netcdf.File(path2store, 'r') as f:
+        assert f.dimensions['time'].isunlimited() and f.dimensions['time'].size == 5
+    ds = aggregator.open(times(0)[0])
+    assert list(ds.time.values) == list(pd.to_datetime(times(0, 3, 5, 10, 15)))
+    assert list(ds.aod.isel(x = 0, y = 0).values) == [0, 3, 5, 10, 15]
+    assert list(ds.x.values) == [0, 1, 2]
+
+    # a restarted run does not duplicate anything
+    again = aggregator.like()
+    again.add(scan(99), time = times(10)[0])
+    again.add(scan(20), time = times(20)[0])
+    again.flush()
+    ds = again.open(times(0)[0])
+    assert list(ds.aod.isel(x = 0, y = 0).values) == [0, 3, 5, 10, 15, 20]
+
+
+def test_failed_append_leaves_store_as_it_was(aggregator, monkeypatch):
+    for value, time in zip([0, 5], times(0, 5)):
+        aggregator.add(scan(value), time = time)
+    path2store = aggregator.path(times(0)[0])
+    before = path2store.read_bytes()
+
+    resize = h5netcdf.File.resize_dimension
+    def crash(self, *args, **kwargs):
+        resize(self, *args, **kwargs)
+        raise RuntimeError('crash')
+    monkeypatch.setattr(h5netcdf.File, 'resize_dimension', crash)
+    aggregator.add(scan(10), time = times(10)[0])
+    with pytest.raises(RuntimeError):
+        aggregator.add(scan(15), time = times(15)[0])
+    assert path2store.read_bytes() == before
+    assert [p.name for p in path2store.parent.iterdir()] == [path2store.name]
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+import nesdis_aws
+from nesdis_aws import backends
+
+
+def test_query_lists_from_mirror(tmp_path, path2root):
+    # the mirror lacks two files, a listing from S3 would have them
+    for path in sorted(path2root.rglob('*.nc'))[:2]:
+        path.unlink()
+    tmp_path.joinpath('local').mkdir()
+    query = nesdis_aws.AwsQuery(path2folder_local = tmp_path.joinpath('local').as_posix(),
+                                start = '2020-08-08 00:00', end = '2020-08-08 00:59',
+                                path2mirror = path2root.as_posix(), mirror_listing = True)
+    assert query.workplan.shape[0] == 10
+    query.download()
+    assert len(list(tmp_path.joinpath('local').iterdir())) == 10
+    assert query.aws.hits[repr(query.aws.backends[0])] == 10
+
+
+def test_mirror_reads_ranges_like_fsspec(tmp_path):
+    tmp_path.joinpath('bucket').mkdir()
+    tmp_path.joinpath('bucket', 'key').write_bytes(bytes(range(100)))
+    fs = backends.MirrorFileSystem(tmp_path.as_posix())
+    data = bytes(range(100))
+    for start, end in [(None, None), (10, 20), (None, 5), (-10, None), (-10, -2), (5, -90), (-200, 3), (50, 10)]:
+        assert fs.cat_file('bucket/key', start = start, end = end) == data[start:end]
+
+
+class Broken(backends.Mirror):
+    """A mirror that fails with something else than a missing file, e.g. a stale NFS handle."""
+    def make_filesystem(self):
+        fs = backends.MirrorFileSystem(self.path2mirror)
+        async def fail(*args, **kwargs):
+            raise OSError(116, 'Stale file handle')
+        fs._cat_file = fs._info = fail
+        return fs
+
+    def __repr__(self):
+        return 'Broken()'
+
+
+def test_chain_falls_through_on_os_errors(path2root):
+    key = sorted(path2root.rglob('*.nc'))[0].relative_to(path2root).as_posix()
+    chain = backends.BackendChain([Broken(path2root.as_posix()), backends.Mirror(path2root.as_posix())])
+    assert len(chain.cat_file(key)) == 100
+    assert chain.info(key)['size'] == 100
+    assert list(chain.hits.values()) == [0, 1]
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import socket
+import subprocess
+import pytest
+from nesdis_aws import cache
+
+
+def key(i):
+    return f'noaa-goes16/ABI-L2-AODC/2020/221/00/OR_ABI-L2-AODC-M6_G16_s2020221000{i}000_e2020221000{i}000_c2020221000{i}000.nc'
+
+
+def download(path):
+    path.write_bytes(b'x' * 100)
+
+
+@pytest.fixture
+def raw_cache(tmp_path):
+    return cache.RawFileCache(tmp_path.joinpath('cache'), max_bytes = 300, min_free_fraction = 0,
+                              wait_timeout = 0, poll_interval = 0)
+
+
+def test_least_recently_used_is_evicted(raw_cache):
+    for i in range(3):
+        assert raw_cache.fetch(key(i), 100, download)
+        raw_cache.unpin(key(i))
+    assert not isinstance(raw_cache.get(key(0)), type(None))
+    assert raw_cache.fetch(key(3), 100, download)
+    assert raw_cache.keys() == {key(0), key(2), key(3)}
+    assert not raw_cache.path(key(1)).exists()
+    assert raw_cache.usage()['size_bytes'] == 300
+
+
+def test_oldest_scan_is_evicted(tmp_path):
+    raw_cache = cache.RawFileCache(tmp_path.joinpath('cache'), max_bytes = 300, policy = 'oldest_scan', min_free_fraction = 0)
+    for i in [2, 0, 1]:
+        raw_cache.fetch(key(i), 100, download)
+        raw_cache.unpin(key(i))
+    raw_cache.fetch(key(3), 100, download)
+    assert raw_cache.keys() == {key(1), key(2), key(3)}
+
+
+def test_pinned_files_are_not_evicted(raw_cache):
+    for i in range(3):
+        raw_cache.fetch(key(i), 100, download)
+    assert raw_cache.usage()['pinned'] == 3
+    with pytest.raises(TimeoutError):
+        raw_cache.fetch(key(3), 100, download)
+    # the failed reservation left nothing behind
+    assert raw_cache.usage()['reserved_bytes'] == 0
+    raw_cache.unpin(key(1))
+    assert raw_cache.fetch(key(3), 100, download)
+    assert raw_cache.keys() == {key(0), key(2), key(3)}
+
+
+def test_stale_reservation_is_dropped(raw_cache):
+    # a process on this host that is gone
+    dead = subprocess.Popen([sys.executable, '-c', 'pass'])
+    dead.wait()
+    other = cache.RawFileCache(raw_cache.path2cache, max_bytes = 300, min_free_fraction = 0)
+    other.owner = f'{socket.gethostname()}:{dead.pid}'
+    assert other.reserve(key(0), 100)
+    assert raw_cache.fetch(key(0), 100, download)
+    assert raw_cache.keys() == {key(0)}
+
+
+def test_reservation_of_live_process_is_kept(raw_cache):
+    other = cache.RawFileCache(raw_cache.path2cache, max_bytes = 300, min_free_fraction = 0)
+    # the parent of this process, it is alive
+    other.owner = f'{socket.gethostname()}:{os.getppid()}'
+    assert other.reserve(key(0), 100)
+    with pytest.raises(TimeoutError):
+        raw_cache.reserve(key(0), 100)
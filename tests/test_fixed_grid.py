@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import xarray as xr
+from nesdis_aws import fixed_grid
+
+# GOES-East projection as in the PUG Vol. 3, 4.2.8.1
+projection_attrs = dict(semi_major_axis = 6378137.0, semi_minor_axis = 6356752.31414,
+                        perspective_point_height = 35786023.0, longitude_of_projection_origin = -75.0)
+
+
+def dataset():
+    """Fixed grid with 1 mrad pixels, y descending like in the ABI files."""
+    x = np.arange(-0.1, 0.1, 0.001) + 0.0005
+    y = x[::-1]
+    return xr.Dataset({'goes_imager_projection': ((), 0, projection_attrs),
+                       'AOD': (('y', 'x'), np.zeros((y.size, x.size)))},
+                      coords = {'x': x, 'y': y}, attrs = dict(platform_ID = 'G16', scene_id = 'CONUS'))
+
+
+def test_latlon2xy_against_pug_example():
+    proj = fixed_grid.projection_parameters(dataset())
+    assert proj['H'] == 42164160.0
+    x, y = fixed_grid.latlon2xy(33.846162, -84.690932, proj)
+    np.testing.assert_allclose([x, y], [-0.024052, 0.095340], atol = 1e-6)
+
+
+def test_latlon2xy_not_visible():
+    proj = fixed_grid.projection_parameters(dataset())
+    x, y = fixed_grid.latlon2xy([0, 0], [-75, 100], proj)
+    np.testing.assert_allclose([x[0], y[0]], [0, 0], atol = 1e-12)
+    assert np.isnan(x[1]) and np.isnan(y[1])
+
+
+def test_nearest_index():
+    coord = np.array([0., 1., 2., 3.])
+    assert list(fixed_grid.nearest_index(coord, [-1, 0.4, 0.6, 2.9, 10])) == [0, 0, 1, 3, 3]
+    assert list(fixed_grid.nearest_index(coord[::-1], [-1, 0.4, 0.6, 2.9, 10])) == [3, 3, 2, 0, 0]
+
+
+def test_window_around_point(tmp_path):
+    ds = dataset()
+    window = fixed_grid.FixedGridWindow(points = [(33.846162, -84.690932)], margin = 1,
+                                        path2cache = tmp_path.joinpath('windows.json'))
+    isel = window(ds)
+    ix = fixed_grid.nearest_index(ds.x.values, -0.024052)
+    iy = fixed_grid.nearest_index(ds.y.values, 0.095340)
+    assert isel == {'x': slice(ix - 1, ix + 2), 'y': slice(iy - 1, iy + 2)}
+    # cached per grid, also for the next session
+    again = fixed_grid.FixedGridWindow(points = [(0, 0)], path2cache = tmp_path.joinpath('windows.json'))
+    assert again(ds) == isel
+
+
+def test_window_of_bbox():
+    ds = dataset()
+    isel = fixed_grid.FixedGridWindow(bbox = (-86, 33, -84, 35), margin = 0)(ds)
+    sub = ds.isel(**isel)
+    proj = fixed_grid.projection_parameters(ds)
+    for lat, lon in [(33, -86), (35, -84), (34, -85)]:
+        x, y = fixed_grid.latlon2xy(lat, lon, proj)
+        assert sub.x.min() - 0.0005 <= x <= sub.x.max() + 0.0005
+        assert sub.y.min() - 0.0005 <= y <= sub.y.max() + 0.0005
+
+
+def test_window_not_visible():
+    isel = fixed_grid.FixedGridWindow(bbox = (90, 0, 110, 10))(dataset())
+    assert isel == {'x': slice(0, 0), 'y': slice(0, 0)}
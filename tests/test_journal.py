@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from nesdis_aws import journal
+
+
+def test_resume_redoes_only_failed_files(tmp_path, make_query, recorder):
+    def make():
+        return make_query(process = True, start = '2020-08-08 00:00', end = '2020-08-08 00:29',
+                          path2journal = tmp_path.joinpath('journal.db'))
+    query = make()
+    assert query.workplan.shape[0] == 6
+    recorder.fail_on = [2]
+    query.process()
+    assert query.journal.summary() == {'processed': 5, 'failed': 1}
+    failed = recorder.names[1]
+    assert [k.rsplit('/', 1)[-1] for k in query.journal.errors()] == [failed]
+    # written to a temporary name, moved in place once the journal has it as processed
+    assert all('.part' in row.path2file_local_processed.name for row in recorder.rows)
+    assert len(list(tmp_path.joinpath('processed').iterdir())) == 5
+    assert not any('.part' in p.name for p in tmp_path.joinpath('processed').iterdir())
+
+    # a restarted run only gets the failed file
+    recorder.rows.clear()
+    query = make()
+    assert [p.name for p in query.workplan.path2file_aws] == [failed]
+    query.process()
+    assert recorder.names == [failed]
+    assert query.journal.summary() == {'processed': 6}
+
+
+def test_keys_in_state_of_given_keys(tmp_path):
+    j = journal.RunJournal(tmp_path.joinpath('journal.db'))
+    j.set_state([f'k{i}' for i in range(1000)], 'processed')
+    j.set_state(['k3', 'k4'], 'failed', errors = ['a', 'b'])
+    assert len(j.keys_in_state('processed')) == 998
+    assert j.keys_in_state('processed', keys = ['k2', 'k3', 'k999', 'other']) == {'k2', 'k999'}
+    assert j.keys_in_state(['failed', 'processed'], keys = ['k3', 'k5']) == {'k3', 'k5'}
+    assert j.keys_in_state('failed', keys = []) == set()
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+import time
+import pytest
+from nesdis_aws import lease
+
+
+def fail_at_ten_past(row):
+    """Process function for the workers, fails for the scans at hh:10."""
+    if row.name.minute == 10:
+        raise ValueError('boom')
+
+
+@pytest.fixture
+def path2leases(tmp_path):
+    return tmp_path.joinpath('leases')
+
+
+def store(path2leases, make_query, owner, **kwargs):
+    leases = lease.LeaseStore(path2leases, batch_size = 5, owner = owner, **kwargs)
+    leases.shared_workplan(lambda: make_query().compact_workplan)
+    return leases
+
+
+def claim_batch(leases, batch):
+    """Lease of the given batch, batches claimed on the way are released."""
+    for claimed in leases.claim():
+        if claimed.batch == batch:
+            return claimed
+        claimed.release()
+
+
+def test_two_holders_split_the_rows(path2leases, make_query):
+    holders = {owner: store(path2leases, make_query, owner, poll_interval = 0) for owner in ['a', 'b']}
+    claims = {owner: leases.claim(wait = False) for owner, leases in holders.items()}
+    rows = {owner: [] for owner in holders}
+    held = []
+    while len(claims) > 0:
+        for owner in list(claims):
+            claimed = next(claims[owner], 'exhausted')
+            if claimed == 'exhausted':
+                del claims[owner]
+            elif isinstance(claimed, type(None)):
+                # the other one holds the rest, finish what is held
+                for held_lease in held:
+                    held_lease.done()
+                held = []
+            else:
+                rows[owner] += list(claimed.rows)
+                held.append(claimed.start())
+    assert len(rows['a']) > 0 and len(rows['b']) > 0
+    assert set(rows['a']).isdisjoint(rows['b'])
+    assert sorted(rows['a'] + rows['b']) == list(range(24))
+    assert holders['a'].progress() == dict(no_of_batches = 5, done = 5, leased = 0, free = 0, failed = 0)
+
+
+def test_claims_start_at_random_batches_and_skip_done_ones(path2leases, make_query):
+    leases = store(path2leases, make_query, 'a')
+    firsts = set()
+    for i in range(20):
+        claims = leases.claim()
+        claimed = next(claims)
+        claims.close()
+        firsts.add(claimed.batch)
+        claimed.release()
+    assert len(firsts) > 1
+    for claimed in leases.claim():
+        claimed.done()
+    # batches known to be done are not looked up on the shared folder again
+    for path in path2leases.glob('batch_*.done'):
+        path.unlink()
+    assert list(leases.claim()) == []
+
+
+def test_expired_lease_is_taken_over(path2leases, make_query):
+    a = store(path2leases, make_query, 'a', lease_seconds = 0.5)
+    b = store(path2leases, make_query, 'b', lease_seconds = 0.5)
+    lease_a = next(a.claim())
+    # renewed by its heartbeat
+    lease_a.start()
+    time.sleep(1)
+    claims = b.claim()
+    assert lease_a.batch not in [next(claims).batch for i in range(4)]
+    claims.close()
+    # a died: no more renewals
+    lease_a._stop.set()
+    time.sleep(1)
+    lease_b = claim_batch(b, lease_a.batch)
+    assert lease_b.is_mine() and not lease_a.is_mine()
+    # a can not remove the lease of b anymore
+    lease_a.release()
+    assert lease_b.is_mine()
+    lease_b.done()
+    assert a.progress()['done'] == 1
+
+
+def test_process_parallel_records_failed_rows(path2leases, make_query):
+    # batch 1 is finished by another host before
+    other = store(path2leases, make_query, 'other')
+    claim_batch(other, 1).done()
+
+    query = make_query()
+    report = query.process_parallel(fail_at_ten_past, no_of_cpu = 2, path2leases = path2leases, 
+                                    batch_size = 5, poll_interval = 0.1, verbose = False)
+    assert report.shape[0] == 24 - 5
+    failed = report.index[report.status == 'error']
+    assert list(failed.strftime('%H:%M')) == ['00:10', '01:10']
+    assert other.progress() == dict(no_of_batches = 5, done = 5, leased = 0, free = 0, failed = 2)
+    assert list(query.compact_workplan.index[other.failed()]) == list(failed)
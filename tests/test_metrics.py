@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+from nesdis_aws import metrics
+
+
+def families(text):
+    """TYPE of each family and its samples, in the order of the text."""
+    out = {}
+    family = None
+    for line in text.splitlines():
+        if line.startswith('# TYPE '):
+            family, kind = line[len('# TYPE '):].split()
+            assert family not in out, f'{family} has more than one TYPE line'
+            out[family] = (kind, [])
+        else:
+            name = line.split('{')[0].split()[0]
+            assert name.startswith(family), f'{name} is written under {family}'
+            out[family][1].append(line)
+    return out
+
+
+def test_prometheus_families(tmp_path):
+    m = metrics.Metrics(prefix = 'test')
+    m.inc('download_files', status = 'success')
+    m.inc('download_files', status = 'error')
+    m.inc('download_files', status = 'success')
+    m.set('queue_depth', 3, queue = 'workers')
+    m.observe('process_seconds', 1, status = 'success')
+    m.observe('process_seconds', 3, status = 'success')
+    m.observe('list_seconds', 0.5)
+    out = families(m.to_prometheus())
+    assert out['test_download_files_total'] == ('counter', ['test_download_files_total{status="error"} 1',
+                                                            'test_download_files_total{status="success"} 2'])
+    assert out['test_queue_depth'] == ('gauge', ['test_queue_depth{queue="workers"} 3'])
+    assert out['test_process_seconds'] == ('summary', ['test_process_seconds_count{status="success"} 2',
+                                                       'test_process_seconds_sum{status="success"} 4'])
+    assert out['test_process_seconds_min'] == ('gauge', ['test_process_seconds_min{status="success"} 1'])
+    assert out['test_process_seconds_max'] == ('gauge', ['test_process_seconds_max{status="success"} 3'])
+    assert out['test_list_seconds'] == ('summary', ['test_list_seconds_count 1', 'test_list_seconds_sum 0.5'])
+
+    m.to_prometheus(tmp_path.joinpath('metrics.prom'))
+    assert tmp_path.joinpath('metrics.prom').read_text() == m.to_prometheus()
+    assert [p.name for p in tmp_path.iterdir()] == ['metrics.prom']
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+import time
+import pytest
+from nesdis_aws import pipeline
+
+
+def raw_files(tmp_path):
+    return [p for p in tmp_path.joinpath('local').rglob('*') if p.is_file()]
+
+
+@pytest.mark.parametrize('prefetch', [0, 4])
+def test_raw_files_are_removed_when_processing_stops(tmp_path, make_query, recorder, prefetch):
+    query = make_query(process = True)
+    recorder.fail_on = [3]
+    with pytest.raises(ValueError):
+        query.process(raise_exception = True, prefetch = prefetch)
+    assert len(recorder.rows) == 3
+    assert raw_files(tmp_path) == []
+
+
+def test_raw_files_are_kept_with_keep_files(tmp_path, make_query, recorder):
+    query = make_query(process = True, keep_files = True)
+    recorder.fail_on = [3]
+    with pytest.raises(ValueError):
+        query.process(raise_exception = True, prefetch = 4)
+    # the processed rows and the ones that were fetched ahead
+    assert len(raw_files(tmp_path)) >= 3
+
+
+def test_in_memory_reads_raw_files_on_disk(tmp_path, make_query, recorder):
+    query = make_query(process = True, start = '2020-08-08 00:00', end = '2020-08-08 00:14',
+                       path2journal = tmp_path.joinpath('journal.db'))
+    # the first file is on disk already, e.g. kept from an earlier run
+    row = query.workplan.iloc[0]
+    query._fetch_raw(row)
+    row.path2file_local.write_bytes(b'on disk')
+    assert query.aws.calls['get'] == 1
+    recorder.journal = query.journal
+    query.process(in_memory = True)
+    assert recorder.contents[0] == b'on disk' and len(recorder.contents) == 3
+    assert query.aws.calls['get'] == 3
+    # like on disk, the journal has the files as downloaded, then processed
+    assert recorder.states == ['downloaded'] * 3
+    assert query.journal.summary() == {'processed': 3}
+
+
+def test_prefetch_yields_in_input_order():
+    taken = []
+    def items():
+        for i in range(8):
+            taken.append(i)
+            yield i
+    def fetch(i):
+        # later items finish first
+        time.sleep(0.01 * (8 - i))
+        return i * 10
+    fetched = pipeline.prefetch(items(), fetch, 3)
+    first = next(fetched)
+    # the items are taken lazily, one per slot
+    assert first == (0, 0, None) and len(taken) <= 4
+    assert [item for item, result, error in fetched] == list(range(1, 8))
+
+
+def test_scans_are_processed_in_workplan_order(make_query, recorder):
+    query = make_query(process = True)
+    query.process(prefetch = 4)
+    assert recorder.names == [p.name for p in query.workplan.path2file_aws]
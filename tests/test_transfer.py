@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+import os
+import pytest
+from standin import LocalS3
+from nesdis_aws import transfer
+
+
+class WatchedS3(LocalS3):
+    def __init__(self, root, path2local, **kwargs):
+        """LocalS3 that counts the partial files in path2local at each request."""
+        super().__init__(root, **kwargs)
+        self.path2local = path2local
+        self.parts = []
+
+    async def _cat_file(self, path, start = None, end = None, **kwargs):
+        self.parts.append(len(list(self.path2local.glob('.*.part*'))))
+        return await super()._cat_file(path, start = start, end = end, **kwargs)
+
+
+@pytest.fixture
+def bucket(tmp_path):
+    """Files of 0, 1000, and 2500 random bytes in a stand-in bucket."""
+    root = tmp_path.joinpath('root')
+    root.joinpath('bucket').mkdir(parents = True)
+    content = {}
+    for size in [0, 1000, 2500]:
+        content[f'bucket/f{size}.nc'] = os.urandom(size)
+        root.joinpath(f'bucket/f{size}.nc').write_bytes(content[f'bucket/f{size}.nc'])
+    return root, content
+
+
+def download(tmp_path, fs, keys, **kwargs):
+    return transfer.download_files(fs, keys, [tmp_path.joinpath('local', k.split('/')[-1]) for k in keys], **kwargs)
+
+
+def test_byte_ranges():
+    assert transfer._byte_ranges(0, 300) == []
+    assert transfer._byte_ranges(100, 300) == [(0, 100)]
+    assert transfer._byte_ranges(1000, None) == [(0, 1000)]
+    assert transfer._byte_ranges(1000, 300) == [(0, 300), (300, 600), (600, 900), (900, 1000)]
+
+
+def test_chunks_are_reassembled(tmp_path, bucket):
+    root, content = bucket
+    fs = LocalS3(root.as_posix())
+    report = download(tmp_path, fs, ['bucket/f2500.nc'], sizes = [2500], chunk_size = 300)
+    assert list(report.status) == ['downloaded']
+    assert tmp_path.joinpath('local', 'f2500.nc').read_bytes() == content['bucket/f2500.nc']
+    assert fs.calls['get'] == 9
+    assert 'head' not in fs.calls
+
+
+def test_empty_file(tmp_path, bucket):
+    root, content = bucket
+    fs = LocalS3(root.as_posix())
+    report = download(tmp_path, fs, ['bucket/f0.nc'], sizes = [0], chunk_size = 300)
+    assert list(report.status) == ['downloaded'] and report.size_bytes.iloc[0] == 0
+    assert tmp_path.joinpath('local', 'f0.nc').read_bytes() == b''
+    assert 'get' not in fs.calls
+
+
+def test_unknown_size(tmp_path, bucket):
+    root, content = bucket
+    fs = LocalS3(root.as_posix())
+    keys = sorted(content)
+    report = download(tmp_path, fs, keys, chunk_size = 300)
+    assert list(report.status) == ['downloaded'] * 3
+    assert list(report.size_bytes) == [0, 1000, 2500]
+    assert fs.calls['head'] == 3
+    for key in keys:
+        assert tmp_path.joinpath('local', key.split('/')[-1]).read_bytes() == content[key]
+    assert [p.name for p in tmp_path.joinpath('local').iterdir() if '.part' in p.name] == []
+
+
+def test_size_mismatch_leaves_no_file(tmp_path, bucket):
+    root, content = bucket
+    report = download(tmp_path, LocalS3(root.as_posix()), ['bucket/f1000.nc'], sizes = [1200], chunk_size = 300)
+    assert list(report.status) == ['failed']
+    assert list(tmp_path.joinpath('local').iterdir()) == []
+
+
+def test_part_files_are_bounded_by_max_concurrency(tmp_path):
+    root = tmp_path.joinpath('root')
+    root.joinpath('bucket').mkdir(parents = True)
+    keys = [f'bucket/f{i}.nc' for i in range(20)]
+    for key in keys:
+        root.joinpath(key).write_bytes(os.urandom(1000))
+    tmp_path.joinpath('local').mkdir()
+    fs = WatchedS3(root.as_posix(), tmp_path.joinpath('local'), latency = 0.01)
+    report = download(tmp_path, fs, keys, sizes = [1000] * 20, max_concurrency = 2, chunk_size = 300)
+    assert (report.status == 'downloaded').all()
+    assert max(fs.parts) <= 2
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+import collections
+import pytest
+from nesdis_aws import workers
+
+
+def work(row):
+    """Process function for the workers: rows are ints, 3 kills its worker, 5 raises."""
+    time.sleep(0.01)
+    if row == 3:
+        os._exit(3)
+    if row == 5:
+        raise ValueError('boom')
+
+
+def tasks(n):
+    return [(i, i) for i in range(n)]
+
+
+def test_every_task_reports_back():
+    out = workers.run(work, tasks(8), no_of_workers = 2)
+    assert sorted(out) == list(range(8))
+    status = {idx: result[0] for idx, result in out.items()}
+    assert status == {**{i: 'success' for i in range(8)}, 3: 'error', 5: 'error'}
+    assert 'exit code 3' in out[3][1]
+    assert 'ValueError' in out[5][1]
+    # the killed worker was replaced, the rows after it were processed
+    assert out[3][2] not in [out[i][2] for i in range(4, 8) if i != 5]
+
+
+def test_workers_are_recycled_after_max_tasks():
+    out = workers.run(work, [(i, 0) for i in range(6)], no_of_workers = 1, max_tasks_per_worker = 2)
+    assert all(result[0] == 'success' for result in out.values())
+    tasks_per_pid = collections.Counter(result[2] for result in out.values())
+    assert len(tasks_per_pid) == 3 and set(tasks_per_pid.values()) == {2}
+
+
+def test_callback_and_raise_exception():
+    reported = []
+    with pytest.raises(RuntimeError, match = 'Processing of 5 failed'):
+        workers.run(work, [(i, i) for i in [0, 5, 1]], no_of_workers = 1, raise_exception = True,
+                    callback = lambda idx, status, error: reported.append((idx, status)))
+    assert reported[:2] == [(0, 'success'), (5, 'error')]
+
+
+def test_tasks_from_a_generator_that_waits():
+    def source():
+        for i in range(4):
+            # nothing to hand out for a moment
+            yield None
+            yield (i, 0)
+    out = workers.run(work, source(), no_of_workers = 2)
+    assert sorted(out) == list(range(4))
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+import pandas as pd
+from nesdis_aws import workplan
+
+
+def test_parquet_round_trip(tmp_path, make_query):
+    query = make_query(process = True)
+    regular = query.workplan
+    compact = query.compact_workplan
+    assert len(compact) == regular.shape[0] == 24
+    pd.testing.assert_frame_equal(compact.to_frame(), regular, check_dtype = False, check_freq = False)
+
+    compact.to_parquet(tmp_path.joinpath('workplan.parquet'))
+    loaded = workplan.CompactWorkplan.read_parquet(tmp_path.joinpath('workplan.parquet'))
+    assert loaded.columns == compact.columns
+    assert all(loaded.record(i) == compact.record(i) for i in range(len(compact)))
+    pd.testing.assert_frame_equal(loaded.to_frame(), compact.to_frame())
+    row = loaded.row(5)
+    assert row.name == regular.index[5]
+    assert row.path2file_local_processed == regular.path2file_local_processed.iloc[5]
+
+
+def test_parquet_round_trip_of_empty_workplan(tmp_path, make_query):
+    compact = make_query(start = '2020-08-09 00:00', end = '2020-08-09 01:00').compact_workplan
+    assert len(compact) == 0
+    compact.to_parquet(tmp_path.joinpath('workplan.parquet'))
+    loaded = workplan.CompactWorkplan.read_parquet(tmp_path.joinpath('workplan.parquet'))
+    assert len(loaded) == 0 and loaded.columns == compact.columns